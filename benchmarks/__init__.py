@@ -0,0 +1,14 @@
+"""
+:py:mod:`benchmarks`
+--------------------
+python-mcollective performance benchmarks.
+
+Benchmarks aren't part of the test suite, run them as scripts, e.g.::
+
+    python -m benchmarks.serializers
+
+or run them all, saving machine readable results, see
+:py:mod:`benchmarks.suite`::
+
+    python -m benchmarks --output results.json
+"""
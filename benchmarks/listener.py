@@ -0,0 +1,77 @@
+"""
+:py:mod:`benchmarks.listener`
+-----------------------------
+Measure reply listener throughput.
+
+Replies are fed straight into :py:class:`pymco.listener.ResponseListener`,
+as the connection receiver thread does, then decoded, so the cost of
+receiving replies is measured apart from decoding them.
+"""
+from __future__ import print_function
+import time
+
+from pymco import listener
+from pymco import server
+
+from . import security
+
+#: Number of replies fed into the listener.
+REPLIES = 5000
+
+
+def get_frames(config_, count):
+    """Encode ``discovery`` replies from ``count`` different nodes."""
+    server_security = config_.get_server_security()
+    request = {':requestid': '335a3e8261e4589499d366862b328816',
+               ':agent': 'discovery'}
+    return [server_security.encode(server.build_reply(
+        'node{0}'.format(index), request, 'pong', server_security))
+        for index in range(count)]
+
+
+def bench(provider, count):
+    """Time receiving and decoding ``count`` replies.
+
+    Returns:
+        ``results``: A dict with the average time, in microseconds, per
+        reply for each phase.
+    """
+    config_ = security.get_config(provider)
+    frames = get_frames(config_, count)
+    response_listener = listener.ResponseListener(config_, count=count)
+    # Load the security provider before timing.
+    provider_ = response_listener.security
+
+    start = time.time()
+    for frame in frames:
+        response_listener.on_message({}, frame)
+    receive = time.time() - start
+
+    start = time.time()
+    for reply in response_listener.consume():
+        provider_.verify(reply)
+        reply.load()
+    decode = time.time() - start
+
+    return {
+        'receive': receive / count * 1e6,
+        'decode': decode / count * 1e6,
+    }
+
+
+def run(count=REPLIES):
+    """Run the benchmark for every security provider."""
+    return dict((provider, bench(provider, count))
+                for provider in security.PROVIDERS)
+
+
+def main():
+    print('{0:<10}{1:>14}{2:>14}'.format('provider', 'receive us',
+                                         'decode us'))
+    for provider, result in sorted(run().items()):
+        print('{0:<10}{1:>14.2f}{2:>14.1f}'.format(
+            provider, result['receive'], result['decode']))
+
+
+if __name__ == '__main__':
+    main()
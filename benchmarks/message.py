@@ -0,0 +1,102 @@
+"""
+:py:mod:`benchmarks.message`
+----------------------------
+Compare creation, access and memory cost of message objects.
+"""
+from __future__ import print_function
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:  # Python < 3.4
+    tracemalloc = None
+
+from pymco import config
+from pymco import message
+
+CONFIGSTR = '''
+main_collective = mcollective
+identity = mco1
+securityprovider = none
+connector = activemq
+'''
+
+#: Number of objects kept alive when measuring memory.
+OBJECTS = 10000
+
+
+def get_factories():
+    """Callables building a new message from a body, by name."""
+    config_ = config.Config.from_configstr(CONFIGSTR)
+    filter_ = message.Filter().add_agent('discovery')
+
+    def plain(body):
+        return message.Message(body, 'discovery', config_, filter_)
+
+    def compact(body):
+        return message.CompactMessage(body, 'discovery', config_, filter_)
+
+    return {
+        'Message': plain,
+        'CompactMessage': compact,
+        'MessageTemplate': message.MessageTemplate('discovery',
+                                                   config_,
+                                                   filter_),
+        'CompactMessageTemplate': message.MessageTemplate(
+            'discovery', config_, filter_,
+            message_class=message.CompactMessage),
+    }
+
+
+def timed(fnc, number):
+    """Best average time, in microseconds, for calling fnc."""
+    return min(timeit.Timer(fnc).repeat(3, number)) / number * 1e6
+
+
+def memory(factory):
+    """Average bytes allocated per message, or ``None`` if unknown."""
+    if tracemalloc is None:
+        return None
+
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    messages = [factory('ping') for _ in range(OBJECTS)]
+    size = sum(stat.size_diff for stat in
+               tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    tracemalloc.stop()
+    del messages
+    return size / OBJECTS
+
+
+def run(number=10000):
+    """Run the benchmark for every message factory."""
+    results = {}
+    for name, factory in sorted(get_factories().items()):
+        msg = factory('ping')
+        results[name] = {
+            'create': timed(lambda: factory('ping'), number),
+            'getitem': timed(lambda: msg[':body'], number),
+            'to_dict': timed(msg.to_dict, number),
+            'bytes': memory(factory),
+        }
+        if isinstance(msg, message.CompactMessage):
+            results[name]['getattr'] = timed(lambda: msg.body, number)
+
+    return results
+
+
+def main():
+    print('{0:<24}{1:>12}{2:>12}{3:>12}{4:>12}{5:>10}'.format(
+        'class', 'create us', 'getitem us', 'getattr us', 'to_dict us',
+        'bytes'))
+    for name, result in sorted(run().items()):
+        print('{0:<24}{1:>12.2f}{2:>12.3f}{3:>12}{4:>12.3f}{5:>10}'.format(
+            name, result['create'], result['getitem'],
+            '{0:.3f}'.format(result['getattr']) if 'getattr' in result
+            else '-',
+            result['to_dict'],
+            '{0:.0f}'.format(result['bytes']) if result['bytes'] else '-'))
+
+
+if __name__ == '__main__':
+    main()
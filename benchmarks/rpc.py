@@ -0,0 +1,134 @@
+"""
+:py:mod:`benchmarks.rpc`
+------------------------
+Measure full RPC round trips against a local broker stand-in.
+
+Each run starts a :py:class:`pymco.test.broker.Broker` and a
+:py:class:`pymco.test.fleet.Fleet` of the given size answering ``discovery``
+pings with no latency, so the figures are the cost of the client, the
+broker stand-in and the fleet, all in the same process. Measured are:
+
+``call``
+    a :py:class:`pymco.rpc.SimpleAction` call, which connects, subscribes,
+    sends the request, waits for the first reply and disconnects.
+
+``fanin``
+    the time from sending a request on an open connection until every node
+    reply has been received.
+
+``fanin_per_reply``
+    the former divided by the fleet size.
+"""
+from __future__ import print_function
+import time
+
+from pymco import listener
+from pymco import message
+from pymco import rpc
+from pymco.test import broker as _broker
+from pymco.test import fleet as _fleet
+
+from . import security
+
+#: Default fleet sizes.
+SIZES = (10, 100, 1000)
+
+
+def wait_fleet(broker, fleet):
+    """Wait for the fleet to send every reply and drop unread ones, so they
+    don't leak into the next measure."""
+    fleet.wait(60)
+    broker.purge()
+
+
+def bench_call(config_, broker, fleet, number):
+    """Average time, in microseconds, for a SimpleAction call."""
+    elapsed = 0
+    # The first round is a warm up, not accounted.
+    for round_ in range(number + 1):
+        msg = message.Message(body='ping', agent='discovery', config=config_)
+        action = rpc.SimpleAction(config_, msg, 'discovery')
+        start = time.time()
+        action.call(timeout=30)
+        if round_:
+            elapsed += time.time() - start
+        wait_fleet(broker, fleet)
+
+    return elapsed / number * 1e6
+
+
+def bench_fanin(config_, broker, fleet, number):
+    """Average time, in microseconds, until every node has replied."""
+    connector = config_.get_connector()
+    connector.connect(wait=True)
+    reply_target = connector.get_reply_target(agent='discovery',
+                                              collective='mcollective')
+    target = connector.get_target(agent='discovery', collective='mcollective')
+    connector.subscribe(reply_target)
+    elapsed = 0
+    try:
+        for round_ in range(number + 1):
+            responses = listener.ResponseListener(config_, count=len(fleet),
+                                                  timeout=60)
+            connector.add_listener('fanin', responses)
+            msg = message.Message(body='ping', agent='discovery',
+                                  config=config_)
+            start = time.time()
+            connector.send(msg, target, **{'reply-to': reply_target})
+            responses.wait_on_message()
+            if round_:
+                elapsed += time.time() - start
+            replies = responses.consume()
+            if len(replies) != len(fleet):
+                raise RuntimeError('Got {0} replies out of {1}'.format(
+                    len(replies), len(fleet)))
+            wait_fleet(broker, fleet)
+    finally:
+        connector.disconnect()
+
+    return elapsed / number * 1e6
+
+
+def bench(provider, size, number):
+    """Run round trips against a fleet of the given size.
+
+    Returns:
+        ``results``: A dict with the average time, in microseconds, for each
+        measure.
+    """
+    broker = _broker.Broker().start()
+    config_ = broker.configure(security.get_config(provider))
+    fleet = _fleet.Fleet(broker, config_, size=size).start()
+    try:
+        fanin = bench_fanin(config_, broker, fleet, number)
+        return {
+            'call': bench_call(config_, broker, fleet, number),
+            'fanin': fanin,
+            'fanin_per_reply': fanin / size,
+        }
+    finally:
+        fleet.stop()
+        broker.stop()
+
+
+def run(sizes=SIZES, number=5):
+    """Run the benchmark for every security provider and fleet size."""
+    results = {}
+    for provider in security.PROVIDERS:
+        for size in sizes:
+            results[(provider, size)] = bench(provider, size, number)
+
+    return results
+
+
+def main():
+    print('{0:<10}{1:>8}{2:>14}{3:>14}{4:>20}'.format(
+        'provider', 'nodes', 'call us', 'fanin us', 'fanin/reply us'))
+    for (provider, size), result in sorted(run().items()):
+        print('{0:<10}{1:>8}{2:>14.0f}{3:>14.0f}{4:>20.1f}'.format(
+            provider, size, result['call'], result['fanin'],
+            result['fanin_per_reply']))
+
+
+if __name__ == '__main__':
+    main()
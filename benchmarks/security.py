@@ -0,0 +1,100 @@
+"""
+:py:mod:`benchmarks.security`
+-----------------------------
+Measure security providers encoding and decoding requests and replies.
+
+Client side costs are signing and serializing requests, then de-serializing
+and verifying replies; server side ones are the opposite. The SSL provider
+uses the test fixture keys.
+"""
+from __future__ import print_function
+import os
+import timeit
+
+from pymco import config
+from pymco import message
+from pymco.test import ctxt
+
+from . import serializers
+
+CONFIGSTR = '''
+main_collective = mcollective
+identity = mco1
+securityprovider = {provider}
+connector = activemq
+plugin.ssl_serializer = yaml
+plugin.ssl_server_public = {fixtures}/server-public.pem
+plugin.ssl_server_private = {fixtures}/server-private.pem
+plugin.ssl_client_public = {fixtures}/client-public.pem
+plugin.ssl_client_private = {fixtures}/client-private.pem
+plugin.ssl_client_cert_dir = {fixtures}
+'''
+
+PROVIDERS = ('none', 'ssl')
+
+
+def get_config(provider):
+    """Get a configuration using the given security provider."""
+    return config.Config.from_configstr(CONFIGSTR.format(
+        provider=provider,
+        fixtures=os.path.join(ctxt.ROOT, 'fixtures')))
+
+
+def timed(fnc, number):
+    """Best average time, in microseconds, for calling fnc."""
+    return min(timeit.Timer(fnc).repeat(3, number)) / number * 1e6
+
+
+def bench(provider, number):
+    """Time client and server side operations for the given provider.
+
+    Returns:
+        ``results``: A dict with the average time, in microseconds, for each
+        operation.
+    """
+    config_ = get_config(provider)
+    client, server = config_.get_security(), config_.get_server_security()
+    request = serializers.request()
+    reply = serializers.reply()
+    reply[':body'] = server.serialize_body(reply[':body'])
+    request_frame = client.encode(message.Message.from_dict(dict(request)))
+    reply_frame = server.encode(dict(reply))
+
+    def encode_request():
+        # Don't let the provider re-use the last signature.
+        client._last_hash = (None, None)
+        return client.encode(request)
+
+    def encode_reply():
+        server._last_hash = (None, None)
+        return server.encode(reply)
+
+    return {
+        'encode_request': timed(encode_request, number),
+        'decode_request': timed(lambda: server.decode(request_frame), number),
+        'encode_reply': timed(encode_reply, number),
+        'decode_reply': timed(lambda: client.decode(reply_frame), number),
+        'decode_reply_body': timed(
+            lambda: message.Reply(reply_frame, client).body, number),
+    }
+
+
+def run(number=100):
+    """Run the benchmark for every security provider."""
+    return dict((provider, bench(provider, number))
+                for provider in PROVIDERS)
+
+
+def main():
+    columns = ('encode_request', 'decode_request', 'encode_reply',
+               'decode_reply', 'decode_reply_body')
+    print('{0:<10}'.format('provider') +
+          ''.join('{0:>22}'.format(column + ' us') for column in columns))
+    for provider, result in sorted(run().items()):
+        print('{0:<10}'.format(provider) +
+              ''.join('{0:>22.1f}'.format(result[column])
+                      for column in columns))
+
+
+if __name__ == '__main__':
+    main()
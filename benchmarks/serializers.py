@@ -0,0 +1,109 @@
+"""
+:py:mod:`benchmarks.serializers`
+--------------------------------
+Compare available serializers on real MCollective envelopes.
+"""
+from __future__ import print_function
+import timeit
+
+from pymco import config
+from pymco import message
+from pymco.serializers import SerializerBase
+from pymco import utils
+
+CONFIGSTR = '''
+main_collective = mcollective
+identity = mco1
+securityprovider = none
+connector = activemq
+'''
+
+#: Number of facts in the inventory like reply.
+FACTS = 200
+
+
+def request():
+    """A ``discovery ping`` request as built by :py:class:`Message`."""
+    filter_ = message.Filter().add_agent('discovery').add_cfclass('apache')
+    return message.Message(body='ping',
+                           agent='discovery',
+                           filter_=filter_,
+                           config=config.Config.from_configstr(CONFIGSTR))
+
+
+def reply():
+    """An ``rpcutil inventory`` like reply, with a big facts hash."""
+    facts = dict(('fact_{0}'.format(index), 'value {0}'.format(index))
+                 for index in range(FACTS))
+    return {
+        ':senderid': 'node1.example.com',
+        ':requestid': '335a3e8261e4589499d366862b328816',
+        ':senderagent': 'rpcutil',
+        ':msgtime': 1384022186,
+        ':body': {
+            ':statusmsg': 'OK',
+            ':statuscode': 0,
+            ':data': {
+                ':agents': ['discovery', 'rpcutil', 'package', 'service'],
+                ':classes': ['common::linux', 'apache', 'mysql::server'],
+                ':collectives': ['mcollective'],
+                ':facts': facts,
+                ':main_collective': 'mcollective',
+                ':version': '2.4.1',
+            },
+        },
+    }
+
+
+def get_serializers():
+    """Instantiate every installed serializer plugin."""
+    serializers = {}
+    for name, import_path in sorted(SerializerBase.plugins.items()):
+        try:
+            serializers[name] = utils.import_object(import_path)
+        except ImportError:
+            print('Skipping {0}: not installed'.format(name))
+
+    return serializers
+
+
+def bench(serializer, envelope, number):
+    """Time serialization and de-serialization of the given envelope.
+
+    Returns:
+        ``results``: A dict with the serialized size, in bytes, and the
+        average time, in microseconds, for each operation.
+    """
+    payload = serializer.serialize(envelope)
+    serialize = timeit.Timer(lambda: serializer.serialize(envelope))
+    deserialize = timeit.Timer(lambda: serializer.deserialize(payload))
+    return {
+        'size': len(payload),
+        'serialize': min(serialize.repeat(3, number)) / number * 1e6,
+        'deserialize': min(deserialize.repeat(3, number)) / number * 1e6,
+    }
+
+
+def run(number=200):
+    """Run the benchmark for every serializer and envelope."""
+    results = {}
+    envelopes = (('request', request()), ('reply', reply()))
+    for name, serializer in sorted(get_serializers().items()):
+        for envelope_name, envelope in envelopes:
+            results[(name, envelope_name)] = bench(serializer, envelope,
+                                                   number)
+
+    return results
+
+
+def main():
+    print('{0:<10}{1:<10}{2:>10}{3:>16}{4:>16}'.format(
+        'plugin', 'envelope', 'bytes', 'serialize us', 'deserialize us'))
+    for (name, envelope), result in sorted(run().items()):
+        print('{0:<10}{1:<10}{2:>10}{3:>16.1f}{4:>16.1f}'.format(
+            name, envelope, result['size'], result['serialize'],
+            result['deserialize']))
+
+
+if __name__ == '__main__':
+    main()
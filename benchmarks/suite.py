@@ -0,0 +1,205 @@
+"""
+:py:mod:`benchmarks.suite`
+--------------------------
+Run benchmarks and save or compare machine readable results.
+
+Every benchmark module ``run`` function returns a dictionary keyed by what
+was measured, a name or a tuple of names, with dictionaries of metrics as
+values. Results are flattened into records with the suite, the name, the
+metric and its value, and saved as JSON together with information about the
+environment, so results from different runs can be compared::
+
+    python -m benchmarks --output baseline.json
+    python -m benchmarks --compare baseline.json --threshold 0.2
+
+Every metric is a time in microseconds or a size in bytes, so lower is
+always better. Comparisons exit with status 1 when any metric got worse
+than the threshold.
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+
+#: Benchmark suites: module import path and ``run`` arguments, for full and
+#: quick runs.
+SUITES = (
+    ('message', 'benchmarks.message', {}, {'number': 1000}),
+    ('serializers', 'benchmarks.serializers', {}, {'number': 20}),
+    ('security', 'benchmarks.security', {}, {'number': 10}),
+    ('listener', 'benchmarks.listener', {}, {'count': 500}),
+    ('rpc', 'benchmarks.rpc', {}, {'sizes': (10, 100), 'number': 2}),
+)
+
+#: Metrics measured in bytes, the rest are in microseconds.
+SIZE_METRICS = frozenset(('size', 'bytes'))
+
+FORMAT = 1
+
+
+def get_unit(metric):
+    """Get the unit for the given metric name."""
+    return 'bytes' if metric in SIZE_METRICS else 'us'
+
+
+def flatten(suite, results):
+    """Flatten the results from a benchmark module into records.
+
+    Params:
+        ``suite``: suite name.
+
+        ``results``: dictionary returned by a benchmark module ``run``.
+    Returns:
+        ``records``: list of dictionaries, sorted by name and metric.
+    """
+    records = []
+    for key, metrics in results.items():
+        if not isinstance(key, tuple):
+            key = (key,)
+        name = '.'.join(str(part) for part in key)
+        for metric, value in metrics.items():
+            if value is None:
+                continue
+            records.append({
+                'suite': suite,
+                'name': name,
+                'metric': metric,
+                'unit': get_unit(metric),
+                'value': value,
+            })
+
+    return sorted(records, key=lambda record: (record['name'],
+                                               record['metric']))
+
+
+def get_revision():
+    """Get the current git revision, or ``None`` if unknown."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                             stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.decode('ascii').strip()
+
+
+def get_metadata():
+    """Information about the environment the benchmarks run on."""
+    return {
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'revision': get_revision(),
+    }
+
+
+def run(suites=None, quick=False):
+    """Run the given benchmark suites, every suite by default.
+
+    Params:
+        ``suites``: iterable of suite names.
+
+        ``quick``: whether to run fewer iterations, for smoke testing.
+    Returns:
+        ``report``: dictionary with the ``format`` version, ``metadata`` and
+        ``results`` records, ready to be dumped as JSON.
+    """
+    records = []
+    for name, import_path, kwargs, quick_kwargs in SUITES:
+        if suites and name not in suites:
+            continue
+
+        module = importlib.import_module(import_path)
+        records.extend(flatten(name, module.run(**(quick_kwargs if quick
+                                                   else kwargs))))
+
+    return {'format': FORMAT, 'metadata': get_metadata(), 'results': records}
+
+
+def _index(report):
+    return dict(((record['suite'], record['name'], record['metric']),
+                 record['value'])
+                for record in report['results'])
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare two reports.
+
+    Params:
+        ``baseline``: report to compare with.
+
+        ``current``: new report.
+
+        ``threshold``: relative change over which a metric is a regression.
+    Returns:
+        ``comparison``: list of ``(key, baseline, current, change,
+        regression)`` tuples, for every metric found on both reports, where
+        ``key`` is a ``(suite, name, metric)`` tuple and ``change`` the
+        relative change.
+    """
+    old, new = _index(baseline), _index(current)
+    comparison = []
+    for key in sorted(set(old) & set(new)):
+        change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+        comparison.append((key, old[key], new[key], change,
+                           change > threshold))
+
+    return comparison
+
+
+def print_report(report):
+    for record in report['results']:
+        print('{0:<12}{1:<32}{2:<20}{3:>14.2f} {4}'.format(
+            record['suite'], record['name'], record['metric'],
+            record['value'], record['unit']))
+
+
+def print_comparison(comparison):
+    for (suite, name, metric), old, new, change, regression in comparison:
+        print('{0:<12}{1:<32}{2:<20}{3:>14.2f}{4:>14.2f}{5:>+9.1%}{6}'.format(
+            suite, name, metric, old, new, change,
+            '  REGRESSION' if regression else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Run python-mcollective benchmarks.')
+    parser.add_argument('suites', nargs='*',
+                        help='suites to run, every suite by default: ' +
+                        ', '.join(suite[0] for suite in SUITES))
+    parser.add_argument('--quick', action='store_true',
+                        help='run fewer iterations')
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change taken as a regression')
+    args = parser.parse_args(argv)
+
+    report = run(args.suites, args.quick)
+    if args.output:
+        with open(args.output, 'wt') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    if not args.compare:
+        print_report(report)
+        return 0
+
+    with open(args.compare, 'rt') as baseline_file:
+        baseline = json.load(baseline_file)
+    comparison = compare(baseline, report, args.threshold)
+    print_comparison(comparison)
+    return 1 if any(item[-1] for item in comparison) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+:py:mod:`pymco.compound`
+------------------------
+MCollective compound filter expressions support.
+
+Compound expressions combine fact comparisons and configuration management
+classes using ``and``, ``or``, ``not`` (or ``!``) and parentheses, e.g.::
+
+    ((country=uk and environment=staging) or environment=dev) and /apache/
+
+A statement including a comparison operator is a fact comparison, with
+``fact=/regex/`` meaning a regular expression match. Any other statement is a
+class, which may also be a ``/regex/``. Data plugin function statements are
+not supported.
+
+Expressions are parsed into the MCollective wire format, a callstack (list of
+one key dictionaries) sent into the ``compound`` filter, and compiled into
+Python callables, so the same expression can be sent to the servers or
+evaluated locally against known facts and classes::
+
+    expression = compound.parse('country=uk and /apache/')
+    filter_.add_compound(expression)
+    expression(facts={'country': 'uk'}, classes=['apache::mod'])
+
+As on MCollective servers, which evaluate the callstack as Ruby ``&&`` and
+``||``, ``and`` binds tighter than ``or``, both being evaluated from left to
+right, while ``not`` applies to the term after it.
+"""
+import re
+
+import six
+
+from . import exc
+
+#: Statement operators, longest first so ``>=`` isn't taken as ``>``.
+OPERATORS = ('>=', '<=', '=>', '=<', '!=', '==', '=~', '=', '<', '>')
+
+_OPERATOR_RE = re.compile('|'.join(re.escape(op) for op in OPERATORS))
+_INTEGER_RE = re.compile(r'^[0-9]+$')
+_FLOAT_RE = re.compile(r'^[0-9]+\.[0-9]+$')
+_ALIASES = {'=': '==', '=>': '>=', '=<': '<='}
+_COMPARISONS = {
+    '==': lambda fact, value: fact == value,
+    '!=': lambda fact, value: fact != value,
+    '>=': lambda fact, value: fact >= value,
+    '<=': lambda fact, value: fact <= value,
+    '>': lambda fact, value: fact > value,
+    '<': lambda fact, value: fact < value,
+}
+_KEYWORDS = {'and': 'and', 'or': 'or', 'not': 'not', '!': 'not'}
+
+
+def _is_regex(value):
+    return len(value) > 1 and value.startswith('/') and value.endswith('/')
+
+
+def _cast(fact, value):
+    """Cast fact and value to numbers when both look like numbers, the same
+    way MCollective does."""
+    if _INTEGER_RE.match(fact) and _INTEGER_RE.match(value):
+        return int(fact), int(value)
+    if _FLOAT_RE.match(fact) and _FLOAT_RE.match(value):
+        return float(fact), float(value)
+    return fact, value
+
+
+def compile_fact(fact, value, operator='=='):
+    """Compile a fact comparison.
+
+    Params:
+        ``fact``: fact name.
+
+        ``value``: value to compare the fact with, or a ``/regex/``.
+
+        ``operator``: any MCollective fact operator, ``=~`` for regular
+        expressions. Regular expression values always use ``=~``.
+    Returns:
+        ``matcher``: a callable taking a facts dictionary and returning
+        whether the fact matches.
+    Raises:
+        :py:exc:`pymco.exc.BadFilterExpression`: for unknown operators.
+    """
+    value = six.text_type(value)
+    operator = _ALIASES.get(operator or '==', operator or '==')
+    if operator == '=~' or _is_regex(value):
+        regex = re.compile(value[1:-1] if _is_regex(value) else value)
+
+        def match_regex(facts):
+            if fact not in facts:
+                return False
+            return regex.search(six.text_type(facts[fact])) is not None
+
+        return match_regex
+
+    if operator not in _COMPARISONS:
+        raise exc.BadFilterExpression(
+            'Unsupported operator {0}'.format(operator))
+
+    compare = _COMPARISONS[operator]
+
+    def match(facts):
+        if fact not in facts:
+            return False
+        return compare(*_cast(six.text_type(facts[fact]), value))
+
+    return match
+
+
+def compile_class(klass):
+    """Compile a configuration management class match.
+
+    Params:
+        ``klass``: class name or a ``/regex/``.
+    Returns:
+        ``matcher``: a callable taking an iterable of classes and returning
+        whether any of them matches.
+    """
+    if _is_regex(klass):
+        regex = re.compile(klass[1:-1])
+        return lambda classes: any(regex.search(item) for item in classes)
+
+    return lambda classes: klass in classes
+
+
+def compile_statement(statement):
+    """Compile a compound statement, either a fact comparison or a class.
+
+    Returns:
+        ``matcher``: a callable taking facts and classes and returning
+        whether they match the statement.
+    """
+    match = _OPERATOR_RE.search(statement)
+    if match is None or _is_regex(statement):
+        matcher = compile_class(statement)
+        return lambda facts, classes: matcher(classes)
+
+    fact, value = statement[:match.start()], statement[match.end():]
+    if not fact or not value:
+        raise exc.BadFilterExpression(
+            'Invalid statement {0}'.format(statement))
+
+    matcher = compile_fact(fact, value, match.group())
+    return lambda facts, classes: matcher(facts)
+
+
+def tokenize(expression):
+    """Split a compound expression into a callstack.
+
+    Returns:
+        ``callstack``: list of one key dictionaries, as MCollective expects
+        on the ``compound`` filter.
+    """
+    callstack = []
+    index, length = 0, len(expression)
+    while index < length:
+        char = expression[index]
+        if char.isspace():
+            index += 1
+        elif char in '()':
+            callstack.append({char: char})
+            index += 1
+        elif char == '!' and not expression.startswith('!=', index):
+            callstack.append({'not': 'not'})
+            index += 1
+        else:
+            start, in_regex = index, False
+            while index < length:
+                char = expression[index]
+                if in_regex:
+                    in_regex = char != '/'
+                elif char == '/' and (index == start or
+                                      expression[index - 1] in '=~<>'):
+                    in_regex = True
+                elif char.isspace() or char in '()':
+                    break
+                index += 1
+
+            if in_regex:
+                raise exc.BadFilterExpression(
+                    'Unterminated regex in {0}'.format(expression))
+
+            token = expression[start:index]
+            if token in _KEYWORDS:
+                callstack.append({_KEYWORDS[token]: _KEYWORDS[token]})
+            else:
+                callstack.append({'statement': token})
+
+    return callstack
+
+
+class _Parser(object):
+    """Recursive descent parser compiling a callstack into a callable."""
+    def __init__(self, callstack):
+        self.tokens = [next(six.iteritems(item)) for item in callstack]
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+
+    def pop(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def error(self, message):
+        return exc.BadFilterExpression(
+            '{0} at position {1}'.format(message, self.position))
+
+    def parse(self):
+        if not self.tokens:
+            raise self.error('Empty expression')
+
+        matcher = self.expression()
+        if self.peek() is not None:
+            raise self.error('Unexpected {0}'.format(self.peek()))
+
+        return matcher
+
+    def expression(self):
+        matcher = self.and_expression()
+        while self.peek() == 'or':
+            operator, _ = self.pop()
+            matcher = self.combine(operator, matcher, self.and_expression())
+
+        return matcher
+
+    def and_expression(self):
+        matcher = self.term()
+        while self.peek() == 'and':
+            operator, _ = self.pop()
+            matcher = self.combine(operator, matcher, self.term())
+
+        return matcher
+
+    @staticmethod
+    def combine(operator, left, right):
+        if operator == 'and':
+            return lambda facts, classes: (left(facts, classes) and
+                                           right(facts, classes))
+
+        return lambda facts, classes: (left(facts, classes) or
+                                       right(facts, classes))
+
+    def term(self):
+        kind = self.peek()
+        if kind == 'not':
+            self.pop()
+            matcher = self.term()
+            return lambda facts, classes: not matcher(facts, classes)
+        elif kind == '(':
+            self.pop()
+            matcher = self.expression()
+            if self.peek() != ')':
+                raise self.error('Missing )')
+            self.pop()
+            return matcher
+        elif kind == 'statement':
+            return compile_statement(self.pop()[1])
+        elif kind is None:
+            raise self.error('Unexpected end of expression')
+
+        raise self.error('Unexpected {0}'.format(kind))
+
+
+class Expression(object):
+    """Compiled compound expression.
+
+    Calling it with facts and classes returns whether they match the
+    expression. The MCollective wire format is available as
+    :py:attr:`callstack`.
+    """
+    def __init__(self, callstack):
+        self.callstack = callstack
+        self._matcher = _Parser(callstack).parse()
+
+    def __call__(self, facts, classes=()):
+        """Evaluate the expression.
+
+        Params:
+            ``facts``: dictionary of facts.
+
+            ``classes``: iterable of configuration management classes.
+        Returns:
+            ``result``: whether the expression matches.
+        """
+        return bool(self._matcher(facts, classes))
+
+    evaluate = __call__
+
+
+def parse(expression):
+    """Parse a compound filter expression.
+
+    Params:
+        ``expression``: compound expression string.
+    Returns:
+        ``expression``: an :py:class:`Expression` instance.
+    Raises:
+        :py:exc:`pymco.exc.BadFilterExpression`: on parse errors.
+    """
+    return Expression(tokenize(expression))
@@ -71,7 +71,18 @@ class Config(collections.Mapping):
             return bool(value)
 
     def get_connector(self):
-        """Get connector based on MCollective settings."""
+        """Get connector based on MCollective settings.
+
+        A :py:class:`pymco.connector.sharded.ShardedConnector` is returned
+        when the connector ``connections`` option is greater than 1.
+        """
+        connections = self.getint(
+            'plugin.{0}.connections'.format(self.config['connector']),
+            default=1)
+        if connections > 1:
+            from .connector import sharded
+            return sharded.ShardedConnector(self, connections=connections)
+
         import_path = Connector.plugins[self.config['connector']]
         return utils.import_object(import_path, config=self)
 
@@ -80,11 +91,28 @@ class Config(collections.Mapping):
         import_path = SecurityProvider.plugins[self.config['securityprovider']]
         return utils.import_object(import_path, config=self)
 
+    def get_server_security(self):
+        """Get server side security plugin based on MCollective settings."""
+        name = self.config['securityprovider']
+        import_path = SecurityProvider.server_plugins.get(
+            name, SecurityProvider.plugins[name])
+        return utils.import_object(import_path, config=self)
+
     def get_serializer(self, key):
         """Get serializer based on MCollective settings."""
         import_path = SerializerBase.plugins[self.config[key]]
         return utils.import_object(import_path)
 
+    def get_serializer_name(self):
+        """Get the name of the serializer used by the configured security
+        provider, without building the provider."""
+        option = SecurityProvider.serializer_options.get(
+            self.config['securityprovider'], None)
+        if option is None:
+            return 'yaml'
+
+        return self.config[option]
+
     def get_host_and_ports(self):
         """Get all hosts and port pairs for the current configuration.
 
@@ -6,12 +6,45 @@ python-mcollective connectors for MCollective.
 from __future__ import absolute_import
 
 import abc
-import itertools
+import logging
+import threading
+import time
+import timeit
 
+import six
+from six.moves import queue
 from stomp import connect
+from stomp import utils as stomp_utils
 
 from .. import exc
 from .. import listener
+from .. import metrics
+from .. import serializers
+from .. import tracing
+from .. import utils
+from . import selector as _selector
+from . import subscriptions as _subscriptions
+
+logger = logging.getLogger(__name__)
+
+# Result of connections completed after another broker won the race.
+_LOST = object()
+
+
+def _notify_send(transport, frame):
+    """Tell the transport listeners about a frame about to be sent, as
+    :py:meth:`stomp.transport.BaseTransport.transmit` does, for frames
+    written straight to the transport."""
+    for listener_ in list(transport.listeners.values()):
+        on_send = getattr(listener_, 'on_send', None)
+        if on_send is not None:
+            on_send(frame)
+
+
+def escape_header(value):
+    """Escape a STOMP 1.1 header name or value."""
+    return (six.text_type(value).replace('\\', '\\\\')
+            .replace('\n', '\\n').replace(':', '\\c'))
 
 
 class BaseConnector(object):
@@ -24,13 +57,25 @@ class BaseConnector(object):
         'stomp': 'pymco.connector.stomp.StompConnector',
     }
 
-    id_generator = itertools.count()
+    #: Bytes of coalesced frames written at once by :py:meth:`send_bulk`.
+    bulk_send_bytes = 1024 * 1024
+
+    #: Subscription header limiting unacknowledged messages the broker
+    #: pushes, ``None`` if the middleware has none.
+    prefetch_header = None
 
     def __init__(self, config, connection=None):
         self.config = config
         self._security = None
         self._started = False
-        self._id = None
+        self._selector = None
+        self._sent_at = None
+        self._response_listener = None
+        #: Subscriptions made through this connector, see
+        #: :py:class:`pymco.connector.subscriptions.SubscriptionManager`.
+        self.subscriptions = _subscriptions.SubscriptionManager()
+        # Brokers are only chosen by pymco for connections it builds.
+        self._select_brokers = connection is None
 
         if connection is None:
             self.connection = self.default_connection(config)
@@ -40,23 +85,246 @@ class BaseConnector(object):
         self.set_listeners()
         self.set_ssl()
 
+    @property
+    def selector(self):
+        """Broker selector for the configured pool, see
+        :py:mod:`pymco.connector.selector`."""
+        if not self._selector:
+            self._selector = _selector.get_selector(self.config)
+
+        return self._selector
+
+    @property
+    def selects_brokers(self):
+        """Whether this connector chooses brokers from a pool."""
+        return self._select_brokers and len(self.selector) > 1
+
     def connect(self, wait=None):
-        """Connect to MCollective middleware."""
-        if not self.connection.connected:
-            self.connection.start()
-            user, password = self.config.get_user_and_password(
-                self.get_current_host_and_port())
-            self.connection.connect(username=user,
-                                    passcode=password,
-                                    wait=wait)
+        """Connect to MCollective middleware.
+
+        Connectors built from a configuration with several brokers try them
+        in :py:attr:`selector` order, healthiest first, accounting for
+        connect times and errors.
+        """
+        if self.connection.is_connected():
+            return self
+
+        if self.selects_brokers:
+            return self.connect_selected(wait)
+
+        self.connection.start()
+        user, password = self.config.get_user_and_password(
+            self.get_current_host_and_port())
+        self.connection.connect(username=user,
+                                passcode=password,
+                                wait=wait)
+
+        return self
+
+    def connect_selected(self, wait=None):
+        """Connect to the healthiest broker in the pool.
+
+        Every round, brokers are tried in :py:attr:`selector` order, see
+        :py:meth:`connect_first`, sleeping between rounds as configured for
+        reconnections.
+
+        Raises:
+            :py:exc:`pymco.exc.ConnectError`: if the maximum number of
+            connection attempts was reached.
+        """
+        params = self.config.get_conn_params()
+        delay = params.get('reconnect_sleep_initial', 0.01)
+        max_delay = params.get('reconnect_sleep_max', 30.0)
+        max_attempts = params.get('reconnect_attempts_max', float('inf'))
+        stagger = self.config.getfloat(
+            'plugin.{0}.connect_stagger'.format(self.config['connector']),
+            default=0.005)
+        attempts = 0
+        while True:
+            hosts = self.selector.order()
+            remaining = max_attempts - attempts
+            if remaining < len(hosts):
+                hosts = hosts[:int(max(remaining, 1))]
+            connection, errors = self.connect_first(hosts, wait, stagger)
+            if connection is not None:
+                self.replace_connection(connection)
+                return self
+
+            attempts += len(errors)
+            if attempts >= max_attempts:
+                raise exc.ConnectError(
+                    'Unable to connect to any broker: {0}'.format(errors[-1]))
+
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def connect_first(self, hosts, wait=None, stagger=0.005):
+        """Connect to the first broker to complete the connection.
+
+        Brokers are tried in parallel, in the given order, each one
+        ``stagger`` seconds after the previous, or right away if the
+        previous one fails. The first connection established is kept, any
+        other one is closed as soon as it completes.
+
+        Params:
+            ``hosts``: list of ``(host, port)`` two-tuples.
+
+            ``wait``: whether to wait for the broker to acknowledge the
+            connection.
+
+            ``stagger``: seconds between broker attempts.
+        Returns:
+            ``result``: two-tuple with the connection, ``None`` if every
+            broker failed, and the list of errors.
+        """
+        results = queue.Queue()
+        state = {'winner': None}
+        lock = threading.Lock()
+        hosts = iter(hosts)
+
+        def attempt(host_and_port):
+            try:
+                connection = self.connect_broker(host_and_port, wait)
+            except Exception as error:
+                logger.warning('Unable to connect to %s: %s', host_and_port,
+                               error)
+                results.put((None, error))
+                return
+
+            with lock:
+                won = state['winner'] is None
+                if won:
+                    state['winner'] = connection
+            if won:
+                results.put((connection, None))
+            else:
+                self.close_connection(connection)
+                results.put((_LOST, None))
+
+        def launch():
+            host_and_port = next(hosts, None)
+            if host_and_port is None:
+                return 0
+            thread = threading.Thread(target=attempt, args=(host_and_port,),
+                                      name='pymco-connect')
+            thread.daemon = True
+            thread.start()
+            return 1
+
+        errors = []
+        pending = more = launch()
+        while pending:
+            try:
+                # Once every broker is being tried, just wait for results.
+                connection, error = results.get(
+                    timeout=stagger if more else None)
+            except queue.Empty:
+                more = launch()
+                pending += more
+                continue
+
+            pending -= 1
+            if connection is _LOST:
+                continue
+            if connection is not None:
+                return connection, errors
+            errors.append(error)
+            if more:
+                more = launch()
+                pending += more
+
+        return None, errors
+
+    def connect_broker(self, host_and_port, wait=None):
+        """Open a new connection to the given broker, accounting the
+        connect time or the error on :py:attr:`selector`.
+
+        Returns:
+            ``connection``: the new, connected, :py:class:`stomp.Connection`.
+        """
+        connection = self.default_connection(self.config,
+                                             host_and_ports=[host_and_port])
+        self.set_listeners(connection)
+        self.set_ssl(connection)
+        connected = listener.ConnectedListener()
+        connection.set_listener('connected', connected)
+        timeout = self.config.getfloat(
+            'plugin.{0}.connect_timeout'.format(self.config['connector']),
+            default=30.0)
+        start = timeit.default_timer()
+        try:
+            connection.start()
+            user, password = self.config.get_user_and_password(host_and_port)
+            connection.connect(username=user, passcode=password, wait=False)
+            if wait and not connected.wait(timeout):
+                raise exc.ConnectError(connected.error or
+                                       'Timed out waiting for CONNECTED')
+        except Exception:
+            self.selector.record_error(host_and_port)
+            self.close_connection(connection)
+            raise
+        finally:
+            connection.remove_listener('connected')
+
+        self.selector.record_connect(host_and_port,
+                                     timeit.default_timer() - start)
+        return connection
+
+    def reconnect(self, wait=True):
+        """Connect again once the connection was lost, subscribing again to
+        every destination subscribed to.
+
+        Connections built by the connector are closed and replaced by new
+        ones, keeping their listeners, since stomp.py connections don't
+        restart heart-beating once they time out.
+        """
+        if self._select_brokers:
+            self.close_connection(self.connection)
+            if not self.selects_brokers:
+                connection = self.default_connection(self.config)
+                self.set_ssl(connection)
+                self.replace_connection(connection)
+        if self._response_listener is not None:
+            self._response_listener.reset()
+
+        self.connect(wait=wait)
+        for subscription in self.subscriptions:
+            self.connection.subscribe(subscription.destination,
+                                      id=subscription.id,
+                                      **subscription.headers)
+
+        return self
 
+    def replace_connection(self, connection):
+        """Use the given connection from now on, keeping the listeners set
+        on the current one."""
+        for name, listener_ in list(self.connection.transport.listeners.items()):
+            if connection.get_listener(name) is None:
+                connection.set_listener(name, listener_)
+
+        self.connection = connection
         return self
 
+    @staticmethod
+    def close_connection(connection):
+        """Close a connection without waiting for the broker."""
+        try:
+            connection.transport.disconnect_socket()
+        except Exception:
+            logger.debug('Error closing connection', exc_info=True)
+        # stomp.py only stops heart-beating when notified of disconnections,
+        # which sockets closed on our side never are.
+        connection.running = False
+
     def disconnect(self):
-        """Disconnet from MCollective middleware."""
+        """Disconnet from MCollective middleware, which drops every
+        subscription."""
         if self.connection.is_connected():
             self.connection.disconnect()
 
+        self.subscriptions.clear()
+        if self._response_listener is not None:
+            self._response_listener.reset()
         return self
 
     def send(self, msg, destination, *args, **kwargs):
@@ -68,33 +336,212 @@ class BaseConnector(object):
         Returns:
             ``self``: so you can chain calls.
         """
-        self.connection.send(body=self.security.encode(msg),
-                             destination=destination,
-                             **kwargs)
+        headers = self.get_message_headers(msg)
+        headers.update(kwargs)
+        return self.send_encoded(self.security.encode(msg),
+                                 destination,
+                                 *args,
+                                 **headers)
+
+    def send_many(self, msg, destinations, *args, **kwargs):
+        """Send the same MCollective message to many destinations.
+
+        The message is signed and serialized just once, then the same payload
+        is published to every destination.
+
+        Args:
+            ``msg``: message to be sent.
+
+            ``destinations``: iterable of targets the message will be sent
+            to.
+
+        Returns:
+            ``self``: so you can chain calls.
+        """
+        body = self.security.encode(msg)
+        headers = self.get_message_headers(msg)
+        headers.update(kwargs)
+        return self.send_bulk(((body, destination)
+                               for destination in destinations), **headers)
+
+    def get_message_headers(self, msg):
+        """Get middleware specific headers for sending the given
+        MCollective message, such as its broker side expiry.
+
+        Connectors supporting message expiry should override this method,
+        so brokers drop requests nobody is waiting for anymore instead of
+        delivering them late.
+
+        Args:
+            ``msg``: message to be sent.
+
+        Returns:
+            ``headers``: new headers dictionary.
+        """
+        return {}
+
+    def get_send_headers(self, headers):
+        """Add middleware specific headers to those of a message being
+        sent.
+
+        Connectors adding headers should override this method, so they
+        apply to every send, including bulk ones.
+
+        Args:
+            ``headers``: message headers dictionary, which may be updated.
+
+        Returns:
+            ``headers``: headers to send the message with.
+        """
+        return headers
+
+    def send_encoded(self, body, destination, *args, **kwargs):
+        """Send an already encoded MCollective message.
+
+        Headers are completed by :py:meth:`get_send_headers`, which
+        connectors adding middleware specific headers should override.
+
+        Args:
+            ``body``: message, as returned by
+            :py:meth:`pymco.security.SecurityProvider.encode`.
+
+            ``destination``: target the message will be sent to.
+
+        Returns:
+            ``self``: so you can chain calls.
+        """
+        kwargs = self.get_send_headers(kwargs)
+        with tracing.span('connector.send', destination=destination) as span:
+            if span:
+                span.set('bytes', len(body))
+            self.connection.send(body=body, destination=destination, **kwargs)
+        self._sent_at = timeit.default_timer()
+        metrics.MESSAGES_SENT.inc()
         return self
 
+    def send_bulk(self, messages, receipt=None, timeout=30, **kwargs):
+        """Send many already encoded MCollective messages at once.
+
+        SEND frames for every message are coalesced in a buffer written to
+        the connection socket in one go, up to :py:attr:`bulk_send_bytes`
+        at a time, rather than one write per message. Connection listeners
+        are still told about every frame through ``on_send``, before it is
+        written, as they are for frames sent by the connection itself.
+
+        Args:
+            ``messages``: iterable of ``(body, destination)`` two-tuples.
+
+            ``receipt``: receipt id to ask the broker for on the last frame,
+            waiting for it when given.
+
+            ``timeout``: how long to wait for the receipt, in seconds.
+
+            ``kwargs``: headers for every message.
+
+        Returns:
+            ``self``: so you can chain calls.
+
+        Raises:
+            :py:exc:`pymco.exc.TimeoutError`: if the receipt wasn't received
+            in time.
+        """
+        headers = dict((key, value) for key, value in
+                       six.iteritems(self.get_send_headers(kwargs))
+                       if value is not None)
+        messages = list(messages)
+        waiter = None
+        if receipt is not None and messages:
+            waiter = listener.ReceiptListener(receipt)
+            self.connection.set_listener('receipt_listener', waiter)
+
+        try:
+            self._send_frames(messages, headers, waiter)
+            if waiter is not None and not waiter.wait(timeout):
+                raise exc.TimeoutError(
+                    'Timed out waiting for receipt {0}'.format(receipt))
+        finally:
+            if waiter is not None:
+                self.connection.remove_listener('receipt_listener')
+
+        return self
+
+    def _send_frames(self, messages, headers, waiter):
+        transport = self.connection.transport
+        with tracing.span('connector.send_bulk',
+                          messages=len(messages)) as span:
+            buffer, size, sent = [], 0, 0
+            last, encoded = None, None
+            for index, (body, destination) in enumerate(messages, 1):
+                # Messages sent to many destinations share the body.
+                if body is not last:
+                    last = body
+                    encoded = (body.encode('utf-8')
+                               if isinstance(body, six.text_type) else body)
+                frame = stomp_utils.Frame(
+                    'SEND', dict(headers, destination=destination), encoded)
+                if waiter is not None and index == len(messages):
+                    frame.headers['receipt'] = waiter.receipt
+                _notify_send(transport, frame)
+                lines = u''.join(
+                    u'{0}:{1}\n'.format(escape_header(key), escape_header(value))
+                    for key, value in sorted(frame.headers.items()))
+                head = u'SEND\n{0}content-length:{1}\n\n'.format(
+                    lines, len(frame.body)).encode('utf-8')
+                buffer.extend((head, frame.body, b'\x00'))
+                size += len(head) + len(frame.body) + 1
+                if size >= self.bulk_send_bytes:
+                    transport.send(b''.join(buffer))
+                    sent += size
+                    buffer, size = [], 0
+            if buffer:
+                transport.send(b''.join(buffer))
+                sent += size
+            span.set('bytes', sent)
+
+        self._sent_at = timeit.default_timer()
+        metrics.MESSAGES_SENT.inc(len(messages))
+
     def subscribe(self, destination, id=None, *args, **kwargs):
         """Subscribe to MCollective queue.
 
+        Subscriptions are shared: subscribing again to a destination just
+        accounts a new user, see :py:meth:`unsubscribe`.
+
         Args:
             ``destination``: Target to subscribe.
 
+            ``id``: subscription id, by default a new one unique for the
+            connector.
+
             ``args``: extra positional arguments.
 
             ``kwargs``: extra keyword arguments.
 
         Returns:
             ``self``: so you can chain calls.
+
+        Raises:
+            :py:exc:`ValueError`: if the destination is already subscribed
+            with other headers.
         """
-        if not id:
-            id = self.id
+        subscription, new = self.subscriptions.acquire(destination, id,
+                                                       kwargs)
+        if new:
+            try:
+                self.connection.subscribe(destination, id=subscription.id,
+                                          **kwargs)
+            except Exception:
+                self.subscriptions.release(destination)
+                raise
 
-        self.connection.subscribe(destination, id=id)
         return self
 
     def unsubscribe(self, destination, *args, **kwargs):
         """Unsubscribe to MCollective queue.
 
+        The subscription is only dropped once every user subscribing to the
+        destination unsubscribes.
+
         Args:
             ``destination``: Target to unsubscribe.
 
@@ -105,9 +552,78 @@ class BaseConnector(object):
         Returns:
             ``self``: so you can chain calls.
         """
+        subscription = self.subscriptions.get(destination)
+        # Replies nobody took would be delivered again when subscribing
+        # again, so they are acknowledged and dropped while it's possible.
+        if (subscription is not None and subscription.users == 1 and
+                self._response_listener is not None):
+            self._response_listener.consume(destination)
+
+        subscription = self.subscriptions.release(destination)
+        if subscription is not None and self.connection.is_connected():
+            self.connection.unsubscribe(id=subscription.id, **kwargs)
+
+        return self
+
+    @property
+    def reply_prefetch(self):
+        """Replies the broker may push before they're acknowledged, from the
+        connector ``reply_prefetch`` option, 0 for no limit."""
+        return self.config.getint(
+            'plugin.{0}.reply_prefetch'.format(self.config['connector']),
+            default=0)
+
+    def get_reply_subscription_headers(self):
+        """Get the headers for reply subscriptions.
+
+        When the connector ``reply_prefetch`` option is set and the
+        middleware supports it, replies are subscribed with
+        ``client-individual`` acknowledgement and a prefetch window of that
+        many replies, for instance for ActiveMQ::
+
+            plugin.activemq.reply_prefetch = 100
+
+        Replies are only acknowledged once :py:meth:`receive` returns them,
+        see :py:class:`pymco.listener.ResponseListener`, so brokers stop
+        pushing them when consumers fall behind, keeping memory bounded and
+        handing replies to other consumers sharing the queue.
+
+        Returns:
+            ``headers``: dict of subscription headers.
+        """
+        prefetch = self.reply_prefetch
+        if prefetch <= 0 or self.prefetch_header is None:
+            return {}
+
+        return {'ack': 'client-individual',
+                self.prefetch_header: str(prefetch)}
+
+    def ack_message(self, headers):
+        """Acknowledge the received message with the given headers, if its
+        subscription needs it."""
+        subscription = self.subscriptions.find(headers.get('subscription'))
+        if subscription is not None and subscription.acked:
+            self.connection.ack(headers['message-id'],
+                                headers['subscription'])
+
+    def get_response_listener(self):
+        """Get the listener buffering replies for :py:meth:`receive`,
+        setting it on the connection the first time, so replies arriving
+        before waiting for them are kept."""
+        if self._response_listener is None:
+            self._response_listener = listener.SingleResponseListener(
+                config=self.config, ack=self.ack_message)
+            self.connection.set_listener('response_listener',
+                                         self._response_listener)
+
+        return self._response_listener
 
     def receive(self, timeout, *args, **kwargs):
-        """Subscribe to MCollective topic queue and wait for just one message.
+        """Wait for replies, returning as soon as one is received.
+
+        Replies are taken from the response listener, see
+        :py:meth:`get_response_listener`, and acknowledged, so brokers
+        holding back replies beyond their prefetch window deliver more.
 
         Args:
             ``timeout``: how long we should wait for the message.
@@ -117,26 +633,51 @@ class BaseConnector(object):
             ``kwargs``: extra keyword arguments.
 
         Returns:
-            ``message``: received message.
+            ``replies``: list of the received replies.
 
-        Raises: :py:exc:`pymco.exc.TimeoutError`
-        """
-        response_listener = listener.SingleResponseListener(timeout=timeout,
-                                                            config=self.config)
-        self.connection.set_listener('response_listener', response_listener)
-        response_listener.wait_on_message()
+        Raises:
+            :py:exc:`pymco.exc.TimeoutError`: if no message was received.
 
-        if len(response_listener.responses) == 0:
+            :py:exc:`pymco.exc.ConnectionLostError`: if the connection was
+            lost before receiving any message.
+        """
+        response_listener = self.get_response_listener()
+        with tracing.span('connector.receive', timeout=timeout) as span:
+            response_listener.wait_on_message(timeout)
+            replies = response_listener.consume()
+            span.set('replies', len(replies))
+
+        if len(replies) == 0:
+            if response_listener.lost:
+                if self.selects_brokers:
+                    self.selector.record_error(
+                        self.get_current_host_and_port())
+                self.close_connection(self.connection)
+                raise exc.ConnectionLostError(
+                    'Connection lost waiting for replies')
             raise exc.TimeoutError
 
-        return response_listener.responses
+        if self.selects_brokers and self._sent_at is not None:
+            received_at = replies[0].received_at
+            if received_at is not None:
+                self.selector.record_latency(self.get_current_host_and_port(),
+                                             received_at - self._sent_at)
 
-    @property
-    def id(self):
-        if not self._id:
-            self._id = next(self.id_generator)
+        return replies
+
+    def get_direct_subscription(self, collective, identity=None):
+        """Get the subscription for direct requests to a node.
 
-        return self._id
+        Params:
+            ``collective``: MCollective collective.
+
+            ``identity``: node identity, the configured one by default.
+        Returns:
+            ``subscription``: two-tuple with the destination and a dict of
+            subscription headers, or ``None`` if the middleware doesn't
+            support direct addressing.
+        """
+        return None
 
     @property
     def security(self):
@@ -146,11 +687,32 @@ class BaseConnector(object):
 
         return self._security
 
-    def set_listeners(self):
-        """Set default listeners."""
+    def add_listener(self, name, listener_):
+        """Set a listener for every message the connector receives.
+
+        Args:
+            ``name``: listener name, replacing any listener with the same
+            name.
+
+            ``listener_``: :py:class:`stomp.listener.ConnectionListener`
+            instance.
+
+        Returns:
+            ``self``: so you can chain calls.
+        """
+        self.connection.set_listener(name, listener_)
+        return self
+
+    def is_connected(self):
+        """Whether the connector is connected to the middleware."""
+        return self.connection.is_connected()
+
+    def set_listeners(self, connection=None):
+        """Set default listeners, on the current connection by default."""
+        connection = connection or self.connection
         for key, value in self.listeners.items():
-            self.connection.set_listener(key, value(config=self.config,
-                                                    connector=self))
+            connection.set_listener(key, value(config=self.config,
+                                               connector=self))
 
     def get_current_host_and_port(self):
         """Get the current host and port from the tracker listener.
@@ -162,18 +724,50 @@ class BaseConnector(object):
         tracker = self.connection.get_listener('tracker')
         return tracker.get_host(), tracker.get_port()
 
-    def set_ssl(self):
-        """Set the SSL configuration for the current connection."""
+    def set_ssl(self, connection=None):
+        """Set the SSL configuration, for the current connection by
+        default."""
+        connection = connection or self.connection
         for params in self.config.get_ssl_params():
-            self.connection.transport.set_ssl(**params)
+            connection.transport.set_ssl(**params)
 
     @classmethod
-    def default_connection(cls, config):
-        """Creates a :py:class:`stomp.Connection` object with defaults"""
+    def default_connection(cls, config, host_and_ports=None):
+        """Creates a :py:class:`stomp.Connection` object with defaults
+
+        STOMP 1.1 heart-beats are negotiated when the connector
+        ``heartbeat_interval`` option is set, in seconds, for instance for
+        ActiveMQ::
+
+            plugin.activemq.heartbeat_interval = 30
+
+        Brokers not sending heart-beats for one and a half intervals are
+        taken for dead and the connection is dropped, see
+        :py:meth:`reconnect`.
+
+        Args:
+            ``host_and_ports``: brokers to connect to, instead of the
+            configured pool. Such connections try every broker just once.
+        """
         params = config.get_conn_params()
+        if host_and_ports is not None:
+            params['host_and_ports'] = host_and_ports
+            params['reconnect_attempts_max'] = 1
         if config['connector'] == 'rabbitmq':
             params['vhost'] = config['plugin.rabbitmq.vhost']
 
+        interval = config.getfloat(
+            'plugin.{0}.heartbeat_interval'.format(config['connector']),
+            default=0)
+        if interval > 0:
+            params['heartbeats'] = (int(interval * 1000),) * 2
+
+        # Binary serializers, such as msgpack, can't be decoded as text.
+        serializer = utils.import_class(
+            serializers.SerializerBase.plugins[config.get_serializer_name()])
+        if serializer.binary:
+            params['auto_decode'] = False
+
         return connect.StompConnection11(**params)
 
 
@@ -10,15 +10,31 @@ from . import Connector
 
 class ActiveMQConnector(Connector):
     """ActiveMQ middleware specific connector."""
-    def send(self, msg, destination, *args, **kwargs):
-        """Re-implement :py:meth:`pymco.connector.Connector.send`
+    prefetch_header = 'activemq.prefetchSize'
 
-        This implementation adds extra features for ActiveMQ.
+    def get_send_headers(self, headers):
+        """Re-implement :py:meth:`pymco.connector.Connector.get_send_headers`
+
+        This implementation adds extra features for ActiveMQ: the configured
+        priority, unless given for the message.
         """
         if 'plugin.activemq.priority' in self.config:
-            kwargs['priority'] = self.config['plugin.activemq.priority']
+            headers.setdefault('priority',
+                               self.config['plugin.activemq.priority'])
+
+        return headers
+
+    def get_message_headers(self, msg):
+        """Re-implement :py:meth:`pymco.connector.Connector.get_message_headers`
+
+        Messages expire, in milliseconds since the epoch, once their TTL
+        elapses from their creation time.
+        """
+        msgtime, ttl = msg.get(':msgtime', None), msg.get(':ttl', None)
+        if msgtime is None or ttl is None:
+            return {}
 
-        super(ActiveMQConnector, self).send(msg, destination, *args, **kwargs)
+        return {'expires': int((msgtime + ttl) * 1000)}
 
     def get_target(self, agent, collective):
         """Implement :py:meth:`pymco.connector.Connector.get_target`"""
@@ -34,3 +50,13 @@ class ActiveMQConnector(Connector):
             identity=self.config['identity'],
             pid=os.getpid(),
         )
+
+    def get_direct_subscription(self, collective, identity=None):
+        """Re-implement :py:meth:`pymco.connector.Connector.get_direct_subscription`
+
+        ActiveMQ direct requests go to a per collective queue, using a
+        selector on the node identity.
+        """
+        return ('/queue/{collective}.nodes'.format(collective=collective),
+                {'selector': "mc_identity = '{0}'".format(
+                    identity or self.config['identity'])})
@@ -8,6 +8,18 @@ from . import Connector
 
 class RabbitMQConnector(Connector):
     """RabbitMQ middleware specific connector."""
+    prefetch_header = 'prefetch-count'
+
+    def get_message_headers(self, msg):
+        """Re-implement :py:meth:`pymco.connector.Connector.get_message_headers`
+
+        Messages expire once their TTL, in milliseconds, elapses in the queue.
+        """
+        ttl = msg.get(':ttl', None)
+        if ttl is None:
+            return {}
+
+        return {'expiration': str(int(ttl * 1000))}
 
     def get_target(self, agent, collective):
         """Implement :py:meth:`pymco.connector.Connector.get_target`"""
@@ -22,3 +34,10 @@ class RabbitMQConnector(Connector):
             agent=agent,
             collective=collective,
         )
+
+    def get_direct_subscription(self, collective, identity=None):
+        """Re-implement :py:meth:`pymco.connector.Connector.get_direct_subscription`"""
+        return ('/exchange/{collective}_directed/{identity}'.format(
+            collective=collective,
+            identity=identity or self.config['identity'],
+        ), {})
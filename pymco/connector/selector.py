@@ -0,0 +1,214 @@
+"""
+:py:mod:`pymco.connector.selector`
+----------------------------------
+Broker pool selection by measured health.
+
+:py:class:`BrokerSelector` keeps, for every broker in a connector pool, the
+time connections take to be established, the error rate and the round trip
+latency of requests, and orders the pool so the healthiest broker is tried
+first.
+
+Brokers failing ``ejection_failures`` times in a row are ejected: they are
+tried last until the ejection time elapses, doubling on every consecutive
+ejection up to ``max_ejection_time``. Once re-admitted, their error rate
+keeps counting against them and decays with ``error_half_life``, so they
+slowly earn their place back.
+
+Selectors are shared by every connector using the same pool, and can be
+tuned from configuration, for instance for ActiveMQ::
+
+    plugin.activemq.pool.ejection_failures = 3
+    plugin.activemq.pool.ejection_time = 30
+    plugin.activemq.pool.max_ejection_time = 300
+    plugin.activemq.pool.error_half_life = 60
+"""
+import threading
+import timeit
+
+#: Weight, in seconds, of a 100% error rate when scoring brokers.
+ERROR_PENALTY = 5.0
+
+_selectors = {}
+_lock = threading.Lock()
+
+
+class BrokerHealth(object):
+    """Health measures for a single broker.
+
+    ``connect_time`` and ``latency`` are exponentially weighted moving
+    averages, in seconds, ``None`` until measured.
+    """
+    __slots__ = ('host_and_port', 'index', 'connect_time', 'latency',
+                 'error_rate', 'updated_at', 'failures', 'ejections',
+                 'ejected_until')
+
+    def __init__(self, host_and_port, index):
+        self.host_and_port = host_and_port
+        self.index = index
+        self.connect_time = None
+        self.latency = None
+        self.error_rate = 0.0
+        self.updated_at = 0.0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = None
+
+    def as_dict(self):
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+
+def _average(current, value, alpha):
+    if current is None:
+        return value
+    return current + alpha * (value - current)
+
+
+class BrokerSelector(object):
+    """Track pool members health and order them by preference.
+
+    Params:
+        ``host_and_ports``: pool, as returned by
+        :py:meth:`pymco.config.Config.get_host_and_ports`.
+
+        ``ejection_failures``: consecutive failures ejecting a broker.
+
+        ``ejection_time``: seconds a broker is ejected for the first time.
+
+        ``max_ejection_time``: maximum ejection time, in seconds.
+
+        ``error_half_life``: seconds for the error rate to halve.
+
+        ``alpha``: smoothing factor for the moving averages.
+
+        ``clock``: function returning the current time, in seconds.
+    """
+    def __init__(self, host_and_ports, ejection_failures=3, ejection_time=30.0,
+                 max_ejection_time=300.0, error_half_life=60.0, alpha=0.3,
+                 clock=timeit.default_timer):
+        self.brokers = dict(
+            (tuple(host_and_port), BrokerHealth(tuple(host_and_port), index))
+            for index, host_and_port in enumerate(host_and_ports))
+        self.ejection_failures = ejection_failures
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.error_half_life = error_half_life
+        self.alpha = alpha
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.brokers)
+
+    def error_rate(self, health, now=None):
+        """Get the broker error rate, decayed since its last update."""
+        if not health.error_rate:
+            return 0.0
+        elapsed = (self.clock() if now is None else now) - health.updated_at
+        return health.error_rate * 0.5 ** (max(elapsed, 0) /
+                                           self.error_half_life)
+
+    def score(self, health, now=None):
+        """Get the broker score, lower is better."""
+        return ((health.connect_time or 0.0) + (health.latency or 0.0) +
+                self.error_rate(health, now) * ERROR_PENALTY)
+
+    def is_ejected(self, health, now=None):
+        return (health.ejected_until is not None and
+                health.ejected_until > (self.clock() if now is None else now))
+
+    def order(self):
+        """Get the pool ordered by preference.
+
+        Returns:
+            ``host_and_ports``: list of two-tuples, the healthiest broker
+            first. Ejected brokers come last, the one to be re-admitted
+            first leading, so there is always some broker to try.
+        """
+        now = self.clock()
+        with self._lock:
+            brokers = list(self.brokers.values())
+            admitted = sorted(
+                (health for health in brokers
+                 if not self.is_ejected(health, now)),
+                key=lambda health: (self.score(health, now), health.index))
+            ejected = sorted(
+                (health for health in brokers if self.is_ejected(health, now)),
+                key=lambda health: (health.ejected_until, health.index))
+
+        return [health.host_and_port for health in admitted + ejected]
+
+    def _update_error_rate(self, health, value, now):
+        health.error_rate = _average(self.error_rate(health, now), value,
+                                     self.alpha)
+        health.updated_at = now
+
+    def record_connect(self, host_and_port, elapsed):
+        """Account a successful connection taking ``elapsed`` seconds."""
+        health = self.brokers.get(tuple(host_and_port), None)
+        if health is None:
+            return
+        now = self.clock()
+        with self._lock:
+            health.connect_time = _average(health.connect_time, elapsed,
+                                           self.alpha)
+            self._update_error_rate(health, 0.0, now)
+            health.failures = 0
+            health.ejected_until = None
+            if health.error_rate < 0.05:
+                health.ejections = 0
+
+    def record_error(self, host_and_port):
+        """Account a failure connecting or talking to the broker, ejecting
+        it after too many consecutive ones."""
+        health = self.brokers.get(tuple(host_and_port), None)
+        if health is None:
+            return
+        now = self.clock()
+        with self._lock:
+            self._update_error_rate(health, 1.0, now)
+            health.failures += 1
+            if health.failures >= self.ejection_failures:
+                health.failures = 0
+                health.ejections += 1
+                health.ejected_until = now + min(
+                    self.max_ejection_time,
+                    self.ejection_time * 2 ** (health.ejections - 1))
+
+    def record_latency(self, host_and_port, elapsed):
+        """Account a request round trip taking ``elapsed`` seconds."""
+        health = self.brokers.get(tuple(host_and_port), None)
+        if health is None:
+            return
+        with self._lock:
+            health.latency = _average(health.latency, elapsed, self.alpha)
+
+    def stats(self):
+        """Get every broker health as a list of dicts, in pool order."""
+        with self._lock:
+            return [health.as_dict() for health in
+                    sorted(self.brokers.values(),
+                           key=lambda health: health.index)]
+
+
+def get_selector(config):
+    """Get the selector for the configured pool, shared by every connector
+    using the same pool."""
+    host_and_ports = [tuple(host_and_port)
+                      for host_and_port in config.get_host_and_ports()]
+    key = (config['connector'], tuple(host_and_ports))
+    with _lock:
+        selector = _selectors.get(key, None)
+        if selector is None:
+            prefix = 'plugin.{0}.pool.'.format(config['connector'])
+            selector = _selectors[key] = BrokerSelector(
+                host_and_ports,
+                ejection_failures=config.getint(
+                    prefix + 'ejection_failures', default=3),
+                ejection_time=config.getfloat(
+                    prefix + 'ejection_time', default=30.0),
+                max_ejection_time=config.getfloat(
+                    prefix + 'max_ejection_time', default=300.0),
+                error_half_life=config.getfloat(
+                    prefix + 'error_half_life', default=60.0))
+
+    return selector
@@ -0,0 +1,288 @@
+"""
+:py:mod:`pymco.connector.sharded`
+---------------------------------
+Connector spreading messages over several connections.
+
+A single :py:class:`stomp.Connection` serializes every send through one
+socket. :py:class:`ShardedConnector` opens several connections of the
+configured connector type, the shards, spreads outgoing messages over them,
+and merges replies received on any of them into a single listener.
+
+Sharding is enabled by setting the connector ``connections`` option to the
+number of connections to open, for instance for ActiveMQ::
+
+    plugin.activemq.connections = 4
+
+Shards connect to the pool brokers in turn, each one starting from a
+different broker, so load is spread over the pool when it has several.
+"""
+from __future__ import absolute_import
+
+import itertools
+import threading
+
+from stomp import listener as stomp_listener
+
+from .. import exc
+from .. import listener
+from .. import tracing
+from .. import utils
+from . import BaseConnector
+
+#: Destination prefixes whose messages go to just one of their subscribers,
+#: so they can be subscribed to from every shard.
+QUEUE_PREFIXES = ('/queue/', '/amq/queue/')
+
+#: Header added to messages merged from shards, holding the shard index.
+SHARD_HEADER = 'x-pymco-shard'
+
+
+class _ShardListener(stomp_listener.ConnectionListener):
+    """Forward replies received by a shard to the listener merging them,
+    tagged with the shard index, so they're acknowledged through it."""
+    def __init__(self, listener_, index):
+        self.listener = listener_
+        self.index = index
+
+    def on_message(self, headers, body):
+        headers = dict(headers)
+        headers[SHARD_HEADER] = self.index
+        self.listener.on_message(headers, body)
+
+    def on_disconnected(self):
+        self.listener.on_disconnected()
+
+    def on_heartbeat_timeout(self):
+        self.listener.on_heartbeat_timeout()
+
+
+class ShardedConnector(BaseConnector):
+    """Connector sending through several connections.
+
+    Sends go to shards round robin, while :py:meth:`send_bulk` splits
+    messages among shards and sends from every shard in parallel.
+    Queues are subscribed to from every shard, so replies and direct
+    requests are received whatever connection the broker delivers them on,
+    while topics are only subscribed to from the first shard,
+    :py:attr:`primary`, so their messages are received once.
+
+    Targets, headers, security and :py:attr:`connection` are those of the
+    primary shard.
+
+    Params:
+        ``config``: :py:class:`pymco.config.Config` instance.
+
+        ``connections``: number of shards, the connector ``connections``
+        option by default.
+    """
+    def __init__(self, config, connections=None):
+        # Shards own the connections, so there's none to build here.
+        self.config = config
+        self._security = None
+        self._selector = None
+        self._sent_at = None
+        self._response_listener = None
+        self._select_brokers = False
+        if connections is None:
+            connections = config.getint(
+                'plugin.{0}.connections'.format(config['connector']),
+                default=1)
+        cls = utils.import_class(BaseConnector.plugins[config['connector']])
+        host_and_ports = config.get_host_and_ports()
+        self.shards = []
+        for index in range(max(connections, 1)):
+            start = index % len(host_and_ports)
+            connection = cls.default_connection(
+                config,
+                host_and_ports=host_and_ports[start:] +
+                host_and_ports[:start])
+            self.shards.append(cls(config, connection=connection))
+        self._counter = itertools.count()
+
+    @property
+    def primary(self):
+        """First shard, used for everything not involving connections."""
+        return self.shards[0]
+
+    @property
+    def connection(self):
+        """First shard connection."""
+        return self.primary.connection
+
+    @property
+    def subscriptions(self):
+        """First shard subscriptions, which include every destination."""
+        return self.primary.subscriptions
+
+    @property
+    def prefetch_header(self):
+        return self.primary.prefetch_header
+
+    def get_target(self, agent, collective):
+        return self.primary.get_target(agent=agent, collective=collective)
+
+    def get_reply_target(self, agent, collective):
+        return self.primary.get_reply_target(agent=agent,
+                                             collective=collective)
+
+    def get_direct_subscription(self, collective, identity=None):
+        return self.primary.get_direct_subscription(collective, identity)
+
+    def get_message_headers(self, msg):
+        return self.primary.get_message_headers(msg)
+
+    def get_send_headers(self, headers):
+        return self.primary.get_send_headers(headers)
+
+    def next_shard(self):
+        """Get the shard the next message should be sent through."""
+        return self.shards[next(self._counter) % len(self.shards)]
+
+    def get_shards(self, destination):
+        """Get the shards subscribing to the given destination."""
+        if destination.startswith(QUEUE_PREFIXES):
+            return self.shards
+        return [self.primary]
+
+    def connect(self, wait=None):
+        """Connect every shard."""
+        for shard in self.shards:
+            shard.connect(wait=wait)
+
+        return self
+
+    def is_connected(self):
+        """Whether every shard is connected."""
+        return all(shard.is_connected() for shard in self.shards)
+
+    def reconnect(self, wait=True):
+        """Connect again every shard whose connection was lost."""
+        if self._response_listener is not None:
+            self._response_listener.reset()
+        for shard in self.shards:
+            if not shard.is_connected():
+                shard.reconnect(wait=wait)
+
+        return self
+
+    def disconnect(self):
+        """Disconnect every shard."""
+        for shard in self.shards:
+            shard.disconnect()
+        if self._response_listener is not None:
+            self._response_listener.reset()
+
+        return self
+
+    def send_encoded(self, body, destination, *args, **kwargs):
+        """Send an already encoded MCollective message through the next
+        shard."""
+        self.next_shard().send_encoded(body, destination, *args, **kwargs)
+        return self
+
+    def send_bulk(self, messages, receipt=None, timeout=30, **kwargs):
+        """Send many already encoded MCollective messages at once.
+
+        Messages are split evenly among shards, every shard sending its
+        share from its own thread, see
+        :py:meth:`pymco.connector.BaseConnector.send_bulk`. When given, the
+        receipt is asked for and waited on by every shard.
+        """
+        messages = list(messages)
+        shards = len(self.shards)
+        errors = []
+
+        def send(shard, share):
+            try:
+                shard.send_bulk(share, receipt=receipt, timeout=timeout,
+                                **kwargs)
+            except Exception as error:
+                errors.append(error)
+
+        threads = []
+        for index, shard in enumerate(self.shards[1:], 1):
+            thread = threading.Thread(
+                target=send, args=(shard, messages[index::shards]),
+                name='pymco-send')
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        send(self.primary, messages[::shards])
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return self
+
+    def subscribe(self, destination, id=None, *args, **kwargs):
+        """Subscribe to the given destination, from every shard for queues
+        and from the primary shard otherwise."""
+        for shard in self.get_shards(destination):
+            shard.subscribe(destination, id, *args, **kwargs)
+
+        return self
+
+    def unsubscribe(self, destination, *args, **kwargs):
+        """Unsubscribe every shard from the given destination."""
+        subscription = self.subscriptions.get(destination)
+        if (subscription is not None and subscription.users == 1 and
+                self._response_listener is not None):
+            self._response_listener.consume(destination)
+        for shard in self.get_shards(destination):
+            shard.unsubscribe(destination, *args, **kwargs)
+
+        return self
+
+    def add_listener(self, name, listener_):
+        """Set the given listener on every shard connection."""
+        for shard in self.shards:
+            shard.add_listener(name, listener_)
+
+        return self
+
+    def get_response_listener(self):
+        """Get the listener merging replies received by every shard."""
+        if self._response_listener is None:
+            self._response_listener = listener.SingleResponseListener(
+                config=self.config, ack=self.ack_message)
+            for index, shard in enumerate(self.shards):
+                shard.add_listener('response_listener', _ShardListener(
+                    self._response_listener, index))
+
+        return self._response_listener
+
+    def ack_message(self, headers):
+        """Acknowledge the given merged message through the shard which
+        received it."""
+        index = headers.get(SHARD_HEADER, None)
+        if index is not None:
+            self.shards[index].ack_message(headers)
+
+    def receive(self, timeout, *args, **kwargs):
+        """Wait for replies received by any shard, returning as soon as one
+        is received.
+
+        Raises:
+            :py:exc:`pymco.exc.TimeoutError`: if no message was received.
+
+            :py:exc:`pymco.exc.ConnectionLostError`: if a shard connection
+            was lost before receiving any message.
+        """
+        response_listener = self.get_response_listener()
+        with tracing.span('connector.receive', timeout=timeout,
+                          shards=len(self.shards)) as span:
+            response_listener.wait_on_message(timeout)
+            replies = response_listener.consume()
+            span.set('replies', len(replies))
+
+        if len(replies) == 0:
+            if response_listener.lost:
+                for shard in self.shards:
+                    if not shard.is_connected():
+                        shard.close_connection(shard.connection)
+                raise exc.ConnectionLostError(
+                    'Connection lost waiting for replies')
+            raise exc.TimeoutError
+
+        return replies
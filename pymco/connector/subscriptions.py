@@ -0,0 +1,146 @@
+"""
+:py:mod:`pymco.connector.subscriptions`
+---------------------------------------
+Connection subscriptions bookkeeping.
+
+:py:class:`SubscriptionManager` maps every subscribed destination to its
+STOMP subscription id, unique for the connection, and counts its users, so
+shared subscriptions, such as the reply queue used by concurrent RPC calls,
+are made once and only dropped when the last user is done with them.
+"""
+import collections
+import itertools
+import threading
+
+
+class Subscription(object):
+    """Subscription to a destination.
+
+    Params:
+        ``destination``: subscribed destination.
+
+        ``id``: STOMP subscription id.
+
+        ``headers``: subscription headers.
+    """
+    __slots__ = ('destination', 'id', 'headers', 'users')
+
+    def __init__(self, destination, id, headers=None):
+        self.destination = destination
+        self.id = id
+        self.headers = headers or {}
+        self.users = 0
+
+    @property
+    def acked(self):
+        """Whether received messages have to be acknowledged."""
+        return self.headers.get('ack', 'auto') != 'auto'
+
+    def __repr__(self):
+        return '<Subscription {0} id={1} users={2}>'.format(
+            self.destination, self.id, self.users)
+
+
+class SubscriptionManager(object):
+    """Track the subscriptions of a connection, in subscription order.
+
+    Ids are generated per manager, skipping any given explicitly, so they are
+    unique for the connection without growing for the process lifetime.
+    """
+    def __init__(self):
+        self._subscriptions = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._subscriptions.values()))
+
+    def __contains__(self, destination):
+        return destination in self._subscriptions
+
+    def get(self, destination):
+        """Get the subscription to the given destination, ``None`` if
+        missing."""
+        return self._subscriptions.get(destination, None)
+
+    def find(self, id):
+        """Get the subscription with the given id, as found in received
+        message headers, ``None`` if missing."""
+        id = str(id)
+        for subscription in list(self._subscriptions.values()):
+            if str(subscription.id) == id:
+                return subscription
+
+        return None
+
+    def _next_id(self):
+        used = set(subscription.id
+                   for subscription in self._subscriptions.values())
+        while True:
+            id = next(self._ids)
+            if id not in used:
+                return id
+
+    def acquire(self, destination, id=None, headers=None):
+        """Account a new user of the given destination.
+
+        Params:
+            ``destination``: destination to subscribe to.
+
+            ``id``: subscription id, a new one by default. Ignored if the
+            destination is already subscribed.
+
+            ``headers``: subscription headers, which must match those of the
+            existing subscription, if any.
+        Returns:
+            ``result``: two-tuple with the :py:class:`Subscription` and
+            whether it's new, so it has to be made.
+        Raises:
+            :py:exc:`ValueError`: if the destination is already subscribed
+            with other headers, such as a different selector, which the
+            new user would silently miss.
+        """
+        with self._lock:
+            subscription = self._subscriptions.get(destination, None)
+            new = subscription is None
+            if not new and (headers or {}) != subscription.headers:
+                raise ValueError(
+                    'Destination {0} already subscribed with headers {1}, '
+                    'not {2}'.format(destination, subscription.headers,
+                                     headers or {}))
+            if new:
+                subscription = self._subscriptions[destination] = (
+                    Subscription(destination,
+                                 self._next_id() if id is None else id,
+                                 headers))
+            subscription.users += 1
+
+        return subscription, new
+
+    def release(self, destination):
+        """Account a user of the given destination being done with it.
+
+        Returns:
+            ``subscription``: the :py:class:`Subscription` once its last user
+            is done, so it has to be dropped, ``None`` otherwise or if the
+            destination wasn't subscribed.
+        """
+        with self._lock:
+            subscription = self._subscriptions.get(destination, None)
+            if subscription is None:
+                return None
+            subscription.users -= 1
+            if subscription.users > 0:
+                return None
+            del self._subscriptions[destination]
+
+        return subscription
+
+    def clear(self):
+        """Forget every subscription, as when disconnecting."""
+        with self._lock:
+            self._subscriptions.clear()
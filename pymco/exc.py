@@ -22,5 +22,19 @@ class TimeoutError(PyMcoException):
     """Exception to be raised on timeouts"""
 
 
+class ConnectError(PyMcoException):
+    """Exception raised when no broker could be connected to."""
+
+
+class ConnectionLostError(PyMcoException):
+    """Exception raised when the broker connection is lost while waiting for
+    replies."""
+
+
 class VerificationError(PyMcoException):
     """Exception to be raised on message verification errors."""
+
+
+class BadFilterExpression(PyMcoException):
+    """Exception raised on compound filter expressions that can't be
+    parsed."""
@@ -0,0 +1,360 @@
+"""
+:py:mod:`pymco.inventory`
+-------------------------
+Local node inventory backed by SQLite.
+
+The inventory keeps facts, classes and agents for each node, as reported by
+``rpcutil inventory`` replies or registration messages, so discovery can be
+answered by an indexed query instead of broadcasting a ``discovery ping``::
+
+    store = inventory.Inventory('/var/cache/pymco/inventory.db')
+    for reply in rpcutil_inventory_replies:
+        store.update_from_reply(reply)
+    store.discover(message.Filter().add_fact('country', 'uk'))
+"""
+import re
+import sqlite3
+import threading
+import time
+
+import six
+
+from . import compound
+from . import message
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS nodes (identity TEXT PRIMARY KEY, '
+    'updated REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS facts (identity TEXT NOT NULL, '
+    'name TEXT NOT NULL, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS classes (identity TEXT NOT NULL, '
+    'name TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS agents (identity TEXT NOT NULL, '
+    'name TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS facts_name_value ON facts (name, value)',
+    'CREATE INDEX IF NOT EXISTS facts_identity ON facts (identity)',
+    'CREATE INDEX IF NOT EXISTS classes_name ON classes (name)',
+    'CREATE INDEX IF NOT EXISTS classes_identity ON classes (identity)',
+    'CREATE INDEX IF NOT EXISTS agents_name ON agents (name)',
+    'CREATE INDEX IF NOT EXISTS agents_identity ON agents (identity)',
+)
+
+
+def _is_regex(value):
+    return len(value) > 1 and value.startswith('/') and value.endswith('/')
+
+
+def _regexp(pattern, value):
+    """SQLite ``REGEXP`` implementation."""
+    if value is None:
+        return False
+    return re.search(pattern, value) is not None
+
+
+class _FactMatch(object):
+    """SQLite function comparing a fact value using MCollective semantics.
+
+    Compiled comparisons are cached, since the same comparison is run for
+    every candidate row.
+    """
+    def __init__(self):
+        self.cache = {}
+
+    def __call__(self, value, operator, expected):
+        key = (operator, expected)
+        if key not in self.cache:
+            self.cache[key] = compound.compile_fact('fact', expected, operator)
+
+        return self.cache[key]({'fact': value})
+
+
+def _body(reply):
+    if isinstance(reply, message.Reply):
+        return reply.body
+    return reply[':body']
+
+
+def _get(data, key, default=None):
+    """Get data value for the given key, either as a Ruby symbol or not."""
+    if ':' + key in data:
+        return data[':' + key]
+    return data.get(key, default)
+
+
+class Inventory(object):
+    """Local inventory of nodes.
+
+    Params:
+        ``path``: SQLite database path, by default an in memory database.
+    """
+    def __init__(self, path=':memory:'):
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.create_function('REGEXP', 2, _regexp)
+        self.connection.create_function('FACT_MATCH', 3, _FactMatch())
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM nodes').fetchone()[0]
+
+    def __contains__(self, identity):
+        with self._lock:
+            return self.connection.execute(
+                'SELECT 1 FROM nodes WHERE identity = ?',
+                (identity,)).fetchone() is not None
+
+    def close(self):
+        """Close the database connection."""
+        self.connection.close()
+
+    def update(self, identity, facts=None, classes=None, agents=None,
+               updated=None):
+        """Insert or replace a node.
+
+        Params:
+            ``identity``: node identity.
+
+            ``facts``: dictionary of facts.
+
+            ``classes``: iterable of configuration management classes.
+
+            ``agents``: iterable of agent names.
+
+            ``updated``: update timestamp, now by default.
+        """
+        self.update_many(({'identity': identity,
+                           'facts': facts,
+                           'classes': classes,
+                           'agents': agents,
+                           'updated': updated},))
+
+    def update_many(self, nodes):
+        """Insert or replace many nodes on a single transaction.
+
+        Params:
+            ``nodes``: iterable of dictionaries with the same keys than
+            :py:meth:`update` arguments.
+        Returns:
+            ``count``: number of updated nodes.
+        """
+        count = 0
+        with self._lock:
+            with self.connection:
+                for node in nodes:
+                    self._update(cursor=self.connection, **node)
+                    count += 1
+
+        return count
+
+    @staticmethod
+    def _update(cursor, identity, facts=None, classes=None, agents=None,
+                updated=None):
+        cursor.execute('INSERT OR REPLACE INTO nodes VALUES (?, ?)',
+                       (identity, updated or time.time()))
+        for table in ('facts', 'classes', 'agents'):
+            cursor.execute('DELETE FROM {0} WHERE identity = ?'.format(table),
+                           (identity,))
+
+        cursor.executemany('INSERT INTO facts VALUES (?, ?, ?)',
+                           ((identity, name, six.text_type(value))
+                            for name, value in six.iteritems(facts or {})))
+        cursor.executemany('INSERT INTO classes VALUES (?, ?)',
+                           ((identity, name) for name in classes or ()))
+        cursor.executemany('INSERT INTO agents VALUES (?, ?)',
+                           ((identity, name) for name in agents or ()))
+
+    @staticmethod
+    def parse_reply(reply):
+        """Get node data from an ``rpcutil inventory`` reply.
+
+        Params:
+            ``reply``: reply envelope, either a
+            :py:class:`pymco.message.Reply` or a dictionary with a decoded
+            body.
+        Returns:
+            ``node``: a dictionary suitable for :py:meth:`update_many`.
+        """
+        body = _body(reply)
+        data = _get(body, 'data', {})
+        return {'identity': reply[':senderid'],
+                'facts': _get(data, 'facts', {}),
+                'classes': _get(data, 'classes', ()),
+                'agents': _get(data, 'agents', ())}
+
+    @staticmethod
+    def parse_registration(reply):
+        """Get node data from a registration message.
+
+        Registration messages, as sent by MCollective ``meta`` registration
+        plugin, carry the agent list, facts and classes on their body.
+
+        Params:
+            ``reply``: message envelope, either a
+            :py:class:`pymco.message.Reply` or a dictionary with a decoded
+            body.
+        Returns:
+            ``node``: a dictionary suitable for :py:meth:`update_many`.
+        """
+        body = _body(reply)
+        return {'identity': _get(body, 'identity') or reply[':senderid'],
+                'facts': _get(body, 'facts', {}),
+                'classes': _get(body, 'classes', ()),
+                'agents': _get(body, 'agentlist', ())}
+
+    def update_from_reply(self, reply):
+        """Insert or replace a node from an ``rpcutil inventory`` reply."""
+        self.update_many((self.parse_reply(reply),))
+
+    def update_from_registration(self, reply):
+        """Insert or replace a node from a registration message."""
+        self.update_many((self.parse_registration(reply),))
+
+    def remove(self, identity):
+        """Remove a node from the inventory."""
+        with self._lock:
+            with self.connection:
+                for table in ('nodes', 'facts', 'classes', 'agents'):
+                    self.connection.execute(
+                        'DELETE FROM {0} WHERE identity = ?'.format(table),
+                        (identity,))
+
+    def expire(self, max_age):
+        """Remove nodes not updated on the last ``max_age`` seconds.
+
+        Returns:
+            ``identities``: list of removed nodes.
+        """
+        with self._lock:
+            identities = [row[0] for row in self.connection.execute(
+                'SELECT identity FROM nodes WHERE updated < ?',
+                (time.time() - max_age,))]
+
+        for identity in identities:
+            self.remove(identity)
+
+        return identities
+
+    def get(self, identity):
+        """Get facts, classes and agents for a node.
+
+        Returns:
+            ``node``: a dictionary with the same keys than
+            :py:meth:`update` arguments or ``None`` for unknown nodes.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT updated FROM nodes WHERE identity = ?',
+                (identity,)).fetchone()
+            if row is None:
+                return None
+
+            return {
+                'identity': identity,
+                'updated': row[0],
+                'facts': self._facts(identity),
+                'classes': self._names('classes', identity),
+                'agents': self._names('agents', identity),
+            }
+
+    def _facts(self, identity):
+        return dict(self.connection.execute(
+            'SELECT name, value FROM facts WHERE identity = ?', (identity,)))
+
+    def _names(self, table, identity):
+        return [row[0] for row in self.connection.execute(
+            'SELECT name FROM {0} WHERE identity = ? ORDER BY name'.format(
+                table), (identity,))]
+
+    @staticmethod
+    def _name_clause(table, value):
+        if _is_regex(value):
+            return ('identity IN (SELECT identity FROM {0} '
+                    'WHERE name REGEXP ?)'.format(table), value[1:-1])
+
+        return ('identity IN (SELECT identity FROM {0} '
+                'WHERE name = ?)'.format(table), value)
+
+    def get_query(self, filter_, max_age=None):
+        """Build the SQL query for discovering nodes matching the filter.
+
+        Compound filters aren't included, see :py:meth:`discover`.
+
+        Returns:
+            ``query``: two-tuple with the SQL query and its parameters.
+        """
+        clauses, params = [], []
+        for table, key in (('classes', 'cf_class'), ('agents', 'agent')):
+            for value in filter_.get(key, ()):
+                clause, param = self._name_clause(table, value)
+                clauses.append(clause)
+                params.append(param)
+
+        for fact in filter_.get('fact', ()):
+            operator = fact.get(':operator') or '=='
+            value = six.text_type(fact[':value'])
+            if operator == '==' and not _is_regex(value):
+                clauses.append('identity IN (SELECT identity FROM facts '
+                               'WHERE name = ? AND value = ?)')
+                params.extend((fact[':fact'], value))
+            else:
+                clauses.append('identity IN (SELECT identity FROM facts '
+                               'WHERE name = ? AND FACT_MATCH(value, ?, ?))')
+                params.extend((fact[':fact'], operator, value))
+
+        identities = []
+        for identity in filter_.get('identity', ()):
+            if _is_regex(identity):
+                identities.append('identity REGEXP ?')
+                identity = identity[1:-1]
+            else:
+                identities.append('identity = ?')
+            params.append(identity)
+        if identities:
+            clauses.append('({0})'.format(' OR '.join(identities)))
+
+        if max_age is not None:
+            clauses.append('updated >= ?')
+            params.append(time.time() - max_age)
+
+        query = 'SELECT identity FROM nodes'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+
+        return query + ' ORDER BY identity', params
+
+    def discover(self, filter_, max_age=None):
+        """Discover nodes matching the given filter.
+
+        Agent, class, fact and identity filters are resolved by an indexed
+        query, then compound expressions, if any, are evaluated against the
+        facts and classes of the remaining nodes.
+
+        Params:
+            ``filter_``: a :py:class:`pymco.message.Filter` or its dictionary
+            form.
+
+            ``max_age``: ignore nodes not updated on the last ``max_age``
+            seconds.
+        Returns:
+            ``identities``: sorted list of matching node identities.
+        """
+        query, params = self.get_query(filter_, max_age=max_age)
+        expressions = [compound.Expression(callstack)
+                       for callstack in filter_.get('compound', ())]
+        with self._lock:
+            identities = [row[0] for row in
+                          self.connection.execute(query, params)]
+            if not expressions:
+                return identities
+
+            return [identity for identity in identities
+                    if self._match(identity, expressions)]
+
+    def _match(self, identity, expressions):
+        facts = self._facts(identity)
+        classes = self._names('classes', identity)
+        return all(expression(facts, classes) for expression in expressions)
@@ -6,9 +6,13 @@ stomp.py listeners for python-mcollective.
 import functools
 import threading
 import time
+import timeit
 
 from stomp import listener
 
+from . import message
+from . import metrics
+
 
 class CurrentHostPortListener(listener.ConnectionListener):
     """Listener tracking current host and port.
@@ -35,8 +39,23 @@ class CurrentHostPortListener(listener.ConnectionListener):
 
 
 class ResponseListener(listener.ConnectionListener):
-    """Listener that waits for a message response."""
-    def __init__(self, config, count, timeout=30, condition=None):
+    """Listener that waits for a message response.
+
+    Responses are kept as :py:class:`pymco.message.Reply` objects, which are
+    only de-serialized when accessed, and buffered until taken with
+    :py:meth:`consume`. Waits end early, setting :py:attr:`lost`, if the
+    connection is lost, either closed or timing out on heart-beats.
+
+    Replies are only acknowledged, through ``ack``, once consumed, so
+    brokers with a prefetch window for the subscription stop pushing replies
+    while the buffer holds that many of them, see
+    :py:meth:`pymco.connector.BaseConnector.get_reply_subscription_headers`.
+
+    Params:
+        ``ack``: callable taking the received message headers,
+        acknowledging it if needed, ``None`` for no acknowledgements.
+    """
+    def __init__(self, config, count, timeout=30, condition=None, ack=None):
         self.config = config
         self._security = None
         self.timeout = timeout
@@ -47,6 +66,9 @@ class ResponseListener(listener.ConnectionListener):
         self.received = 0
         self.responses = []
         self.count = count
+        self.lost = False
+        self.ack = ack
+        self._headers = []
 
     @property
     def security(self):
@@ -57,22 +79,81 @@ class ResponseListener(listener.ConnectionListener):
         return self._security
 
     def on_message(self, headers, body):
+        received_at = timeit.default_timer()
         self.condition.acquire()
-        self.responses.append(self.security.deserialize(body))
+        self.responses.append(message.Reply(body, self.security, received_at))
+        self._headers.append(headers)
         self.received += 1
+        metrics.REPLIES_RECEIVED.inc()
+        metrics.BUFFERED_REPLIES.inc()
         self.condition.notify()
         self.condition.release()
 
-    def wait_on_message(self):
-        """Wait until we get a message."""
+    def on_disconnected(self):
         self.condition.acquire()
-        self._wait_loop(self.timeout)
+        self.lost = True
+        self.condition.notify()
+        self.condition.release()
+
+    on_heartbeat_timeout = on_disconnected
+
+    def wait_on_message(self, timeout=None):
+        """Wait until ``count`` replies are buffered.
+
+        Args:
+            ``timeout``: how long to wait, :py:attr:`timeout` by default.
+        """
+        self.condition.acquire()
+        self._wait_loop(self.timeout if timeout is None else timeout)
         self.condition.release()
-        self.received = 0
         return self
 
+    def _take(self, destination=None):
+        self.condition.acquire()
+        if destination is None:
+            taken = list(zip(self.responses, self._headers))
+            kept = []
+        else:
+            taken, kept = [], []
+            for item in zip(self.responses, self._headers):
+                if item[1].get('destination', None) == destination:
+                    taken.append(item)
+                else:
+                    kept.append(item)
+        self.responses = [reply for reply, _ in kept]
+        self._headers = [headers for _, headers in kept]
+        self.received = len(self.responses)
+        metrics.BUFFERED_REPLIES.dec(len(taken))
+        self.condition.release()
+        return taken
+
+    def consume(self, destination=None):
+        """Take the buffered replies, acknowledging them.
+
+        Args:
+            ``destination``: only take replies sent to this destination,
+            every one by default.
+
+        Returns:
+            ``replies``: list of :py:class:`pymco.message.Reply`, in arrival
+            order.
+        """
+        taken = self._take(destination)
+        if self.ack is not None:
+            for _, headers in taken:
+                self.ack(headers)
+
+        return [reply for reply, _ in taken]
+
+    def reset(self):
+        """Drop buffered replies without acknowledging them, as brokers
+        deliver them again once the connection is lost, and forget the
+        connection was lost."""
+        self._take()
+        self.lost = False
+
     def _wait_loop(self, timeout):
-        while self.received < self.count:
+        while self.received < self.count and not self.lost:
             init_time = time.time()
             self.condition.wait(timeout)
             current_time = time.time()
@@ -81,4 +162,83 @@ class ResponseListener(listener.ConnectionListener):
                 break
 
 
+class ConnectedListener(listener.ConnectionListener):
+    """Listener waiting for the broker to acknowledge the STOMP connection,
+    with a timeout."""
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+    def on_connected(self, headers, body):
+        self.event.set()
+
+    def on_error(self, headers, body):
+        if not self.event.is_set():
+            self.error = headers.get('message', None) or body
+            self.event.set()
+
+    def wait(self, timeout=None):
+        """Wait for the connection.
+
+        Returns:
+            ``connected``: whether the broker acknowledged the connection
+            before the timeout.
+        """
+        return self.event.wait(timeout) and self.error is None
+
+
+class ConnectionLostListener(listener.ConnectionListener):
+    """Listener calling the given callback when the connection is lost,
+    either closed or timing out on heart-beats. Both may happen for the
+    same connection, so callbacks must cope with being called twice."""
+    def __init__(self, callback):
+        self.callback = callback
+
+    def on_disconnected(self):
+        self.callback()
+
+    on_heartbeat_timeout = on_disconnected
+
+
+class ReceiptListener(listener.ConnectionListener):
+    """Listener waiting for the broker to acknowledge the given receipt,
+    with a timeout."""
+    def __init__(self, receipt):
+        self.receipt = receipt
+        self.event = threading.Event()
+
+    def on_receipt(self, headers, body):
+        if headers.get('receipt-id', None) == self.receipt:
+            self.event.set()
+
+    def wait(self, timeout=None):
+        """Wait for the receipt.
+
+        Returns:
+            ``received``: whether the receipt was received before the
+            timeout.
+        """
+        return self.event.wait(timeout)
+
+
+class QueueListener(listener.ConnectionListener):
+    """Listener putting every received message body into a queue, so they
+    can be consumed out of the receiver thread."""
+    def __init__(self, queue):
+        self.queue = queue
+
+    def on_message(self, headers, body):
+        self.queue.put(body)
+
+
+class CallbackListener(listener.ConnectionListener):
+    """Listener calling the given callback with headers and body for every
+    received message."""
+    def __init__(self, callback):
+        self.callback = callback
+
+    def on_message(self, headers, body):
+        self.callback(headers, body)
+
+
 SingleResponseListener = functools.partial(ResponseListener, count=1)
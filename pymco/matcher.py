@@ -0,0 +1,180 @@
+"""
+:py:mod:`pymco.matcher`
+-----------------------
+Server side request filter evaluation.
+
+Servers receive every broadcast request on their subscribed topics, so they
+need to decide quickly whether they should handle it. :py:class:`FilterMatcher`
+compiles each distinct wire ``:filter`` dictionary once, into a predicate with
+its regular expressions and fact comparisons already built, and caches the
+result for the current node, so repeated filters are answered with a single
+dictionary lookup::
+
+    matcher = FilterMatcher('mco1', agents=['package'], facts={'os': 'Debian'})
+    matcher.matches({'agent': ['package'], 'fact': [], 'identity': []})
+
+Results are cached until the node state changes through
+:py:meth:`FilterMatcher.update`.
+"""
+import collections
+import json
+import re
+import threading
+
+from . import compound
+from . import message
+
+
+def _default(value):
+    if isinstance(value, collections.Mapping):
+        return dict(value)
+    return repr(value)
+
+
+#: Canonical, C accelerated, filter encoder, much faster than freezing
+#: nested filter values into tuples.
+_encode = json.JSONEncoder(sort_keys=True,
+                           separators=(',', ':'),
+                           check_circular=False,
+                           default=_default).encode
+
+
+def _key(filter_):
+    """Get an hashable key for a wire filter."""
+    if isinstance(filter_, message.CompiledFilter):
+        return filter_
+    return _encode(filter_)
+
+
+def _compile_name(name):
+    """Compile an agent or identity match, either a name or a ``/regex/``."""
+    if compound._is_regex(name):
+        regex = re.compile(name[1:-1])
+        return lambda names: any(regex.search(item) for item in names)
+
+    return lambda names: name in names
+
+
+def compile_filter(filter_):
+    """Compile a wire filter into a predicate.
+
+    Params:
+        ``filter_``: filter dictionary as found on request messages.
+    Returns:
+        ``predicate``: a callable taking the node identity, agent names,
+        facts and classes, and returning whether the node matches.
+    Raises:
+        :py:exc:`pymco.exc.BadFilterExpression`: for unsupported fact
+        operators or compound statements.
+    """
+    agents = [_compile_name(agent) for agent in filter_.get('agent', ())]
+    classes = [compound.compile_class(klass)
+               for klass in filter_.get('cf_class', ())]
+    facts = [compound.compile_fact(fact[':fact'],
+                                   fact[':value'],
+                                   fact.get(':operator'))
+             for fact in filter_.get('fact', ())]
+    identities = [_compile_name(identity)
+                  for identity in filter_.get('identity', ())]
+    expressions = [compound.Expression(callstack)
+                   for callstack in filter_.get('compound', ())]
+
+    def predicate(identity, node_agents, node_facts, node_classes):
+        return (all(match(node_agents) for match in agents) and
+                all(match(node_classes) for match in classes) and
+                all(match(node_facts) for match in facts) and
+                (not identities or
+                 any(match((identity,)) for match in identities)) and
+                all(expression(node_facts, node_classes)
+                    for expression in expressions))
+
+    return predicate
+
+
+class FilterMatcher(object):
+    """Match request filters against the current node.
+
+    Params:
+        ``identity``: node identity.
+
+        ``agents``: iterable of agent names served by the node.
+
+        ``facts``: node facts dictionary.
+
+        ``classes``: iterable of node configuration management classes.
+
+        ``maxsize``: maximum number of distinct filters to cache, the cache
+        is reset when exceeded.
+    """
+    def __init__(self, identity, agents=(), facts=None, classes=(),
+                 maxsize=1024):
+        self.identity = identity
+        self.agents = frozenset(agents)
+        self.facts = dict(facts or {})
+        self.classes = frozenset(classes)
+        self.maxsize = maxsize
+        self._predicates = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def update(self, identity=None, agents=None, facts=None, classes=None):
+        """Update the node state, invalidating cached results.
+
+        Compiled predicates don't depend on the node, so they are kept.
+        """
+        with self._lock:
+            if identity is not None:
+                self.identity = identity
+            if agents is not None:
+                self.agents = frozenset(agents)
+            if facts is not None:
+                self.facts = dict(facts)
+            if classes is not None:
+                self.classes = frozenset(classes)
+            self._results = {}
+
+        return self
+
+    def compile(self, filter_, key=None):
+        """Get the compiled predicate for the given filter, cached by the
+        filter key."""
+        if key is None:
+            key = _key(filter_)
+
+        predicate = self._predicates.get(key, None)
+        if predicate is None:
+            predicate = compile_filter(filter_)
+            with self._lock:
+                if len(self._predicates) >= self.maxsize:
+                    self._predicates = {}
+                self._predicates[key] = predicate
+
+        return predicate
+
+    def matches(self, filter_):
+        """Check whether the current node matches the given wire filter.
+
+        Filters failing to compile don't match.
+        """
+        if not filter_:
+            return True
+
+        key = _key(filter_)
+        results = self._results
+        result = results.get(key, None)
+        if result is None:
+            try:
+                result = bool(self.compile(filter_, key)(
+                    self.identity, self.agents, self.facts, self.classes))
+            except Exception:
+                result = False
+
+            with self._lock:
+                if results is self._results:
+                    if len(results) >= self.maxsize:
+                        self._results = results = {}
+                    results[key] = result
+
+        return result
+
+    __call__ = matches
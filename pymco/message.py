@@ -1,58 +1,85 @@
 '''pymco messaging objects'''
 import collections
+import copy
 import hashlib
 import time
+import uuid
 
 import six
 
+from . import compound
 from . import exc
 
+_MISSING = object()
 
-class Filter(collections.Mapping):
-    '''Provides MCollective filters for pymco. This class implements
-    :py:class:`collections.Mapping` interface, so it can be used as non mutable
-    mapping (read only dict), but mutable using provided add methods. So that,
-    for adding the agent you can just use :py:meth:`add_agent`::
+#: Fact operators supported by MCollective filters.
+FACT_OPERATORS = frozenset(('==', '=~', '<=', '=>', '>=', '=<', '>', '<',
+                            '!='))
 
-        filter.add_agent('package')
-    '''
-    def __init__(self):
-        self._filter = {
-            'cf_class': [],
-            'agent': [],
-            'fact': [],
-            'identity': [],
-            'compound': [],
-        }
+
+class BaseFilter(collections.Mapping):
+    '''Base class for MCollective filters, providing the add methods on top
+    of the :py:class:`collections.Mapping` interface.'''
+    __slots__ = ()
 
     def add_cfclass(self, klass):
         '''Adds new classes/recipes/cookbooks/roles applied by your
         configuration management system.'''
-        self._filter['cf_class'].append(klass)
+        self['cf_class'].append(klass)
         return self
 
     def add_agent(self, agent):
         '''Adds new agents'''
-        self._filter['agent'].append(agent)
+        self['agent'].append(agent)
         return self
 
     def add_fact(self, fact, value, operator=None):
         '''Adds new facts'''
         toappend = {':fact': fact, ':value': value}
         if operator:
-            if not operator in ('==', '=~', '<=', '=>', '>=', '=<', '>', '<',
-                                '!='):
+            if operator not in FACT_OPERATORS:
                 raise exc.BadFilterFactOperator(
                     'Unsuppoerted operator {0}'.format(operator))
             toappend[':operator'] = operator
-        self._filter['fact'].append(toappend)
+        self['fact'].append(toappend)
         return self
 
     def add_identity(self, identity):
         '''Adds new identities'''
-        self._filter['identity'].append(identity)
+        self['identity'].append(identity)
+        return self
+
+    def add_compound(self, expression):
+        '''Adds new compound expressions, either an expression string or a
+        :py:class:`pymco.compound.Expression` instance.'''
+        if isinstance(expression, six.string_types):
+            expression = compound.parse(expression)
+
+        self['compound'].append(expression.callstack)
         return self
 
+    def compile(self):
+        '''Get the :py:class:`CompiledFilter` for the current filter.'''
+        return CompiledFilter(self)
+
+
+class Filter(BaseFilter):
+    '''Provides MCollective filters for pymco. This class implements
+    :py:class:`collections.Mapping` interface, so it can be used as non mutable
+    mapping (read only dict), but mutable using provided add methods. So that,
+    for adding the agent you can just use :py:meth:`add_agent`::
+
+        filter.add_agent('package')
+    '''
+    def __init__(self):
+        self._filter = {
+            'cf_class': [],
+            'agent': [],
+            'fact': [],
+            'identity': [],
+            'compound': [],
+        }
+
     def __getitem__(self, key):
         return self._filter[key]
 
@@ -63,29 +90,161 @@ class Filter(collections.Mapping):
         return six.iterkeys(self._filter)
 
 
+class CompactFilter(BaseFilter):
+    '''Same as :py:class:`Filter`, but storing each filter on its own slot
+    rather than in a dictionary, so it has a smaller memory footprint and
+    filters can be reached as attributes, e.g. ``filter_.agent``.'''
+    __slots__ = ('cf_class', 'agent', 'fact', 'identity', 'compound')
+
+    def __init__(self):
+        self.cf_class = []
+        self.agent = []
+        self.fact = []
+        self.identity = []
+        self.compound = []
+
+    def to_dict(self):
+        '''Get the filter as a :py:class:`dict`. Filter lists aren't
+        copied.'''
+        return {
+            'cf_class': self.cf_class,
+            'agent': self.agent,
+            'fact': self.fact,
+            'identity': self.identity,
+            'compound': self.compound,
+        }
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+
+def _freeze(value):
+    '''Get an hashable representation for filter values.'''
+    if isinstance(value, collections.Mapping):
+        return tuple(sorted((key, _freeze(item))
+                            for key, item in six.iteritems(value)))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class CompiledFilter(collections.Mapping):
+    '''Immutable and hashable canonical form of a filter. Build it using
+    :py:meth:`Filter.compile`::
+
+        compiled = Filter().add_agent('package').compile()
+
+    Each filter list is sorted and de-duplicated, so filters selecting the
+    same nodes compile to equal objects no matter the order they were built
+    in, and they can be used as cache keys, e.g. for discovery results.
+
+    The filter dictionary sent on messages is built just once, so messages
+    using a compiled filter share it rather than copying the filter. That
+    dictionary must not be modified.
+    '''
+    __slots__ = ('_key', '_filter', '_hash')
+
+    def __init__(self, filter_):
+        key = []
+        self._filter = {}
+        for name in sorted(filter_):
+            unique = {}
+            for value in filter_[name]:
+                unique.setdefault(_freeze(value), value)
+
+            frozen = sorted(unique, key=repr)
+            key.append((name, tuple(frozen)))
+            self._filter[name] = [copy.deepcopy(unique[item])
+                                  for item in frozen]
+
+        self._key = tuple(key)
+        self._hash = hash(self._key)
+
+    def compile(self):
+        '''Compiled filters are already compiled, so return self.'''
+        return self
+
+    def to_dict(self):
+        '''Get the filter as a :py:class:`dict`. The same dictionary is
+        returned on every call, so it must not be modified.'''
+        return self._filter
+
+    def __getitem__(self, key):
+        return self._filter[key]
+
+    def __len__(self):
+        return len(self._filter)
+
+    def __iter__(self):
+        return six.iterkeys(self._filter)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, CompiledFilter):
+            return self._key == other._key
+        return super(CompiledFilter, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _filter_dict(filter_):
+    '''Get the filter dictionary for a message. Filters providing a
+    ``to_dict`` method are asked for it, so compiled filters aren't copied
+    and slotted ones skip the :py:class:`collections.Mapping` protocol.'''
+    try:
+        return filter_.to_dict()
+    except AttributeError:
+        return dict(filter_)
+
+
+def _build_prototype(agent, config, filter_, kwargs):
+    '''Build the message keys looked up from the configuration and
+    arguments, which are the same for every message sent with them.'''
+    if not filter_:
+        filter_ = Filter()
+
+    message = {}
+    try:
+        message[':senderid'] = config['identity']
+        message[':collective'] = (kwargs.get('collective', None) or
+                                  config['main_collective'])
+    except KeyError as error:
+        raise exc.ImproperlyConfigured(error)
+    message[':ttl'] = (kwargs.get('ttl', None) or
+                       config.getint('ttl', default=60))
+    message[':agent'] = agent
+    message[':filter'] = _filter_dict(filter_)
+    return message
+
+
+def _build_message(body, agent, config, filter_, kwargs):
+    '''Build a new MCollective message as a :py:class:`dict`.'''
+    message = _build_prototype(agent, config, filter_, kwargs)
+    message[':msgtime'] = int(time.time())
+    message[':requestid'] = hashlib.sha1(
+        str(message[':msgtime']).encode('utf-8')).hexdigest()
+    message[':body'] = body
+    return message
+
+
 class Message(collections.MutableMapping):
     '''Provides MCollective messages for pymco. This class implements
     :py:class:`collections.MutableMapping` interface, so it can be used as
     read/write mapping (dictionary).'''
     def __init__(self, body, agent, config, filter_=None, **kwargs):
-        if not filter_:
-            filter_ = Filter()
-
-        self._message = {}
-        try:
-            self._message[':senderid'] = config['identity']
-            self._message[':collective'] = (kwargs.get('collective', None) or
-                                            config['main_collective'])
-        except KeyError as error:
-            raise exc.ImproperlyConfigured(error)
-        self._message[':msgtime'] = int(time.time())
-        self._message[':ttl'] = (kwargs.get('ttl', None) or
-                                 config.getint('ttl', default=60))
-        self._message[':requestid'] = hashlib.sha1(
-            str(self._message[':msgtime']).encode('utf-8')).hexdigest()
-        self._message[':body'] = body
-        self._message[':agent'] = agent
-        self._message[':filter'] = dict(filter_)
+        self._message = _build_message(body, agent, config, filter_, kwargs)
 
     def __len__(self):
         return len(self._message)
@@ -101,8 +260,207 @@ class Message(collections.MutableMapping):
             raise ValueError('Keys must start with `:`, as Ruby symbols.')
 
         if key == ':filter':
-            value = dict(value)
+            value = _filter_dict(value)
         self._message[key] = value
 
     def __delitem__(self, key):
         del self._message[key]
+
+    def to_dict(self):
+        '''Get the message as a :py:class:`dict`, for serialization.
+
+        The message own dictionary is returned, not a copy, so it must not be
+        modified.
+        '''
+        return self._message
+
+    @classmethod
+    def from_dict(cls, message):
+        '''Build a message from a :py:class:`dict` holding every field,
+        without any configuration lookup. The given dictionary is used as
+        is, not copied.'''
+        msg = cls.__new__(cls)
+        msg._message = message
+        return msg
+
+
+class CompactMessage(collections.MutableMapping):
+    '''Same as :py:class:`Message`, but storing each MCollective field on its
+    own slot rather than in a dictionary, so it has a smaller memory
+    footprint and fields can be reached as attributes without the mapping
+    overhead, e.g. ``msg.body`` for ``msg[':body']``.
+
+    Keys other than MCollective message fields are still supported, but they
+    are kept in a dictionary.
+    '''
+    _fields = ('senderid', 'collective', 'msgtime', 'ttl', 'requestid',
+               'body', 'agent', 'filter', 'callerid', 'hash')
+    __slots__ = _fields + ('_extra',)
+    _keys = dict((':' + field, field) for field in _fields)
+
+    def __init__(self, body, agent, config, filter_=None, **kwargs):
+        self._extra = None
+        message = _build_message(body, agent, config, filter_, kwargs)
+        for key, value in six.iteritems(message):
+            setattr(self, self._keys[key], value)
+
+    @classmethod
+    def from_dict(cls, message):
+        '''Build a message from a :py:class:`dict` holding every field,
+        without any configuration lookup.'''
+        msg = cls.__new__(cls)
+        msg._extra = None
+        keys = cls._keys
+        for key, value in six.iteritems(message):
+            if key in keys:
+                setattr(msg, keys[key], value)
+            else:
+                msg[key] = value
+
+        return msg
+
+    def to_dict(self):
+        '''Get the message as a :py:class:`dict`, for serialization. Values
+        aren't copied.'''
+        message = {}
+        for key, field in six.iteritems(self._keys):
+            value = getattr(self, field, _MISSING)
+            if value is not _MISSING:
+                message[key] = value
+
+        if self._extra:
+            message.update(self._extra)
+
+        return message
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._keys[key])
+        except AttributeError:
+            raise KeyError(key)
+        except KeyError:
+            if self._extra is None:
+                raise
+            return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if not key.startswith(':'):
+            raise ValueError('Keys must start with `:`, as Ruby symbols.')
+
+        if key == ':filter':
+            value = _filter_dict(value)
+
+        if key in self._keys:
+            setattr(self, self._keys[key], value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, self._keys[key])
+        except AttributeError:
+            raise KeyError(key)
+        except KeyError:
+            if self._extra is None:
+                raise
+            del self._extra[key]
+
+
+class MessageTemplate(object):
+    '''Prototype for building many :py:class:`Message` instances with the
+    same agent, collective and filter. Use ``message_class`` keyword argument
+    for building :py:class:`CompactMessage` instances instead.
+
+    Sender id, collective, TTL, agent and filter are looked up and copied
+    just once, when the template is created, so each new message only fills
+    ``:msgtime``, ``:requestid`` and ``:body``::
+
+        template = MessageTemplate(agent='discovery', config=config)
+        msg = template.new(body='ping')
+
+    Request ids are random, since hashing the message time, as
+    :py:class:`Message` does, would repeat ids for messages created on the
+    same second. The ``:filter`` dictionary is shared by all messages built
+    from the same template, so it must not be modified in place.
+    '''
+    def __init__(self, agent, config, filter_=None, **kwargs):
+        self._prototype = _build_prototype(agent, config, filter_, kwargs)
+        self.message_class = kwargs.get('message_class', Message)
+
+    def new(self, body):
+        '''Build a new message with the given body.'''
+        message = self._prototype.copy()
+        message[':msgtime'] = int(time.time())
+        message[':requestid'] = uuid.uuid4().hex
+        message[':body'] = body
+        return self.message_class.from_dict(message)
+
+    __call__ = new
+
+
+class Reply(collections.Mapping):
+    '''Lazily decoded MCollective reply. This class implements
+    :py:class:`collections.Mapping` interface over the reply envelope, so
+    it can be used as a read only dict, but nothing is de-serialized until
+    it's needed.
+
+    The envelope (``:senderid``, ``:requestid``...) is de-serialized on first
+    key access, while the message body is only decoded when :py:attr:`body`
+    is accessed, so routing or de-duplicating replies never pays for body
+    decoding. Note ``reply[':body']`` is the body as found on the envelope,
+    which is still serialized for some security providers.
+
+    Listeners set :py:attr:`received_at` to the
+    :py:func:`timeit.default_timer` time the reply was received at.
+    '''
+    __slots__ = ('_frame', '_security', '_envelope', '_body', 'received_at')
+
+    def __init__(self, frame, security, received_at=None):
+        self._frame = frame
+        self._security = security
+        self._envelope = None
+        self._body = _MISSING
+        self.received_at = received_at
+
+    @property
+    def envelope(self):
+        '''De-serialized envelope, a :py:class:`dict`.'''
+        return self.load(body=False)._envelope
+
+    @property
+    def body(self):
+        '''Decoded reply body.'''
+        return self.load()._body
+
+    def load(self, body=True):
+        '''De-serialize the reply now, rather than on first access.
+
+        Args:
+            ``body``: whether to decode the body too, or just the envelope.
+        Returns:
+            ``reply``: this reply.
+        '''
+        if self._envelope is None:
+            self._envelope = self._security.deserialize(self._frame)
+        if body and self._body is _MISSING:
+            self._body = self._security.deserialize_body(
+                self._envelope[':body'])
+
+        return self
+
+    def __getitem__(self, key):
+        return self.envelope[key]
+
+    def __len__(self):
+        return len(self.envelope)
+
+    def __iter__(self):
+        return six.iterkeys(self.envelope)
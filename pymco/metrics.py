@@ -0,0 +1,391 @@
+"""
+:py:mod:`pymco.metrics`
+-----------------------
+Low overhead process metrics, exportable in Prometheus text format.
+
+Metrics live in a :py:class:`Registry`, :py:data:`REGISTRY` by default, where
+connectors, listeners, security providers, servers and RPC calls account
+what they do. Long running clients can expose them with
+:py:func:`start_http_server`, or render them with :py:func:`exposition`::
+
+    from pymco import metrics
+    metrics.start_http_server(9108)
+
+``pymco_rpc_replies`` counts the replies gathered by each RPC call, as many as
+it expected or those arriving before its timeout, see
+:py:meth:`pymco.rpc.SimpleAction.call`, and 0 for calls timing out. Every
+received reply, including those arriving after the call returned, is
+counted by ``pymco_messages_received_total``.
+
+Metrics may have labels, in which case values are kept for each label
+values combination, see :py:meth:`Metric.labels`. Hot paths should bind
+labelled children once and keep them around, rather than looking them up on
+every update.
+"""
+import abc
+import bisect
+import math
+import threading
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+#: Default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+                   5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == math.floor(value) and abs(value) < 1e15:
+        return '{0:.1f}'.format(value)
+    return repr(float(value))
+
+
+def _escape_label(value):
+    return (six.text_type(value).replace('\\', r'\\')
+            .replace('\n', r'\n').replace('"', r'\"'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape_label(value))
+                          for name, value in pairs) + '}'
+
+
+class MetricBase(object):
+    """Base abstract class for metrics.
+
+    Params:
+        ``name``: metric name.
+
+        ``documentation``: metric help text.
+
+        ``labelnames``: label names, if any.
+    """
+    type_ = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *args, **kwargs):
+        """Get the child metric for the given label values.
+
+        Values can be given by position or by label name.
+        """
+        if kwargs:
+            args = tuple(kwargs[name] for name in self.labelnames)
+        if len(args) != len(self.labelnames):
+            raise ValueError('Expected labels {0}'.format(self.labelnames))
+
+        key = tuple(six.text_type(arg) for arg in args)
+        child = self._children.get(key, None)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+
+        return child
+
+    def _root(self):
+        try:
+            return self._children[()]
+        except KeyError:
+            raise ValueError('Metric {0} has labels {1}'.format(
+                self.name, self.labelnames))
+
+    def samples(self):
+        """Get the metric samples.
+
+        Returns:
+            ``samples``: list of ``(name, labels, value)`` tuples, where
+            ``labels`` is the already formatted label set.
+        """
+        samples = []
+        for key, child in sorted(self._children.items()):
+            samples.extend(child.samples(self.name, self.labelnames, key))
+        return samples
+
+    def expose(self):
+        """Render the metric in Prometheus text format."""
+        lines = ['# HELP {0} {1}'.format(
+            self.name,
+            self.documentation.replace('\\', r'\\').replace('\n', r'\n')),
+            '# TYPE {0} {1}'.format(self.name, self.type_)]
+        lines.extend('{0}{1} {2}'.format(name, labels, _format_value(value))
+                     for name, labels, value in self.samples())
+        return '\n'.join(lines) + '\n'
+
+
+def _new_child(self):
+    """Create the value holding a single labelled child of the metric."""
+
+
+# Building Metaclass here for Python 2/3 compatibility
+Metric = abc.ABCMeta('Metric', (MetricBase,), {
+    '_new_child': abc.abstractmethod(_new_child),
+})
+
+
+class _Value(object):
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = float(value)
+
+    def get(self):
+        return self.value
+
+    def samples(self, name, labelnames, key):
+        return [(name, _format_labels(labelnames, key), self.value)]
+
+
+class _CounterValue(_Value):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        with self._lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+    type_ = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        """Increment the counter by the given amount."""
+        self._root().inc(amount)
+
+    def get(self):
+        return self._root().get()
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+    type_ = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._root().inc(amount)
+
+    def dec(self, amount=1):
+        self._root().dec(amount)
+
+    def set(self, value):
+        self._root().set(value)
+
+    def get(self):
+        return self._root().get()
+
+
+class _HistogramValue(object):
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def samples(self, name, labelnames, key):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            samples.append((name + '_bucket',
+                            _format_labels(labelnames, key,
+                                           (('le', _format_value(bound)),)),
+                            cumulative))
+        labels = _format_labels(labelnames, key)
+        samples.append((name + '_count', labels, cumulative))
+        samples.append((name + '_sum', labels, total))
+        return samples
+
+
+class Histogram(Metric):
+    """Distribution of observed values over the given bucket upper
+    bounds."""
+    type_ = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(bucket) for bucket in buckets
+                                    if bucket != float('inf')))
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        """Account an observed value."""
+        self._root().observe(value)
+
+    @property
+    def count(self):
+        return self._root().count
+
+    @property
+    def sum(self):
+        return self._root().sum
+
+
+class Registry(object):
+    """Collection of metrics, indexed by name."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Register a metric, returning the already registered one if any
+        metric with the same name and type exists.
+
+        Raises:
+            :py:exc:`ValueError`: if a different metric type was registered
+            with the same name.
+        """
+        with self._lock:
+            current = self._metrics.setdefault(metric.name, metric)
+        if type(current) is not type(metric):
+            raise ValueError('Metric {0} already registered as {1}'.format(
+                metric.name, current.type_))
+        return current
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames,
+                                       buckets))
+
+    def get(self, name):
+        """Get a registered metric by name, ``None`` if missing."""
+        return self._metrics.get(name, None)
+
+    def __iter__(self):
+        return iter([self._metrics[name] for name in sorted(self._metrics)])
+
+    def expose(self):
+        """Render every metric in Prometheus text format."""
+        return ''.join(metric.expose() for metric in self)
+
+
+#: Default registry.
+REGISTRY = Registry()
+
+
+def exposition(registry=None):
+    """Render the given registry, the default one if none, in Prometheus
+    text format."""
+    return (registry or REGISTRY).expose()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_http_server(port, addr='', registry=None):
+    """Serve the given registry, the default one if none, in Prometheus
+    text format from a daemon thread.
+
+    Returns:
+        ``server``: the HTTP server, call its ``shutdown`` method to stop
+        it.
+    """
+    registry = registry or REGISTRY
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            output = registry.expose().encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(output)))
+            self.end_headers()
+            self.wfile.write(output)
+
+        def log_message(self, *args):
+            pass
+
+    server = _ThreadingHTTPServer((addr, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+MESSAGES_SENT = REGISTRY.counter(
+    'pymco_messages_sent_total', 'Messages published to the middleware.')
+MESSAGES_RECEIVED = REGISTRY.counter(
+    'pymco_messages_received_total',
+    'Messages received from the middleware.', ('kind',))
+MESSAGES_DROPPED = REGISTRY.counter(
+    'pymco_messages_dropped_total',
+    'Received messages dropped without being processed.', ('reason',))
+VERIFICATION_FAILURES = REGISTRY.counter(
+    'pymco_verification_failures_total',
+    'Messages failing security verification.')
+TASK_FAILURES = REGISTRY.counter(
+    'pymco_server_task_failures_total',
+    'Server worker tasks failing, such as reply publishes.')
+RPC_LATENCY = REGISTRY.histogram(
+    'pymco_rpc_latency_seconds', 'RPC call duration.')
+REPLY_FANIN = REGISTRY.histogram(
+    'pymco_rpc_replies', 'Replies returned per RPC call.',
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000))
+IN_FLIGHT = REGISTRY.gauge(
+    'pymco_rpc_in_flight', 'RPC calls waiting for replies.')
+BUFFERED_REPLIES = REGISTRY.gauge(
+    'pymco_buffered_replies',
+    'Replies received by listeners and not yet consumed.')
+
+# Bound children, for hot paths.
+REPLIES_RECEIVED = MESSAGES_RECEIVED.labels(kind='reply')
+REQUESTS_RECEIVED = MESSAGES_RECEIVED.labels(kind='request')
+REGISTRATIONS_RECEIVED = MESSAGES_RECEIVED.labels(kind='registration')
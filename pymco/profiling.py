@@ -0,0 +1,145 @@
+"""
+:py:mod:`pymco.profiling`
+-------------------------
+Opt-in profiling of RPC calls.
+
+Profiling is enabled by setting the ``PYMCO_PROFILE_DIR`` environment
+variable, or the ``pymco.profile_dir`` configuration option, to a
+directory. Every profiled call then runs under :py:mod:`cProfile` and
+:py:mod:`tracemalloc`, writing to that directory, for each call:
+
+``<name>-<timestamp>-<pid>-<number>.prof``
+    :py:mod:`cProfile` stats, to be loaded with :py:class:`pstats.Stats`.
+
+``<name>-<timestamp>-<pid>-<number>.tracemalloc``
+    allocations snapshot taken when the call ends, to be loaded with
+    :py:meth:`tracemalloc.Snapshot.load`.
+
+``<name>-<timestamp>-<pid>-<number>.allocations.txt``
+    lines allocating the most memory during the call.
+
+Allocation tracking needs :py:mod:`tracemalloc`, so it's skipped on Python
+versions lacking it.
+"""
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+ENVIRONMENT_VARIABLE = 'PYMCO_PROFILE_DIR'
+CONFIG_KEY = 'pymco.profile_dir'
+
+#: Number of frames stored for each allocation traceback.
+TRACEMALLOC_FRAMES = 10
+
+#: Number of lines written to allocation summaries.
+TOP_ALLOCATIONS = 50
+
+_counter = itertools.count(1)
+
+
+def get_profile_dir(config):
+    """Get the directory profiles should be written to, ``None`` when
+    profiling is disabled. The environment variable takes precedence over
+    configuration."""
+    return (os.environ.get(ENVIRONMENT_VARIABLE, None) or
+            config.get(CONFIG_KEY, default=None))
+
+
+class CallProfile(object):
+    """Context manager profiling the code run within it.
+
+    Params:
+        ``directory``: directory profiles are written to, created if
+        missing.
+
+        ``name``: prefix for profile file names.
+    """
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.path = None
+        self.profile = None
+        self._tracemalloc = None
+        self._started_tracemalloc = False
+        self._snapshot = None
+
+    def __enter__(self):
+        self.path = os.path.join(self.directory, '{0}-{1}-{2}-{3}'.format(
+            self.name, time.strftime('%Y%m%dT%H%M%S'), os.getpid(),
+            next(_counter)))
+        self._start_tracemalloc()
+        self.profile = cProfile.Profile()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another profiler is already running.
+            logger.warning('Unable to profile %s, a profiler is already '
+                           'active', self.name)
+            self.profile = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profile is not None:
+            self.profile.disable()
+        try:
+            self.write()
+        except Exception:
+            logger.exception('Unable to write profile %s', self.path)
+        finally:
+            self._stop_tracemalloc()
+        return False
+
+    def _start_tracemalloc(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            return
+
+        self._tracemalloc = tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        self._snapshot = tracemalloc.take_snapshot()
+
+    def _stop_tracemalloc(self):
+        if self._started_tracemalloc:
+            self._tracemalloc.stop()
+
+    def write(self):
+        """Write profile and allocation files."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        if self.profile is not None:
+            self.profile.dump_stats(self.path + '.prof')
+
+        if self._tracemalloc is None:
+            return
+
+        snapshot = self._tracemalloc.take_snapshot()
+        snapshot.dump(self.path + '.tracemalloc')
+        with open(self.path + '.allocations.txt', 'w') as output:
+            for stat in snapshot.compare_to(self._snapshot,
+                                            'lineno')[:TOP_ALLOCATIONS]:
+                output.write('{0}\n'.format(stat))
+
+
+def profiled(method):
+    """Decorator profiling the given method calls when profiling is
+    enabled for the instance ``config``."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        directory = get_profile_dir(self.config)
+        if not directory:
+            return method(self, *args, **kwargs)
+
+        name = '{0}.{1}'.format(type(self).__name__, method.__name__)
+        with CallProfile(directory, name):
+            return method(self, *args, **kwargs)
+
+    return wrapper
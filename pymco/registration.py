@@ -0,0 +1,195 @@
+"""
+:py:mod:`pymco.registration`
+----------------------------
+MCollective registration messages consumer.
+
+MCollective servers can periodically publish registration messages, which
+are requests for the ``registration`` agent carrying node facts, classes and
+agents. :py:class:`RegistrationConsumer` subscribes to them and keeps a
+:py:class:`pymco.inventory.Inventory` up to date::
+
+    consumer = RegistrationConsumer(config, inventory.Inventory(path))
+    consumer.run()
+"""
+import threading
+import time
+
+from six.moves import queue
+
+from . import listener
+from . import message
+from . import metrics
+
+
+class Stats(object):
+    """Registration consumer throughput stats."""
+    def __init__(self):
+        self.started = time.time()
+        self.received = 0
+        self.stored = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def rate(self):
+        """Stored messages per second since stats were started."""
+        elapsed = time.time() - self.started
+        return self.stored / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        """Get the stats as a :py:class:`dict`."""
+        return {
+            'received': self.received,
+            'stored': self.stored,
+            'failed': self.failed,
+            'batches': self.batches,
+            'rate': self.rate,
+        }
+
+
+class RegistrationConsumer(object):
+    """Long running registration messages consumer.
+
+    Messages are queued by the connection receiver thread and decoded in
+    batches, so each batch is stored on a single inventory transaction.
+
+    Params:
+        ``config``: :py:class:`pymco.config.Config` instance.
+
+        ``store``: :py:class:`pymco.inventory.Inventory` instance, or any
+        object with the same ``update_many`` method.
+
+        ``batch_size``: maximum number of messages stored at once.
+
+        ``collective``: collective registration messages are sent to, by
+        default ``registration_collective`` option or the main collective.
+
+        ``agent``: registration agent name.
+    """
+    def __init__(self, config, store, batch_size=100, **kwargs):
+        self.config = config
+        self.store = store
+        self.batch_size = batch_size
+        self.agent = kwargs.get('agent', 'registration')
+        self.collective = (
+            kwargs.get('collective', None) or
+            config.get('registration_collective', default=None) or
+            config['main_collective'])
+        self.queue = queue.Queue()
+        self.stats = Stats()
+        self._connector = kwargs.get('connector', None)
+        self._security = None
+        self._stopped = threading.Event()
+
+    @property
+    def connector(self):
+        """Connector property."""
+        if not self._connector:
+            self._connector = self.config.get_connector()
+
+        return self._connector
+
+    @property
+    def security(self):
+        """Security provider property."""
+        if not self._security:
+            self._security = self.config.get_security()
+
+        return self._security
+
+    def get_target(self):
+        """Registration messages target."""
+        return self.connector.get_target(agent=self.agent,
+                                         collective=self.collective)
+
+    def start(self):
+        """Connect and subscribe to registration messages."""
+        self._stopped.clear()
+        self.connector.connect(wait=True)
+        self.connector.add_listener(
+            'registration', listener.QueueListener(self.queue))
+        self.connector.subscribe(destination=self.get_target())
+        return self
+
+    def stop(self):
+        """Stop consuming and disconnect."""
+        self._stopped.set()
+        self.connector.disconnect()
+        return self
+
+    def decode(self, frame):
+        """Decode and verify a registration message.
+
+        Returns:
+            ``node``: node data, as returned by
+            :py:meth:`pymco.inventory.Inventory.parse_registration`.
+        """
+        reply = self.security.verify(message.Reply(frame, self.security))
+        return self.store.parse_registration(reply)
+
+    def get_batch(self, timeout=1):
+        """Wait for a message and get it along with any other queued one.
+
+        Returns:
+            ``frames``: list of up to ``batch_size`` frames, empty if nothing
+            arrived before the timeout.
+        """
+        try:
+            frames = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        while len(frames) < self.batch_size:
+            try:
+                frames.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return frames
+
+    def process_batch(self, timeout=1):
+        """Decode and store the next batch of messages.
+
+        Messages failing to be decoded or verified are counted and dropped.
+
+        Returns:
+            ``count``: number of stored nodes.
+        """
+        frames = self.get_batch(timeout=timeout)
+        if not frames:
+            return 0
+
+        nodes = []
+        for frame in frames:
+            try:
+                nodes.append(self.decode(frame))
+            except Exception:
+                self.stats.failed += 1
+                metrics.MESSAGES_DROPPED.labels('unverified').inc()
+
+        stored = self.store.update_many(nodes) if nodes else 0
+        self.stats.received += len(frames)
+        metrics.REGISTRATIONS_RECEIVED.inc(len(frames))
+        self.stats.stored += stored
+        self.stats.batches += 1
+        return stored
+
+    def run(self, duration=None, timeout=1):
+        """Consume registration messages until :py:meth:`stop` is called or
+        the given duration, in seconds, elapses.
+
+        Returns:
+            ``stats``: consumer :py:class:`Stats`.
+        """
+        self.start()
+        deadline = None if duration is None else time.time() + duration
+        try:
+            while not self._stopped.is_set():
+                if deadline is not None and time.time() >= deadline:
+                    break
+                self.process_batch(timeout=timeout)
+        finally:
+            if not self._stopped.is_set():
+                self.stop()
+
+        return self.stats
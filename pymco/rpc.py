@@ -3,10 +3,117 @@
 -------------------
 MCollective RPC calls support.
 """
+import contextlib
+import logging
+import timeit
+
+from . import exc
+from . import metrics
+from . import profiling
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+#: Callables called with the :py:class:`CallTiming` of every finished
+#: :py:meth:`SimpleAction.call`, after the action own ``timing_hook``.
+timing_hooks = []
+
+
+class CallTiming(object):
+    """Latency breakdown for a single RPC call.
+
+    Every phase is the time it took, in seconds, or ``None`` if it didn't
+    happen. ``first_reply`` and ``last_reply`` are measured from the moment
+    the request was published. ``decode`` and ``verify`` hold the time spent
+    on each reply, only filled when replies are decoded by the call.
+
+    Only replies returned by the call are timed. :py:class:`SimpleAction`
+    gathers replies until it has the ``expected`` count or the timeout
+    expires, see :py:meth:`SimpleAction.call`, so ``last_reply`` is the
+    arrival of the last gathered reply; replies arriving later are never
+    seen by the call.
+    """
+    PHASES = ('resolve', 'connect', 'subscribe', 'sign', 'serialize',
+              'publish', 'first_reply', 'last_reply', 'disconnect', 'total')
+
+    def __init__(self):
+        for phase in self.PHASES:
+            setattr(self, phase, None)
+        self.replies = 0
+        self.decode = []
+        self.verify = []
+        self.published_at = None
+
+    @contextlib.contextmanager
+    def measure(self, phase):
+        """Context manager adding the time spent within it to ``phase``."""
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            elapsed = timeit.default_timer() - start
+            setattr(self, phase, (getattr(self, phase) or 0) + elapsed)
+
+    def add_replies(self, replies):
+        """Account the given replies arrival times.
+
+        Args:
+            ``replies``: iterable of :py:class:`pymco.message.Reply`.
+        """
+        for reply in replies:
+            self.replies += 1
+            received_at = getattr(reply, 'received_at', None)
+            if received_at is None or self.published_at is None:
+                continue
+            elapsed = received_at - self.published_at
+            if self.first_reply is None or elapsed < self.first_reply:
+                self.first_reply = elapsed
+            if self.last_reply is None or elapsed > self.last_reply:
+                self.last_reply = elapsed
+
+    def as_dict(self):
+        """Timing as a :py:class:`dict`, suitable for logging or exporting."""
+        timing = dict((phase, getattr(self, phase)) for phase in self.PHASES)
+        timing['replies'] = self.replies
+        timing['decode'] = list(self.decode)
+        timing['verify'] = list(self.verify)
+        return timing
+
+    def __repr__(self):
+        return '<CallTiming {0}>'.format(', '.join(
+            '{0}={1:.6f}'.format(phase, getattr(self, phase))
+            for phase in self.PHASES if getattr(self, phase) is not None))
+
+
+class Result(list):
+    """Replies from a RPC call, with its :py:class:`CallTiming` as
+    ``timing``."""
+    def __init__(self, replies=(), timing=None):
+        super(Result, self).__init__(replies)
+        self.timing = timing
+
+
+def run_timing_hooks(timing, hooks):
+    """Call the given hooks with ``timing``, logging their errors, so
+    instrumentation never breaks a call."""
+    for hook in hooks:
+        try:
+            hook(timing)
+        except Exception:
+            logger.exception('RPC timing hook %r failed', hook)
 
 
 class SimpleAction(object):
-    """Single RPC call to MCollective"""
+    """Single RPC call to MCollective
+
+    If the broker connection is lost while waiting for replies, the call
+    reconnects and sends the request again, up to ``resends`` times, 1 by
+    default, within the call timeout.
+
+    Requests are sent with the broker side expiry of the connector, see
+    :py:meth:`pymco.connector.BaseConnector.get_message_headers`, and the
+    given ``priority``, if any, instead of the configured one.
+    """
     def __init__(self, config, msg, agent, **kwargs):
         self.config = config
         self.msg = msg
@@ -14,6 +121,10 @@ class SimpleAction(object):
         self._connector = None
         self.collective = (kwargs.get('collective', None) or
                            self.config['main_collective'])
+        self.timing_hook = kwargs.get('timing_hook', None)
+        self.resends = kwargs.get('resends', 1)
+        self.priority = kwargs.get('priority', None)
+        self.timing = None
 
     @property
     def connector(self):
@@ -35,18 +146,158 @@ class SimpleAction(object):
         return self.connector.get_reply_target(collective=self.collective,
                                                agent=self.agent)
 
-    def call(self, timeout=5):
+    @profiling.profiled
+    def call(self, timeout=5, decode=False, expected=1):
         """Make the RPC call.
 
         It should subscribe to the reply target, execute the RPC call and wait
         for the result.
+
+        Replies are gathered until ``expected`` of them arrived or the
+        timeout expired, whatever happens first. Replies already buffered
+        when that count is reached are returned too, so there may be more.
+
+        Every call is timed, see :py:class:`CallTiming`; the timing is kept
+        as :py:attr:`timing`, set on the result and passed to the
+        ``timing_hook`` given to the action and to every
+        :py:data:`timing_hooks`. Calls can also be profiled, see
+        :py:mod:`pymco.profiling`.
+
+        Args:
+            ``timeout``: how long to wait for replies, in seconds.
+
+            ``decode``: whether to verify and decode replies before
+            returning, timing every one of them, instead of leaving them to
+            be lazily decoded.
+
+            ``expected``: how many replies to wait for, such as the number of
+            discovered nodes, or ``None`` to gather them until the timeout.
+        Returns:
+            ``result``: :py:class:`Result` with the received replies.
+
+        Raises:
+            :py:exc:`pymco.exc.TimeoutError`: if no reply was received.
+
+            :py:exc:`pymco.exc.ConnectionLostError`: if the connection was
+            lost before any reply and the request couldn't be sent again.
         """
-        self.connector.connect(wait=True)
-        reply_target = self.get_reply_target()
-        self.connector.subscribe(destination=reply_target)
-        self.connector.send(self.msg,
-                            self.get_target(),
-                            **{'reply-to': reply_target})
-        result = self.connector.receive(timeout=timeout)
-        self.connector.disconnect()
+        timing = self.timing = CallTiming()
+        start = timeit.default_timer()
+        metrics.IN_FLIGHT.inc()
+        try:
+            with tracing.span('rpc.call', agent=self.agent,
+                              collective=self.collective) as span:
+                if span:
+                    span.update(tracing.message_attributes(self.msg))
+                result = self._call(timing, timeout, decode, expected)
+                span.set('replies', timing.replies)
+        finally:
+            timing.total = timeit.default_timer() - start
+            metrics.IN_FLIGHT.dec()
+            metrics.RPC_LATENCY.observe(timing.total)
+            metrics.REPLY_FANIN.observe(timing.replies)
+            hooks = [self.timing_hook] if self.timing_hook else []
+            run_timing_hooks(timing, hooks + timing_hooks)
+
         return result
+
+    def _call(self, timing, timeout, decode, expected):
+        with timing.measure('resolve'):
+            connector = self.connector
+            security = connector.security
+            reply_target = self.get_reply_target()
+            target = self.get_target()
+            headers = self.get_send_headers(connector, reply_target)
+        with timing.measure('connect'):
+            connector.connect(wait=True)
+        with timing.measure('subscribe'):
+            connector.get_response_listener()
+            connector.subscribe(
+                destination=reply_target,
+                **connector.get_reply_subscription_headers())
+        with tracing.span('security.encode') as span:
+            with timing.measure('sign'):
+                signed = security.sign(self.msg)
+            with timing.measure('serialize'):
+                body = security.serialize(signed)
+            if span:
+                span.update(tracing.message_attributes(self.msg))
+                span.set('bytes', len(body))
+        with timing.measure('publish'):
+            connector.send_encoded(body, target, **headers)
+        timing.published_at = timeit.default_timer()
+        try:
+            result = Result(self._receive(connector, timing, timeout,
+                                          expected, body, target, headers),
+                            timing)
+        finally:
+            connector.unsubscribe(reply_target)
+        timing.add_replies(result)
+        if decode:
+            self.decode(result, security, timing)
+        with timing.measure('disconnect'):
+            connector.disconnect()
+        return result
+
+    def get_send_headers(self, connector, reply_target):
+        """Get the headers the request is sent with."""
+        headers = dict(connector.get_message_headers(self.msg))
+        headers['reply-to'] = reply_target
+        if self.priority is not None:
+            headers['priority'] = self.priority
+
+        return headers
+
+    def _receive(self, connector, timing, timeout, expected, body, target,
+                 headers):
+        deadline = timing.published_at + timeout
+        replies = received = self._receive_first(connector, timing, timeout,
+                                                 body, target, headers)
+        while received and (expected is None or len(replies) < expected):
+            timeout = deadline - timeit.default_timer()
+            if timeout <= 0:
+                break
+            try:
+                received = list(connector.receive(timeout=timeout))
+            except (exc.TimeoutError, exc.ConnectionLostError):
+                # Replies were already received, so the request is not
+                # sent again and the call returns them.
+                break
+            replies = replies + received
+
+        return replies
+
+    def _receive_first(self, connector, timing, timeout, body, target,
+                       headers):
+        deadline = timing.published_at + timeout
+        resends = self.resends
+        while True:
+            try:
+                return list(connector.receive(timeout=timeout))
+            except exc.ConnectionLostError:
+                timeout = deadline - timeit.default_timer()
+                if resends <= 0 or timeout <= 0:
+                    raise
+                resends -= 1
+                logger.warning('Connection lost waiting for replies, '
+                               'sending the request again')
+
+            with timing.measure('connect'):
+                connector.reconnect(wait=True)
+            with timing.measure('publish'):
+                connector.send_encoded(body, target, **headers)
+
+    @staticmethod
+    def decode(replies, security, timing):
+        """Verify and decode the given replies, timing every one."""
+        for reply in replies:
+            with tracing.span('security.decode'):
+                start = timeit.default_timer()
+                reply.load(body=False)
+                decoded = timeit.default_timer()
+                security.verify(reply)
+                verified = timeit.default_timer()
+                reply.load()
+                end = timeit.default_timer()
+            timing.verify.append(verified - decoded)
+            timing.decode.append(decoded - start + end - verified)
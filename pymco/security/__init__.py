@@ -1,6 +1,8 @@
 """MCollective security provider implementations."""
 import abc
 
+from .. import tracing
+
 
 class SecurityProviderBase(object):
     """Abstract base class for security providers."""
@@ -9,6 +11,17 @@ class SecurityProviderBase(object):
         'ssl': 'pymco.security.ssl.SSLProvider',
     }
 
+    # Providers for the server side, when they differ from client ones.
+    server_plugins = {
+        'ssl': 'pymco.security.ssl.SSLServerProvider',
+    }
+
+    # Options naming the serializer of providers where it's configurable,
+    # the rest use YAML.
+    serializer_options = {
+        'ssl': 'plugin.ssl_serializer',
+    }
+
     def __init__(self, config):
         """Abstract method to be overriden for subclasses.
 
@@ -37,6 +50,33 @@ class SecurityProviderBase(object):
         """
         return self.serializer.deserialize(message)
 
+    def serialize_body(self, body):
+        """Encode the body of a message before serializing it.
+
+        Counterpart of :py:meth:`deserialize_body`. By default the body is
+        returned unchanged.
+
+        Args:
+            ``body``: message ``:body`` value.
+        Returns:
+            ``body``: encoded body.
+        """
+        return body
+
+    def deserialize_body(self, body):
+        """Decode the body of an already de-serialized message.
+
+        Some security providers serialize the message body on its own before
+        serializing the whole message, so it needs a second de-serialization.
+        By default the body is returned unchanged.
+
+        Args:
+            ``body``: message ``:body`` value.
+        Returns:
+            ``body``: decoded body.
+        """
+        return body
+
     def encode(self, msg):
         """Encode given message using provided security method.
 
@@ -49,7 +89,13 @@ class SecurityProviderBase(object):
         Returns:
             ``msg``: Encoded message.
         """
-        return self.serialize(self.sign(msg))
+        with tracing.span('security.encode') as span:
+            if span:
+                span.update(tracing.message_attributes(msg))
+            encoded = self.serialize(self.sign(msg))
+            if span:
+                span.set('bytes', len(encoded))
+            return encoded
 
     def decode(self, msg):
         """Decode given message using provided security method.
@@ -63,7 +109,13 @@ class SecurityProviderBase(object):
         Returns:
             ``msg``: Decoded message, a :py:class:`dict` like object.
         """
-        return self.verify(self.deserialize(msg))
+        with tracing.span('security.decode') as span:
+            if span:
+                span.set('bytes', len(msg))
+            decoded = self.verify(self.deserialize(msg))
+            if span:
+                span.update(tracing.message_attributes(decoded))
+            return decoded
 
 
 def sign(self, message):
@@ -14,6 +14,7 @@ except ImportError:
     print('You need install pycrypto for using SSL security provider')
 
 from .. import exc
+from .. import metrics
 from . import SecurityProvider
 from .. import utils
 
@@ -25,12 +26,19 @@ class SSLProvider(SecurityProvider):
     http://docs.puppetlabs.com/mcollective/reference/plugins/security_ssl.html
     for further information.
     """
+    # Attributes caching each loaded key.
+    _key_caches = {
+        'plugin.ssl_server_public': '_server_public_key',
+        'plugin.ssl_client_private': '_private_key',
+    }
+
     def __init__(self, config):
         super(SSLProvider, self).__init__(config=config)
         self._private_key = None
         self._server_public_key = None
         self._caller_id = None
         self._serializer = None
+        self._last_hash = (None, None)
 
     def sign(self, message):
         """Implement :py:meth:`pymco.security.SecurityProvider.sign`."""
@@ -41,15 +49,39 @@ class SSLProvider(SecurityProvider):
     def verify(self, message):
         """Implement :py:meth:`pymco.security.SecurityProvider.verify`."""
         hash_ = SHA.new(message[':body'].encode('utf8'))
-        verifier = PKCS1_v1_5.new(self.server_public_key)
+        verifier = PKCS1_v1_5.new(self.get_public_key(message))
         signature = base64.b64decode(message[':hash'])
 
         if not verifier.verify(hash_, signature):
+            metrics.VERIFICATION_FAILURES.inc()
             raise exc.VerificationError(
                 'Message {0} can\'t be verified'.format(message))
 
         return message
 
+    def get_public_key(self, message):
+        """Get the public key for verifying the given message.
+
+        Clients verify replies using the server public key.
+        """
+        return self.server_public_key
+
+    def serialize_body(self, body):
+        """Re-implement :py:meth:`pymco.security.SecurityProvider.serialize_body`.
+
+        MCollective SSL security provider serializes the message body before
+        hashing it.
+        """
+        return self.serialize(body)
+
+    def deserialize_body(self, body):
+        """Re-implement :py:meth:`pymco.security.SecurityProvider.deserialize_body`.
+
+        MCollective SSL security provider serializes the message body before
+        hashing it, so it must be de-serialized on its own.
+        """
+        return self.deserialize(body)
+
     def get_hash(self, message):
         """Get the hash for the given message.
 
@@ -59,11 +91,21 @@ class SSLProvider(SecurityProvider):
 
         Returns:
             ``hash``: Message hash so the receiver can verify the message.
+
+        The signature only covers the message body, so the last hash is kept
+        and re-used while the body doesn't change, e.g. when the same request
+        is sent to many collectives.
         """
+        body, hash_ = self._last_hash
+        if hash_ is not None and body == message[':body']:
+            return hash_
+
         hashed_signature = SHA.new(message[':body'].encode('utf8'))
         signer = PKCS1_v1_5.new(self.private_key)
         hashed_signature = signer.sign(hashed_signature)
-        return base64.b64encode(hashed_signature)
+        hash_ = base64.b64encode(hashed_signature)
+        self._last_hash = (message[':body'], hash_)
+        return hash_
 
     @property
     def callerid(self):
@@ -81,7 +123,8 @@ class SSLProvider(SecurityProvider):
 
     def _load_rsa_key(self, key, cache):
         if not cache:
-            cache = self._server_public_key = utils.load_rsa_key(self.config[key])
+            cache = utils.load_rsa_key(self.config[key])
+            setattr(self, self._key_caches[key], cache)
 
         return cache
 
@@ -110,3 +153,50 @@ class SSLProvider(SecurityProvider):
             self._serializer = self.config.get_serializer('plugin.ssl_serializer')
 
         return self._serializer
+
+
+class SSLServerProvider(SSLProvider):
+    """Provide SSL security provider plugin for the server side.
+
+    Replies are signed using the server private key, while requests are
+    verified using the public key of their caller, which is looked up on the
+    ``plugin.ssl_client_cert_dir`` directory.
+    """
+    def __init__(self, config):
+        super(SSLServerProvider, self).__init__(config=config)
+        self._client_public_keys = {}
+
+    def sign(self, message):
+        """Implement :py:meth:`pymco.security.SecurityProvider.sign`.
+
+        Replies carry the hash only, as MCollective servers do.
+        """
+        message[':hash'] = self.get_hash(message)
+        return message
+
+    def get_public_key(self, message):
+        """Get the public key of the caller for the given request."""
+        name = message[':callerid'].split('=', 1)[-1]
+        if name not in self._client_public_keys:
+            if not name or os.path.basename(name) != name:
+                raise exc.VerificationError(
+                    'Invalid caller id {0}'.format(message[':callerid']))
+
+            filename = os.path.join(self.config['plugin.ssl_client_cert_dir'],
+                                    '{0}.pem'.format(name))
+            try:
+                self._client_public_keys[name] = utils.load_rsa_key(filename)
+            except (IOError, OSError):
+                raise exc.VerificationError(
+                    'No public key for caller {0}'.format(name))
+
+        return self._client_public_keys[name]
+
+    @property
+    def private_key(self):
+        """Property returning the server private key after being loaded."""
+        if not self._private_key:
+            self._private_key = utils.load_rsa_key(
+                self.config['plugin.ssl_server_private'])
+
+        return self._private_key
@@ -4,6 +4,7 @@ py:mod:`pymco.serializers`
 pymco Message [de]serialization.
 """
 import abc
+import collections
 
 
 def serialize(self, msg):
@@ -25,11 +26,38 @@ def deserialize(self, msg):
         ``msg``: de-serialized message.
     """
 
+
+def to_dict(msg):
+    """Get the given message as a :py:class:`dict`.
+
+    Messages providing a ``to_dict`` method, such as
+    :py:class:`pymco.message.Message`, are asked for it, so they can avoid
+    copying themselves, otherwise the message is copied into a new
+    dictionary. Any other value, such as a message body, is returned
+    unchanged.
+
+    Params:
+        ``msg``: message, a dict-like object.
+    Returns:
+        ``msg``: message as a :py:class:`dict`.
+    """
+    try:
+        return msg.to_dict()
+    except AttributeError:
+        if isinstance(msg, collections.Mapping):
+            return dict(msg)
+        return msg
+
+
 # Building Metaclass here for Python 2/3 compatibility
 SerializerBase = abc.ABCMeta('SerializerBase', (object,), {
     'serialize': abc.abstractmethod(serialize),
     'deserialize': abc.abstractmethod(deserialize),
+    # Whether serialized messages are binary data rather than text.
+    'binary': False,
     'plugins': {
+        'json': 'pymco.serializers.json.Serializer',
+        'msgpack': 'pymco.serializers.msgpack.Serializer',
         'yaml': 'pymco.serializers.yaml.Serializer',
     }
 })
@@ -0,0 +1,25 @@
+"""
+:py:mod:`pymco.serializers.json`
+--------------------------------
+JSON [de]serialization for pymco messages.
+
+Ruby symbol keys (``:body``, ``:senderid``...) are kept as plain ``:``
+prefixed strings, so they round-trip unchanged. Since MCollective doesn't
+ship a JSON serializer this is only useful when both ends are under our
+control.
+"""
+from __future__ import absolute_import
+
+import json
+
+from . import SerializerBase
+from . import to_dict
+
+
+class Serializer(SerializerBase):
+    """JSON serializer."""
+    def serialize(self, msg):
+        return json.dumps(to_dict(msg), separators=(',', ':'))
+
+    def deserialize(self, msg):
+        return json.loads(msg)
@@ -0,0 +1,36 @@
+"""
+:py:mod:`pymco.serializers.msgpack`
+-----------------------------------
+MessagePack [de]serialization for pymco messages.
+
+Ruby symbol keys (``:body``, ``:senderid``...) are kept as plain ``:``
+prefixed strings, so they round-trip unchanged. Since MCollective doesn't
+ship a MessagePack serializer this is only useful when both ends are under
+our control.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+
+from . import SerializerBase
+from . import to_dict
+
+try:
+    import msgpack
+except ImportError as exc:
+    print("You must install msgpack in order to use msgpack serializer.")
+    raise exc
+
+
+class Serializer(SerializerBase):
+    """MessagePack serializer.
+
+    Frames are binary, so the STOMP connection must not try to decode them as
+    text, see :py:meth:`pymco.connector.BaseConnector.default_connection`.
+    """
+    binary = True
+
+    def serialize(self, msg):
+        return msgpack.packb(to_dict(msg), use_bin_type=True)
+
+    def deserialize(self, msg):
+        return msgpack.unpackb(msg, raw=False)
@@ -2,6 +2,7 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 from . import SerializerBase
+from . import to_dict
 
 try:
     import yaml
@@ -12,7 +13,7 @@ except ImportError as exc:
 
 class Serializer(SerializerBase):
     def serialize(self, msg):
-        return yaml.safe_dump(dict(msg))
+        return yaml.safe_dump(to_dict(msg))
 
     def deserialize(self, msg):
         return yaml.safe_load(msg)
@@ -0,0 +1,590 @@
+"""
+:py:mod:`pymco.server`
+----------------------
+Pure Python MCollective server runtime.
+
+:py:class:`Server` uses the same configuration, connectors, security
+providers and serializers than pymco clients. It subscribes to the topics of
+its registered agents, and to the direct requests queue, evaluates incoming
+request filters locally and runs matching requests on a bounded worker pool,
+publishing signed replies::
+
+    class Echo(server.RPCAgent):
+        name = 'echo'
+
+        def echo(self, data, request):
+            return data
+
+    mcollectived = server.Server(config, agents=[Echo()])
+    mcollectived.run()
+"""
+import abc
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import six
+from six.moves import queue
+
+from . import listener
+from . import matcher
+from . import message
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+#: MCollective RPC status codes.
+OK = 0
+RPC_ABORTED = 1
+UNKNOWN_RPC_ACTION = 2
+MISSING_RPC_DATA = 3
+INVALID_RPC_DATA = 4
+UNKNOWN_RPC_ERROR = 5
+
+
+class AgentBase(object):
+    """Base abstract class for server agents.
+
+    Subclasses must set :py:attr:`name` and implement :py:meth:`handle`.
+    Agents may run on worker processes, so they should be picklable.
+    """
+    name = None
+
+
+def handle(self, body, request):
+    """Handle a request.
+
+    Params:
+        ``body``: decoded request body.
+
+        ``request``: request envelope, a :py:class:`dict`.
+    Returns:
+        ``body``: reply body.
+    """
+
+
+# Building Metaclass here for Python 2/3 compatibility
+Agent = abc.ABCMeta('Agent', (AgentBase,), {
+    'handle': abc.abstractmethod(handle),
+})
+
+
+class DiscoveryAgent(Agent):
+    """MCollective ``discovery`` agent, answering pings."""
+    name = 'discovery'
+
+    def handle(self, body, request):
+        if body == 'ping':
+            return 'pong'
+
+
+class RPCAgent(Agent):
+    """Base class for SimpleRPC agents.
+
+    Each action is a method named after it, taking the request data and the
+    request envelope and returning the reply data. Methods may raise
+    :py:exc:`RPCError` in order to reply a status code other than ``OK``.
+    """
+    def handle(self, body, request):
+        action = body.get(':action') or ''
+        method = getattr(self, action, None)
+        if (action.startswith('_') or hasattr(RPCAgent, action) or
+                not callable(method)):
+            return self.reply(UNKNOWN_RPC_ACTION,
+                              'Unknown action {0} for agent {1}'.format(
+                                  action, self.name))
+
+        try:
+            data = method(body.get(':data', {}), request)
+        except RPCError as error:
+            return self.reply(error.code, error.args[0])
+        except Exception as error:
+            logger.exception('Action %s of agent %s failed', action,
+                             self.name)
+            return AgentFailure(self.reply(UNKNOWN_RPC_ERROR, str(error)))
+
+        return self.reply(OK, 'OK', data)
+
+    @staticmethod
+    def reply(statuscode, statusmsg, data=None):
+        """Build a SimpleRPC reply body."""
+        return {':statuscode': statuscode,
+                ':statusmsg': statusmsg,
+                ':data': data or {}}
+
+
+class RPCError(Exception):
+    """Exception to be raised by :py:class:`RPCAgent` actions.
+
+    Params:
+        ``message``: reply status message.
+
+        ``code``: reply status code, :py:data:`RPC_ABORTED` by default.
+    """
+    def __init__(self, message, code=RPC_ABORTED):
+        super(RPCError, self).__init__(message)
+        self.code = code
+
+
+class AgentFailure(dict):
+    """Reply body for a request an agent failed to handle, a SimpleRPC
+    reply with :py:data:`UNKNOWN_RPC_ERROR` status.
+
+    Being a distinct type, failures are told apart from replies even when
+    agents run on worker processes, so servers can account them.
+    """
+
+
+def run_agent(agent, body, request):
+    """Run an agent, as worker pools do.
+
+    Returns:
+        ``result``: reply body, an :py:class:`AgentFailure` if the agent
+        failed.
+    """
+    try:
+        return agent.handle(body, request)
+    except Exception as error:
+        logger.exception('Agent %s failed handling request %s', agent.name,
+                         request.get(':requestid', None))
+        return AgentFailure(RPCAgent.reply(UNKNOWN_RPC_ERROR, str(error)))
+
+
+class WorkerPool(object):
+    """Bounded pool of worker threads.
+
+    At most ``backlog`` tasks wait for a worker, further submissions block,
+    which holds back the connection receiver thread and so the broker.
+    """
+    def __init__(self, size=4, backlog=100):
+        self.size = size
+        self.tasks = queue.Queue(maxsize=backlog)
+        self.threads = []
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start worker threads."""
+        for _ in range(self.size - len(self.threads)):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        return self
+
+    def submit(self, fnc, args=(), callback=None):
+        """Run ``fnc(*args)`` on a worker, then ``callback`` with its result
+        if given."""
+        self.tasks.put((fnc, args, callback))
+
+    def stop(self):
+        """Stop workers once they have finished pending tasks."""
+        for _ in self.threads:
+            self.tasks.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+        return self
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+
+            fnc, args, callback = task
+            try:
+                result = fnc(*args)
+                if callback is not None:
+                    callback(result)
+            except Exception:
+                logger.exception('Worker task %r failed', fnc)
+                with self._lock:
+                    self.failed += 1
+                metrics.TASK_FAILURES.inc()
+
+
+def _run_task(fnc, *args):
+    """Run ``fnc(*args)`` on a worker process, returning whether it failed
+    along with its result or error, since Python 2 pools lack
+    ``error_callback``."""
+    try:
+        return False, fnc(*args)
+    except Exception as error:
+        return True, error
+
+
+def _task_done(done, error, outcome):
+    failed, result = outcome
+    if failed:
+        error(result)
+    else:
+        done(result)
+
+
+class ProcessWorkerPool(object):
+    """Bounded pool of worker processes, for CPU bound agents.
+
+    Agents and request data are pickled to the workers, while callbacks run
+    on the current process. At most ``backlog`` tasks are pending at once,
+    further submissions block.
+    """
+    def __init__(self, size=4, backlog=100):
+        self.size = size
+        self.pool = None
+        self.failed = 0
+        self._slots = threading.BoundedSemaphore(backlog)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start worker processes."""
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.size)
+
+        return self
+
+    def submit(self, fnc, args=(), callback=None):
+        """Run ``fnc(*args)`` on a worker, then ``callback`` with its result
+        if given.
+
+        The backlog slot is released whether the task succeeds or fails, so
+        failing tasks never hold back further submissions.
+        """
+        self._slots.acquire()
+
+        def done(result):
+            self._slots.release()
+            if callback is not None:
+                try:
+                    callback(result)
+                except Exception:
+                    logger.exception('Worker task callback %r failed',
+                                     callback)
+                    self._fail()
+
+        def error(exc):
+            self._slots.release()
+            logger.error('Worker task %r failed: %s', fnc, exc)
+            self._fail()
+
+        if six.PY3:
+            self.pool.apply_async(fnc, args, callback=done,
+                                  error_callback=error)
+        else:
+            self.pool.apply_async(
+                _run_task, (fnc,) + tuple(args),
+                callback=functools.partial(_task_done, done, error))
+
+    def _fail(self):
+        with self._lock:
+            self.failed += 1
+        metrics.TASK_FAILURES.inc()
+
+    def stop(self):
+        """Stop workers once they have finished pending tasks."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        return self
+
+
+def build_reply(identity, request, body, security=None):
+    """Build the reply envelope for the given request.
+
+    Params:
+        ``identity``: replying node identity.
+
+        ``request``: request envelope.
+
+        ``body``: reply body.
+
+        ``security``: security provider used to serialize the body. If not
+        given, the body must be already serialized.
+    Returns:
+        ``reply``: reply envelope, a :py:class:`dict`, ready to be encoded.
+    """
+    return {
+        ':senderid': identity,
+        ':requestid': request[':requestid'],
+        ':senderagent': request[':agent'],
+        ':msgtime': int(time.time()),
+        ':body': body if security is None else security.serialize_body(body),
+    }
+
+
+def load_facts(config):
+    """Load node facts from YAML files, as MCollective ``yaml`` fact source.
+
+    Files are taken from the ``plugin.yaml`` option, separated by ``:``.
+    """
+    if config.get('factsource', default='yaml') != 'yaml':
+        return {}
+
+    import yaml
+    facts = {}
+    for filename in config.get('plugin.yaml', default='').split(':'):
+        if filename and os.path.exists(filename):
+            with open(filename, 'rt') as facts_file:
+                facts.update(yaml.safe_load(facts_file) or {})
+
+    return facts
+
+
+def load_classes(config):
+    """Load configuration management classes from ``classesfile``."""
+    filename = config.get('classesfile',
+                          default='/var/lib/puppet/state/classes.txt')
+    if not os.path.exists(filename):
+        return []
+
+    with open(filename, 'rt') as classes_file:
+        return [line.strip() for line in classes_file if line.strip()]
+
+
+class Server(object):
+    """MCollective server.
+
+    Params:
+        ``config``: :py:class:`pymco.config.Config` instance.
+
+        ``agents``: iterable of :py:class:`Agent` instances. The discovery
+        agent is always registered.
+
+        ``pool``: worker pool, by default a :py:class:`WorkerPool` with
+        ``workers`` threads and ``backlog`` pending tasks.
+
+        ``facts``: node facts, loaded from configuration by default.
+
+        ``classes``: node classes, loaded from configuration by default.
+
+        ``connector``: connector instance, built from configuration by
+        default.
+    """
+    def __init__(self, config, agents=(), workers=4, backlog=100, **kwargs):
+        self.config = config
+        self.identity = config['identity']
+        self.collectives = [
+            collective.strip() for collective in
+            config.get('collectives', default=config['main_collective']
+                       ).split(',') if collective.strip()]
+        self.agents = {}
+        self.pool = kwargs.get('pool', None) or WorkerPool(workers, backlog)
+        self.facts = kwargs.get('facts', None)
+        if self.facts is None:
+            self.facts = load_facts(config)
+        self.classes = kwargs.get('classes', None)
+        if self.classes is None:
+            self.classes = load_classes(config)
+        self.matcher = matcher.FilterMatcher(self.identity,
+                                             facts=self.facts,
+                                             classes=self.classes)
+        self.stats = dict.fromkeys(('received', 'invalid', 'filtered',
+                                    'expired', 'unverified', 'processed',
+                                    'failed', 'replied'), 0)
+        self._stats_lock = threading.Lock()
+        self._reconnect_lock = threading.Lock()
+        self._connector = kwargs.get('connector', None)
+        self._security = None
+        self._subscribed = []
+        self._stopped = threading.Event()
+
+        self.register(DiscoveryAgent())
+        for agent in agents:
+            self.register(agent)
+
+    @property
+    def connector(self):
+        """Connector property."""
+        if not self._connector:
+            self._connector = self.config.get_connector()
+
+        return self._connector
+
+    @property
+    def security(self):
+        """Server side security provider property."""
+        if not self._security:
+            self._security = self.config.get_server_security()
+
+        return self._security
+
+    def register(self, agent):
+        """Register an agent, replacing any agent with the same name."""
+        self.agents[agent.name] = agent
+        self.matcher.update(agents=self.agents)
+        return self
+
+    def get_subscriptions(self):
+        """Get the destinations to subscribe to.
+
+        Returns:
+            ``subscriptions``: list of two-tuples with the destination and a
+            dict of subscription headers.
+        """
+        subscriptions = []
+        for collective in self.collectives:
+            for agent in sorted(self.agents):
+                subscriptions.append((
+                    self.connector.get_target(agent=agent,
+                                              collective=collective),
+                    {}))
+
+            direct = self.connector.get_direct_subscription(collective)
+            if direct is not None:
+                subscriptions.append(direct)
+
+        return subscriptions
+
+    def start(self):
+        """Start workers, connect and subscribe."""
+        self._stopped.clear()
+        self.pool.start()
+        self.connector.connect(wait=True)
+        self.connector.add_listener(
+            'server', listener.CallbackListener(self.on_request))
+        self.connector.add_listener(
+            'server_lost', listener.ConnectionLostListener(
+                self.on_connection_lost))
+        for destination, headers in self.get_subscriptions():
+            self.connector.subscribe(destination, **headers)
+            self._subscribed.append(destination)
+
+        return self
+
+    def stop(self):
+        """Unsubscribe, disconnect and stop workers."""
+        self._stopped.set()
+        while self._subscribed:
+            self.connector.unsubscribe(self._subscribed.pop())
+        self.connector.disconnect()
+        self.pool.stop()
+        return self
+
+    def run(self, duration=None):
+        """Serve requests until :py:meth:`stop` is called or the given
+        duration, in seconds, elapses."""
+        self.start()
+        try:
+            self._stopped.wait(duration)
+        finally:
+            if not self._stopped.is_set():
+                self.stop()
+
+    def on_connection_lost(self):
+        """Reconnect, from a new thread, when the broker connection is lost
+        while the server is running."""
+        if self._stopped.is_set():
+            return
+
+        thread = threading.Thread(target=self.reconnect,
+                                  name='pymco-reconnect')
+        thread.daemon = True
+        thread.start()
+
+    def reconnect(self):
+        """Connect again and subscribe to every destination, unless the
+        server is stopped or already connected again."""
+        with self._reconnect_lock:
+            if self._stopped.is_set() or self.connector.is_connected():
+                return
+            logger.warning('Connection to the broker lost, reconnecting')
+            try:
+                self.connector.reconnect(wait=True)
+            except Exception:
+                logger.exception('Unable to reconnect to the broker')
+
+    def count(self, stat):
+        """Increment the given :py:attr:`stats` counter. Stats are updated
+        from both the receiver and worker threads."""
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def matches(self, filter_):
+        """Check whether the current node matches the given wire filter."""
+        return self.matcher.matches(filter_)
+
+    def on_request(self, headers, frame):
+        """Handle an incoming request frame.
+
+        Malformed requests, requests for unknown agents, not matching the
+        node, expired or failing verification are dropped; the rest are run
+        on the worker pool. Agent and filter checks only need the envelope,
+        so dropped requests never get their body deserialized.
+
+        This runs on the connection receiver thread, which stops on any
+        error, so errors are never raised.
+
+        Returns:
+            ``accepted``: whether the request was accepted.
+        """
+        self.count('received')
+        metrics.REQUESTS_RECEIVED.inc()
+        request = message.Reply(frame, self.security)
+        try:
+            agent = self.agents.get(request[':agent'])
+            filtered = (agent is None or
+                        not self.matches(request.get(':filter', {})))
+            expired = (not filtered and
+                       request[':msgtime'] + request[':ttl'] < time.time())
+        except Exception:
+            logger.debug('Dropping malformed request', exc_info=True)
+            self.count('invalid')
+            metrics.MESSAGES_DROPPED.labels('invalid').inc()
+            return False
+
+        if filtered:
+            self.count('filtered')
+            metrics.MESSAGES_DROPPED.labels('filtered').inc()
+            return False
+
+        if expired:
+            self.count('expired')
+            metrics.MESSAGES_DROPPED.labels('expired').inc()
+            return False
+
+        try:
+            self.security.verify(request)
+            body = request.body
+        except Exception:
+            self.count('unverified')
+            metrics.MESSAGES_DROPPED.labels('unverified').inc()
+            return False
+
+        envelope = dict(request)
+        self.pool.submit(run_agent,
+                         (agent, body, envelope),
+                         functools.partial(self.reply, envelope, headers))
+        return True
+
+    def reply(self, request, headers, body):
+        """Sign and publish the reply to the given request.
+
+        Replies are sent to the request ``reply-to`` header, falling back to
+        the connector reply target. Agent failures are accounted, in the
+        ``failed`` stat and the task failures metric, and replied too.
+        """
+        self.count('processed')
+        if body is None:
+            return
+        if isinstance(body, AgentFailure):
+            self.count('failed')
+            metrics.TASK_FAILURES.inc()
+            body = dict(body)
+
+        reply = build_reply(self.identity, request, body, self.security)
+        destination = headers.get('reply-to', None)
+        if not destination:
+            destination = self.connector.get_reply_target(
+                agent=request[':agent'],
+                collective=request[':collective'])
+
+        self.connector.send_encoded(self.security.encode(reply), destination)
+        self.count('replied')
@@ -0,0 +1,555 @@
+"""
+:py:mod:`pymco.test.broker`
+---------------------------
+In process STOMP broker stand-in, for load testing and benchmarks.
+
+:py:class:`Broker` speaks enough STOMP 1.0, 1.1 and 1.2 for ``stomp.py`` and
+pymco connectors to connect to it on localhost, subscribe, send and receive
+messages, without a running ActiveMQ or RabbitMQ::
+
+    broker = Broker().start()
+    config = broker.configure(config)
+    ...
+    broker.stop()
+
+Destinations under ``/queue/`` and ``/temp-queue/`` have queue semantics,
+each message goes to one subscriber and messages sent while there are no
+subscribers are kept until one subscribes. Any other destination, like
+``/topic/`` and ``/exchange/`` ones, fans messages out to every subscriber.
+Only ``header = 'value'`` selectors, as used by MCollective direct
+addressing, are supported. Subscriptions with ``client`` or
+``client-individual`` acknowledgement and a prefetch window, given by the
+``activemq.prefetchSize`` or ``prefetch-count`` header, are only delivered
+that many unacknowledged messages, further ones being held until ``ACK``
+frames make room.
+
+In process code, like :py:class:`pymco.test.fleet.Fleet`, can also
+:py:meth:`Broker.subscribe` and :py:meth:`Broker.publish` directly, skipping
+the network.
+"""
+import collections
+import itertools
+import re
+import socket
+import threading
+import time
+
+import six
+from six.moves import socketserver
+
+from .. import config as _config
+
+QUEUE_PREFIXES = ('/queue/', '/temp-queue/')
+
+_SELECTOR_RE = re.compile(r"^\s*([\w.-]+)\s*=\s*'([^']*)'\s*$")
+_ESCAPES = (('\\', '\\\\'), ('\r', '\\r'), ('\n', '\\n'), (':', '\\c'))
+_UNESCAPE_RE = re.compile(r'\\[\\rnc]')
+_UNESCAPES = dict((escaped, char) for char, escaped in _ESCAPES)
+#: Frame headers not forwarded to subscribers.
+_SEND_HEADERS = ('content-length', 'receipt', 'transaction')
+#: Subscription headers setting a prefetch window.
+_PREFETCH_HEADERS = ('activemq.prefetchSize', 'prefetch-count')
+
+Frame = collections.namedtuple('Frame', ('command', 'headers', 'body'))
+
+
+def escape(value):
+    """Escape a STOMP 1.1+ header value."""
+    for char, escaped in _ESCAPES:
+        value = value.replace(char, escaped)
+    return value
+
+
+def unescape(value):
+    """Unescape a STOMP 1.1+ header value."""
+    return _UNESCAPE_RE.sub(lambda match: _UNESCAPES[match.group(0)], value)
+
+
+def pack(command, headers, body=b'', escaped=True):
+    """Pack a STOMP frame.
+
+    Params:
+        ``command``: frame command.
+
+        ``headers``: frame headers dictionary.
+
+        ``body``: frame body, either bytes or text.
+
+        ``escaped``: whether to escape header values, as STOMP 1.1+ does.
+    Returns:
+        ``frame``: frame bytes.
+    """
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+
+    lines = [command]
+    for key, value in six.iteritems(headers):
+        value = six.text_type(value)
+        if escaped:
+            key, value = escape(key), escape(value)
+        lines.append(u'{0}:{1}'.format(key, value))
+
+    lines.append(u'content-length:{0}'.format(len(body)))
+    return (u'\n'.join(lines) + u'\n\n').encode('utf-8') + body + b'\x00'
+
+
+def parse(buffer, escaped=True):
+    """Parse all complete STOMP frames from the given buffer.
+
+    Params:
+        ``buffer``: received bytes, a :py:class:`bytearray`. Parsed frames are
+        removed from it.
+
+        ``escaped``: whether header values are escaped, as STOMP 1.1+ does.
+    Returns:
+        ``frames``: list of :py:class:`Frame`.
+    """
+    frames = []
+    while True:
+        # Heart-beats are just end of lines between frames.
+        start = 0
+        while start < len(buffer) and buffer[start] in b'\r\n':
+            start += 1
+        del buffer[:start]
+
+        end = buffer.find(b'\n\n')
+        crlf_end = buffer.find(b'\r\n\r\n')
+        if crlf_end != -1 and (end == -1 or crlf_end < end):
+            end, separator = crlf_end, 4
+        else:
+            separator = 2
+        if end == -1:
+            return frames
+
+        lines = buffer[:end].decode('utf-8').splitlines()
+        command, headers = lines[0], {}
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            if escaped and command not in ('CONNECT', 'STOMP'):
+                key, value = unescape(key), unescape(value)
+            # Repeated headers: the first one wins.
+            headers.setdefault(key, value)
+
+        body_start = end + separator
+        if 'content-length' in headers:
+            body_end = body_start + int(headers['content-length'])
+            if len(buffer) <= body_end:
+                return frames
+        else:
+            body_end = buffer.find(b'\x00', body_start)
+            if body_end == -1:
+                return frames
+
+        frames.append(Frame(command, headers,
+                            bytes(buffer[body_start:body_end])))
+        del buffer[:body_end + 1]
+
+
+class Subscription(object):
+    """Broker subscription.
+
+    Params:
+        ``destination``: subscribed destination.
+
+        ``callback``: callable taking message headers and body.
+
+        ``selector``: optional ``header = 'value'`` selector.
+    """
+    __slots__ = ('destination', 'callback', 'selector', 'id')
+
+    def __init__(self, destination, callback, selector=None, id=None):
+        self.destination = destination
+        self.callback = callback
+        self.id = id
+        self.selector = None
+        if selector:
+            match = _SELECTOR_RE.match(selector)
+            if match is None:
+                raise ValueError('Unsupported selector {0}'.format(selector))
+            self.selector = match.groups()
+
+    def matches(self, headers):
+        """Check whether a message with the given headers is selected."""
+        if self.selector is None:
+            return True
+        header, value = self.selector
+        return headers.get(header, None) == value
+
+
+class _Flow(object):
+    """Prefetch window of a client subscription."""
+    __slots__ = ('window', 'unacked', 'held')
+
+    def __init__(self, window):
+        self.window = window
+        self.unacked = set()
+        self.held = collections.deque()
+
+
+class Broker(object):
+    """In process STOMP broker.
+
+    Params:
+        ``host``: address to listen on.
+
+        ``port``: port to listen on, by default any free port.
+
+        ``backlog``: maximum number of messages kept for each queue without
+        subscribers.
+
+        ``heartbeat``: interval, in seconds, the broker offers to send STOMP
+        1.1+ heart-beats at, 0 to never send them. While :py:attr:`silent`
+        is set, heart-beats are not sent, as if the broker was dead.
+    """
+    def __init__(self, host='127.0.0.1', port=0, backlog=100000,
+                 heartbeat=0):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.heartbeat = heartbeat
+        self.silent = False
+        self.stats = dict.fromkeys(('connections', 'received', 'delivered',
+                                    'dropped'), 0)
+        self._server = None
+        self._thread = None
+        self._lock = threading.RLock()
+        self._subscriptions = collections.defaultdict(list)
+        self._pending = collections.defaultdict(collections.deque)
+        self._message_ids = itertools.count(1)
+        self._round_robin = itertools.count()
+
+    @property
+    def host_and_port(self):
+        """Two-tuple with the host and the port the broker listens on."""
+        return self.host, self.port
+
+    def start(self):
+        """Start listening for connections."""
+        broker = self
+
+        class Handler(_ConnectionHandler):
+            pass
+        Handler.broker = broker
+
+        self._server = _Server((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop listening and close every client connection."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.close_connections()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+        return self
+
+    def configure(self, config):
+        """Get a copy of the given configuration connecting to this broker.
+
+        Params:
+            ``config``: :py:class:`pymco.config.Config` instance.
+        Returns:
+            ``config``: new :py:class:`pymco.config.Config` instance.
+        """
+        configdict = dict(config.config)
+        connector = configdict['connector']
+        if connector == 'stomp':
+            configdict['plugin.stomp.host'] = self.host
+            configdict['plugin.stomp.port'] = str(self.port)
+            configdict.setdefault('plugin.stomp.user', 'mcollective')
+            configdict.setdefault('plugin.stomp.password', 'secret')
+            return _config.Config(configdict)
+
+        prefix = 'plugin.{0}.pool.'.format(connector)
+        for key in list(configdict):
+            if key.startswith(prefix):
+                del configdict[key]
+
+        configdict.update({
+            prefix + 'size': '1',
+            prefix + '1.host': self.host,
+            prefix + '1.port': str(self.port),
+            prefix + '1.user': 'mcollective',
+            prefix + '1.password': 'secret',
+        })
+        if connector == 'rabbitmq':
+            configdict.setdefault('plugin.rabbitmq.vhost', '/mcollective')
+
+        return _config.Config(configdict)
+
+    def subscribe(self, destination, callback, selector=None, id=None):
+        """Subscribe the given callback to a destination.
+
+        Params:
+            ``destination``: destination to subscribe to.
+
+            ``callback``: callable taking message headers and body, called on
+            the publisher thread.
+
+            ``selector``: optional ``header = 'value'`` selector.
+        Returns:
+            ``subscription``: a :py:class:`Subscription` instance.
+        """
+        subscription = Subscription(destination, callback, selector, id)
+        with self._lock:
+            self._subscriptions[destination].append(subscription)
+            pending = self._pending.pop(destination, ())
+
+        for headers, body in pending:
+            self.publish(destination, body, headers)
+
+        return subscription
+
+    def subscribers(self, destination):
+        """Get the number of subscriptions to the given destination."""
+        with self._lock:
+            return len(self._subscriptions.get(destination, ()))
+
+    def unsubscribe(self, subscription):
+        """Remove the given subscription."""
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.destination,
+                                                    [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.destination, None)
+
+    def purge(self, destination=None):
+        """Drop messages kept for the given queue, or for every queue.
+
+        Returns:
+            ``purged``: number of dropped messages.
+        """
+        with self._lock:
+            if destination is None:
+                pending, self._pending = (self._pending,
+                                          collections.defaultdict(
+                                              collections.deque))
+                return sum(len(messages) for messages in pending.values())
+
+            return len(self._pending.pop(destination, ()))
+
+    def publish(self, destination, body, headers=None):
+        """Publish a message.
+
+        Params:
+            ``destination``: message destination.
+
+            ``body``: message body.
+
+            ``headers``: optional message headers.
+        Returns:
+            ``delivered``: number of subscribers the message was delivered to.
+        """
+        headers = dict(headers or {})
+        headers['destination'] = destination
+        headers.setdefault('message-id', 'pymco-{0}'.format(
+            next(self._message_ids)))
+        with self._lock:
+            self.stats['received'] += 1
+            subscriptions = [subscription for subscription in
+                             self._subscriptions.get(destination, ())
+                             if subscription.matches(headers)]
+            if subscriptions and destination.startswith(QUEUE_PREFIXES):
+                subscriptions = [subscriptions[next(self._round_robin) %
+                                               len(subscriptions)]]
+            elif not subscriptions:
+                if destination.startswith(QUEUE_PREFIXES):
+                    pending = self._pending[destination]
+                    if len(pending) < self.backlog:
+                        pending.append((headers, body))
+                        return 0
+                self.stats['dropped'] += 1
+                return 0
+            self.stats['delivered'] += len(subscriptions)
+
+        for subscription in subscriptions:
+            subscription.callback(headers, body)
+
+        return len(subscriptions)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        socketserver.TCPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+
+    def close_connections(self):
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    """STOMP client connection handler."""
+    broker = None
+    versions = ('1.0', '1.1', '1.2')
+
+    def setup(self):
+        self.server.connections.add(self.request)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.write_lock = threading.Lock()
+        self.flow_lock = threading.Lock()
+        self.subscriptions = {}
+        self.flows = {}
+        self.escaped = False
+        self.connected = True
+        with self.broker._lock:
+            self.broker.stats['connections'] += 1
+
+    def finish(self):
+        self.connected = False
+        for subscription in list(self.subscriptions.values()):
+            self.broker.unsubscribe(subscription)
+        self.server.connections.discard(self.request)
+
+    def handle(self):
+        buffer = bytearray()
+        while self.connected:
+            try:
+                data = self.request.recv(65536)
+            except socket.error:
+                return
+            if not data:
+                return
+
+            buffer.extend(data)
+            for frame in parse(buffer, self.escaped):
+                handler = getattr(self, 'on_' + frame.command.lower(), None)
+                if handler is not None:
+                    handler(frame)
+                if 'receipt' in frame.headers:
+                    self.write('RECEIPT',
+                               {'receipt-id': frame.headers['receipt']})
+                if frame.command == 'DISCONNECT':
+                    return
+
+    def write(self, command, headers, body=b''):
+        frame = pack(command, headers, body,
+                     self.escaped and command != 'CONNECTED')
+        with self.write_lock:
+            try:
+                self.request.sendall(frame)
+            except socket.error:
+                self.connected = False
+
+    def on_connect(self, frame):
+        accepted = frame.headers.get('accept-version', '1.0').split(',')
+        version = max([version for version in self.versions
+                       if version in accepted] or ['1.0'])
+        self.escaped = version != '1.0'
+        headers = {'session': 'pymco-{0}'.format(id(self)),
+                   'server': 'pymco-broker'}
+        if version != '1.0':
+            headers.update({'version': version, 'heart-beat': '0,0'})
+            interval = self.get_heartbeat_interval(frame)
+            if interval:
+                headers['heart-beat'] = '{0},0'.format(int(interval * 1000))
+                thread = threading.Thread(target=self.send_heartbeats,
+                                          args=(interval,))
+                thread.daemon = True
+                thread.start()
+        self.write('CONNECTED', headers)
+
+    def get_heartbeat_interval(self, frame):
+        """Get the interval heart-beats are sent at, in seconds, as
+        negotiated with the client, 0 if none are sent."""
+        try:
+            wanted = int(frame.headers.get('heart-beat',
+                                           '0,0').split(',')[1])
+        except (IndexError, ValueError):
+            wanted = 0
+        if not wanted or not self.broker.heartbeat:
+            return 0
+        return max(wanted / 1000.0, self.broker.heartbeat)
+
+    def send_heartbeats(self, interval):
+        while self.connected:
+            time.sleep(interval)
+            if self.broker.silent:
+                continue
+            with self.write_lock:
+                try:
+                    self.request.sendall(b'\n')
+                except socket.error:
+                    self.connected = False
+
+    on_stomp = on_connect
+
+    def on_subscribe(self, frame):
+        subscription_id = frame.headers.get('id',
+                                            frame.headers['destination'])
+        flow = self.get_flow(frame.headers)
+        if flow is not None:
+            self.flows[subscription_id] = flow
+
+        def deliver(headers, body):
+            headers = dict(headers, subscription=subscription_id)
+            if flow is None:
+                self.write('MESSAGE', headers, body)
+                return
+            with self.flow_lock:
+                if len(flow.unacked) >= flow.window:
+                    flow.held.append((headers, body))
+                    return
+                flow.unacked.add(headers['message-id'])
+                self.write('MESSAGE', headers, body)
+
+        self.subscriptions[subscription_id] = self.broker.subscribe(
+            frame.headers['destination'],
+            deliver,
+            selector=frame.headers.get('selector', None),
+            id=subscription_id)
+
+    @staticmethod
+    def get_flow(headers):
+        """Get the prefetch window for a subscription with the given
+        headers, ``None`` if it has none."""
+        if headers.get('ack', 'auto') == 'auto':
+            return None
+        for header in _PREFETCH_HEADERS:
+            if header in headers:
+                return _Flow(int(headers[header]))
+
+        return None
+
+    def on_ack(self, frame):
+        message_id = frame.headers.get('message-id',
+                                       frame.headers.get('id', None))
+        with self.flow_lock:
+            for flow in self.flows.values():
+                if message_id in flow.unacked:
+                    flow.unacked.discard(message_id)
+                    while flow.held and len(flow.unacked) < flow.window:
+                        headers, body = flow.held.popleft()
+                        flow.unacked.add(headers['message-id'])
+                        self.write('MESSAGE', headers, body)
+                    return
+
+    def on_unsubscribe(self, frame):
+        subscription_id = frame.headers.get('id',
+                                            frame.headers.get('destination'))
+        self.flows.pop(subscription_id, None)
+        subscription = self.subscriptions.pop(subscription_id, None)
+        if subscription is not None:
+            self.broker.unsubscribe(subscription)
+
+    def on_send(self, frame):
+        headers = dict((key, value)
+                       for key, value in six.iteritems(frame.headers)
+                       if key not in _SEND_HEADERS)
+        destination = headers.pop('destination')
+        self.broker.publish(destination, frame.body, headers)
@@ -0,0 +1,416 @@
+"""
+:py:mod:`pymco.test.fleet`
+--------------------------
+Simulated fleet of MCollective nodes, for load testing and benchmarks.
+
+:py:class:`Fleet` attaches any number of virtual nodes to an in process
+:py:class:`pymco.test.broker.Broker`. Nodes answer ``discovery`` pings and
+any configured agent, with replies encoded by the configured server security
+provider and serializer, as real nodes would do, and sent after a simulated
+latency::
+
+    broker = Broker().start()
+    config = broker.configure(config)
+    fleet = Fleet(broker, config, size=10000, latency=(0.01, 0.2),
+                  agents=[StaticAgent('rpcutil', {'ping': {'pong': 1}})])
+    fleet.start()
+    ...
+    fleet.stop()
+
+The fleet subscribes straight to the broker, so only the client under test
+goes through the network, and each request is decoded and verified once for
+the whole fleet. Filters are evaluated for each virtual node, with facts and
+classes given by ``facts`` and ``classes``, either fixed values or callables
+taking the node index.
+"""
+import functools
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+
+from .. import matcher
+from .. import message
+from .. import metrics
+from .. import server
+from . import broker as _broker
+
+ENVIRONMENTS = ('production', 'staging', 'development')
+
+#: Sender identity placeholder in reply templates.
+PLACEHOLDER = 'pymcofleetsenderid'
+
+_PLAIN_IDENTITY_RE = re.compile(r'^[A-Za-z][\w.-]*$')
+
+
+def default_facts(index):
+    """Default virtual node facts."""
+    return {
+        'environment': ENVIRONMENTS[index % len(ENVIRONMENTS)],
+        'processorcount': str(2 ** (index % 4 + 1)),
+        'index': str(index),
+    }
+
+
+class StaticAgent(server.RPCAgent):
+    """SimpleRPC agent answering canned data.
+
+    Params:
+        ``name``: agent name.
+
+        ``actions``: dict mapping action names to the reply data, or to a
+        callable taking the request data and envelope and returning it.
+    """
+    def __init__(self, name, actions):
+        self.name = name
+        self.actions = dict(actions)
+
+    def handle(self, body, request):
+        action = body.get(':action')
+        if action not in self.actions:
+            return self.reply(server.UNKNOWN_RPC_ACTION,
+                              'Unknown action {0} for agent {1}'.format(
+                                  action, self.name))
+
+        data = self.actions[action]
+        if callable(data):
+            data = data(body.get(':data', {}), request)
+
+        return self.reply(server.OK, 'OK', data)
+
+
+class VirtualNode(object):
+    """Virtual node state."""
+    __slots__ = ('identity', 'facts', 'classes')
+
+    def __init__(self, identity, facts, classes):
+        self.identity = identity
+        self.facts = facts
+        self.classes = frozenset(classes)
+
+
+class Fleet(object):
+    """Simulated fleet of MCollective nodes.
+
+    Params:
+        ``broker``: :py:class:`pymco.test.broker.Broker` instance.
+
+        ``config``: :py:class:`pymco.config.Config` instance, used for the
+        collectives, destinations and security.
+
+        ``size``: number of virtual nodes.
+
+        ``agents``: iterable of :py:class:`pymco.server.Agent` instances. The
+        discovery agent is always registered.
+
+        ``latency``: reply latency in seconds, either a number, a
+        ``(minimum, maximum)`` two-tuple for uniformly distributed latencies
+        or a callable taking the virtual node.
+
+        ``identity``: node identity format, taking the node index.
+
+        ``facts``: node facts, :py:func:`default_facts` by default.
+
+        ``classes``: node classes, none by default.
+
+        ``workers``: number of threads sending replies.
+
+        ``seed``: random seed for latencies.
+
+        ``templates``: whether to encode replies to a request once, as a
+        template where each node fills its identity in, rather than for every
+        node. Serializing is the bulk of the cost of a reply, so this keeps
+        the fleet from competing for CPU with the client under test. Binary
+        serializers and identities other than plain names always encode
+        every reply. Enabled by default.
+
+        ``security``: server side security provider, built from
+        configuration by default.
+
+        ``connector``: connector used for destination names, built from
+        configuration by default.
+    """
+    def __init__(self, broker, config, size=100, agents=(), latency=0,
+                 **kwargs):
+        self.broker = broker
+        self.config = config
+        self.collectives = [
+            collective.strip() for collective in
+            config.get('collectives', default=config['main_collective']
+                       ).split(',') if collective.strip()]
+        self.agents = {}
+        for agent in (server.DiscoveryAgent(),) + tuple(agents):
+            self.agents[agent.name] = agent
+        self.agent_names = frozenset(self.agents)
+        self.latency = latency
+        self.workers = kwargs.get('workers', 1)
+        self.templates = kwargs.get('templates', True)
+        self.random = random.Random(kwargs.get('seed', None))
+        self.security = (kwargs.get('security', None) or
+                         config.get_server_security())
+        self.connector = (kwargs.get('connector', None) or
+                          config.get_connector())
+        self.matcher = matcher.FilterMatcher(None)
+        self.stats = dict.fromkeys(('received', 'invalid', 'filtered',
+                                    'unverified', 'failed', 'replied'), 0)
+        self._stats_lock = threading.Lock()
+
+        identity = kwargs.get('identity', 'node{0:05d}')
+        facts = kwargs.get('facts', default_facts)
+        classes = kwargs.get('classes', ())
+        self.nodes = [VirtualNode(identity.format(index),
+                                  facts(index) if callable(facts) else facts,
+                                  classes(index) if callable(classes)
+                                  else classes)
+                      for index in range(size)]
+        self.nodes_by_identity = dict((node.identity, node)
+                                      for node in self.nodes)
+
+        self._subscriptions = []
+        self._threads = []
+        self._pending = []
+        self._running = 0
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = True
+        self._last_body = (None, None)
+        self._last_template = (None, None, None, None)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def pending(self):
+        """Number of replies waiting to be sent."""
+        return len(self._pending)
+
+    def get_latency(self, node):
+        """Get the reply latency for the given node."""
+        if callable(self.latency):
+            return self.latency(node)
+        if isinstance(self.latency, (tuple, list)):
+            return self.random.uniform(*self.latency)
+        return self.latency
+
+    def start(self):
+        """Subscribe the fleet to the broker and start reply workers."""
+        self._stopped = False
+        for collective in self.collectives:
+            for agent in sorted(self.agents):
+                self._subscribe(self.connector.get_target(
+                    agent=agent, collective=collective), self.on_request)
+            self._subscribe_direct(collective)
+
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        return self
+
+    def stop(self):
+        """Unsubscribe and stop reply workers, dropping pending replies."""
+        for subscription in self._subscriptions:
+            self.broker.unsubscribe(subscription)
+        self._subscriptions = []
+
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return self
+
+    def wait(self, timeout=None):
+        """Wait until every scheduled reply has been sent.
+
+        Returns:
+            ``done``: whether there are no replies pending.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending or self._running:
+                if deadline is not None and time.time() >= deadline:
+                    break
+                self._condition.wait(0.01)
+
+            return not (self._pending or self._running)
+
+    def _subscribe(self, destination, callback, selector=None):
+        self._subscriptions.append(self.broker.subscribe(destination,
+                                                         callback,
+                                                         selector))
+
+    def _subscribe_direct(self, collective):
+        shared = {}
+        for node in self.nodes:
+            direct = self.connector.get_direct_subscription(collective,
+                                                            node.identity)
+            if direct is None:
+                return
+
+            destination, headers = direct
+            if headers.get('selector', None):
+                # A single subscription for all nodes sharing the destination,
+                # dispatching on the selector header.
+                header, _ = _broker.Subscription(
+                    destination, None, headers['selector']).selector
+                shared[destination] = header
+            else:
+                self._subscribe(destination,
+                                functools.partial(self.on_request,
+                                                  identity=node.identity))
+
+        for destination, header in shared.items():
+            self._subscribe(destination, functools.partial(
+                self.on_direct_request, header))
+
+    def on_direct_request(self, header, headers, frame):
+        """Handle a request for the node identified by the given header."""
+        return self.on_request(headers, frame, headers.get(header, None))
+
+    def count(self, stat):
+        """Increment the given :py:attr:`stats` counter."""
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    def on_request(self, headers, frame, identity=None):
+        """Handle an incoming request, scheduling replies from every
+        matching node.
+
+        Params:
+            ``headers``: message headers.
+
+            ``frame``: encoded request.
+
+            ``identity``: target node identity for direct requests.
+        Returns:
+            ``scheduled``: number of replies scheduled.
+        """
+        self.count('received')
+        request = message.Reply(frame, self.security)
+        try:
+            agent = self.agents.get(request[':agent'], None)
+            filter_ = request.get(':filter', None)
+        except Exception:
+            # Never raise on the connection receiver thread.
+            self.count('invalid')
+            return 0
+
+        reply_to = headers.get('reply-to', None)
+        if agent is None or not reply_to:
+            self.count('filtered')
+            return 0
+
+        if identity is None:
+            nodes = self.nodes
+        elif identity in self.nodes_by_identity:
+            nodes = [self.nodes_by_identity[identity]]
+        else:
+            nodes = []
+
+        if filter_ and nodes:
+            try:
+                predicate = self.matcher.compile(filter_)
+                nodes = [node for node in nodes
+                         if predicate(node.identity, self.agent_names,
+                                      node.facts, node.classes)]
+            except Exception:
+                nodes = []
+
+        if not nodes:
+            self.count('filtered')
+            return 0
+
+        try:
+            self.security.verify(request)
+            task = (agent, request.body, dict(request), reply_to)
+        except Exception:
+            self.count('unverified')
+            return 0
+
+        now = time.time()
+        with self._condition:
+            for node in nodes:
+                heapq.heappush(self._pending, (now + self.get_latency(node),
+                                               next(self._sequence),
+                                               node,
+                                               task))
+            self._condition.notify_all()
+
+        return len(nodes)
+
+    def reply(self, node, task):
+        """Run the agent for the given node and publish its reply."""
+        agent, body, request, reply_to = task
+        result = server.run_agent(agent, body, request)
+        if result is None:
+            return
+        if isinstance(result, server.AgentFailure):
+            self.count('failed')
+            metrics.TASK_FAILURES.inc()
+            result = dict(result)
+
+        # Nodes usually reply the same body, serialize it just once.
+        last_result, serialized = self._last_body
+        if last_result is None or last_result != result:
+            serialized = self.security.serialize_body(result)
+            self._last_body = (result, serialized)
+
+        self.broker.publish(reply_to,
+                            self.encode_reply(node, request, serialized))
+        self.count('replied')
+
+    def encode_reply(self, node, request, body):
+        """Encode the reply from the given node, with an already serialized
+        body."""
+        if (not self.templates or self.security.serializer.binary or
+                not _PLAIN_IDENTITY_RE.match(node.identity)):
+            return self.security.encode(
+                server.build_reply(node.identity, request, body))
+
+        # Templates are only valid for the same request, body and second.
+        now = int(time.time())
+        last_request, last_body, last_time, template = self._last_template
+        if last_request is not request or last_body is not body or \
+                last_time != now:
+            reply = server.build_reply(PLACEHOLDER, request, body)
+            reply[':msgtime'] = now
+            template = self.security.encode(reply)
+            self._last_template = (request, body, now, template)
+
+        return template.replace(PLACEHOLDER, node.identity)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if self._pending:
+                        timeout = self._pending[0][0] - time.time()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._condition.wait(timeout)
+
+                if self._stopped:
+                    return
+
+                _, _, node, task = heapq.heappop(self._pending)
+                self._running += 1
+
+            try:
+                self.reply(node, task)
+            except Exception:
+                pass
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    if not (self._pending or self._running):
+                        self._condition.notify_all()
@@ -0,0 +1,131 @@
+"""
+:py:mod:`pymco.tracing`
+-----------------------
+Span hooks for plugging python-mcollective into distributed tracing.
+
+Connectors, security providers and RPC calls open spans around sending,
+receiving, encoding and decoding messages. A hook is any object with
+``start`` and ``end`` methods::
+
+    class Hook(object):
+        def start(self, name, attributes):
+            return tracer.start_span(name, attributes=attributes)
+
+        def end(self, context, attributes, error=None):
+            context.set_attributes(attributes)
+            context.end()
+
+    tracing.add_hook(Hook())
+
+``start`` is called with the span name and its attributes when the span
+starts, and its return value is given back to ``end`` as ``context``,
+together with the attributes, including any added while the span was open,
+and the exception ending the span, if any. Hook errors are logged and
+otherwise ignored.
+
+While no hook is registered :py:func:`span` returns a shared no-op span, so
+tracing costs next to nothing.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+_hooks = []
+
+
+def add_hook(hook):
+    """Register a span hook."""
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    """Unregister a span hook."""
+    _hooks.remove(hook)
+
+
+def message_attributes(msg):
+    """Get tracing attributes from an MCollective message."""
+    return dict((key[1:], msg[key]) for key in
+                (':agent', ':collective', ':requestid') if key in msg)
+
+
+class Span(object):
+    """Span notifying registered hooks when it starts and ends.
+
+    Spans are true, so attributes costly to compute can be skipped when
+    tracing is disabled::
+
+        with tracing.span('foo') as span:
+            if span:
+                span.update(costly())
+    """
+    __slots__ = ('name', 'attributes', '_hooks', '_contexts')
+
+    def __init__(self, name, attributes, hooks):
+        self.name = name
+        self.attributes = attributes
+        self._hooks = hooks
+        self._contexts = []
+
+    def set(self, key, value):
+        """Set a span attribute."""
+        self.attributes[key] = value
+
+    def update(self, attributes):
+        """Set many span attributes."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        for hook in self._hooks:
+            try:
+                self._contexts.append((hook, hook.start(self.name,
+                                                        self.attributes)))
+            except Exception:
+                logger.exception('Tracing hook %r failed to start %s', hook,
+                                 self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        while self._contexts:
+            hook, context = self._contexts.pop()
+            try:
+                hook.end(context, self.attributes, exc_value)
+            except Exception:
+                logger.exception('Tracing hook %r failed to end %s', hook,
+                                 self.name)
+        return False
+
+
+class NoopSpan(object):
+    """Span doing nothing, used while no hook is registered."""
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def update(self, attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def span(name, **attributes):
+    """Get a span with the given name and attributes, to be used as a
+    context manager."""
+    if not _hooks:
+        return NOOP_SPAN
+
+    return Span(name, attributes, tuple(_hooks))
@@ -0,0 +1,71 @@
+"""Tests for benchmarks.suite"""
+import json
+
+import pytest
+
+from benchmarks import suite
+from pymco.test.utils import mock
+
+
+def report(*records):
+    return {'format': suite.FORMAT, 'metadata': {}, 'results': [
+        {'suite': 'rpc', 'name': name, 'metric': metric, 'value': value,
+         'unit': suite.get_unit(metric)}
+        for name, metric, value in records]}
+
+
+def test_flatten():
+    results = {('none', 10): {'call': 2.0, 'fanin': None},
+               'yaml': {'size': 10, 'dump': 1.5}}
+    assert suite.flatten('rpc', results) == [
+        {'suite': 'rpc', 'name': 'none.10', 'metric': 'call', 'unit': 'us',
+         'value': 2.0},
+        {'suite': 'rpc', 'name': 'yaml', 'metric': 'dump', 'unit': 'us',
+         'value': 1.5},
+        {'suite': 'rpc', 'name': 'yaml', 'metric': 'size', 'unit': 'bytes',
+         'value': 10},
+    ]
+
+
+@pytest.mark.parametrize('value,regression', ((109.0, False),
+                                              (110.0, False),
+                                              (111.0, True),
+                                              (50.0, False)))
+def test_compare__threshold(value, regression):
+    comparison = suite.compare(report(('none', 'call', 100.0)),
+                               report(('none', 'call', value)), 0.1)
+    assert comparison == [(('rpc', 'none', 'call'), 100.0, value,
+                           pytest.approx((value - 100.0) / 100.0),
+                           regression)]
+
+
+def test_compare__missing_keys():
+    baseline = report(('none', 'call', 1.0), ('none', 'gone', 1.0))
+    current = report(('none', 'call', 1.0), ('none', 'added', 9.0))
+    assert [item[0] for item in suite.compare(baseline, current)] == [
+        ('rpc', 'none', 'call')]
+
+
+def test_compare__zero_baseline():
+    comparison = suite.compare(report(('none', 'call', 0.0)),
+                               report(('none', 'call', 5.0)))
+    assert comparison[0][3:] == (0.0, False)
+
+
+@pytest.mark.parametrize('value,status', ((100.0, 0), (200.0, 1)))
+def test_main__compare_status(tmpdir, value, status):
+    baseline = tmpdir.join('baseline.json')
+    baseline.write(json.dumps(report(('none', 'call', 100.0))))
+    with mock.patch.object(suite, 'run',
+                           return_value=report(('none', 'call', value))):
+        assert suite.main(['--compare', str(baseline),
+                           '--threshold', '0.5']) == status
+
+
+def test_main__output(tmpdir):
+    output = tmpdir.join('report.json')
+    current = report(('none', 'call', 1.0))
+    with mock.patch.object(suite, 'run', return_value=current) as run:
+        assert suite.main(['rpc', '--quick', '--output', str(output)]) == 0
+    run.assert_called_once_with(['rpc'], True)
+    assert json.loads(output.read()) == current
@@ -99,4 +99,13 @@ def msg(config, filter_):
 def security():
     return mock.Mock()
 
+
+@pytest.fixture
+def tracing_hook(request):
+    '''Registers a mock tracing hook for the test duration.'''
+    from pymco import tracing
+    hook = tracing.add_hook(mock.Mock())
+    request.addfinalizer(lambda: tracing.remove_hook(hook))
+    return hook
+
 conn_mock = security
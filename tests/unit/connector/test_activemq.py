@@ -8,6 +8,7 @@ from pymco.test.utils import mock
 
 @pytest.fixture
 def connector(config, conn_mock):
+    conn_mock.transport.listeners = {}
     return activemq.ActiveMQConnector(config=config, connection=conn_mock)
 
 
@@ -27,9 +28,77 @@ def test_get_reply_target(getpid, connector):
             new_callable=mock.PropertyMock)
 def test_send__msg_priority(security, connector, conn_mock, config):
     config.config['plugin.activemq.priority'] = 4
-    connector.send('foo', 'spam')
+    connector.send({}, 'spam')
     conn_mock.send.assert_called_once_with(
-        body=security.return_value.encode('foo'),
+        body=security.return_value.encode({}),
         destination='spam',
         priority=4,
     )
+
+
+@mock.patch('pymco.connector.Connector.security',
+            new_callable=mock.PropertyMock)
+def test_send_many__msg_priority(security, connector, conn_mock, config):
+    config.config['plugin.activemq.priority'] = 4
+    security.return_value.encode.return_value = 'body'
+    connector.send_many({}, ['spam', 'eggs'])
+    security.return_value.encode.assert_called_once_with({})
+    conn_mock.transport.send.assert_called_once_with(
+        b'SEND\ndestination:spam\npriority:4\ncontent-length:4\n\nbody\x00'
+        b'SEND\ndestination:eggs\npriority:4\ncontent-length:4\n\nbody\x00')
+
+
+def test_get_reply_subscription_headers(connector, config):
+    assert connector.get_reply_subscription_headers() == {}
+    config.config['plugin.activemq.reply_prefetch'] = '100'
+    assert connector.get_reply_subscription_headers() == {
+        'ack': 'client-individual', 'activemq.prefetchSize': '100'}
+
+
+@mock.patch('pymco.connector.Connector.security',
+            new_callable=mock.PropertyMock)
+def test_send__call_priority(security, connector, conn_mock, config):
+    config.config['plugin.activemq.priority'] = 4
+    connector.send({}, 'spam', priority=9)
+    assert conn_mock.send.call_args[1]['priority'] == 9
+
+
+@mock.patch('pymco.connector.Connector.security',
+            new_callable=mock.PropertyMock)
+def test_send__expires(security, connector, conn_mock):
+    connector.send({':msgtime': 1000, ':ttl': 60}, 'spam')
+    conn_mock.send.assert_called_once_with(
+        body=security.return_value.encode.return_value,
+        destination='spam',
+        expires=1060000,
+    )
+
+
+@mock.patch('pymco.connector.Connector.security',
+            new_callable=mock.PropertyMock)
+def test_send_many__expires(security, connector, conn_mock):
+    security.return_value.encode.return_value = 'body'
+    connector.send_many({':msgtime': 1000, ':ttl': 60}, ['spam'])
+    conn_mock.transport.send.assert_called_once_with(
+        b'SEND\ndestination:spam\nexpires:1060000\ncontent-length:4\n\n'
+        b'body\x00')
+
+
+@pytest.mark.parametrize('msg', ({}, {':msgtime': 1000}, {':ttl': 60}))
+def test_get_message_headers__no_expiry(connector, msg):
+    assert connector.get_message_headers(msg) == {}
+
+
+def test_get_message_headers__message(connector, msg):
+    assert connector.get_message_headers(msg) == {
+        'expires': (msg[':msgtime'] + msg[':ttl']) * 1000}
+
+
+def test_get_direct_subscription(connector):
+    assert connector.get_direct_subscription('mcollective') == (
+        '/queue/mcollective.nodes', {'selector': "mc_identity = 'mco1'"})
+
+
+def test_get_direct_subscription__identity(connector):
+    assert connector.get_direct_subscription('mcollective', 'mco2')[1] == {
+        'selector': "mc_identity = 'mco2'"}
@@ -50,3 +50,32 @@ def test_get_target(connector):
 def test_get_reply_target(connector):
     assert connector.get_reply_target(agent='agent', collective='collective') == (
         '/queue/collective_reply_agent')
+
+
+def test_get_direct_subscription(connector):
+    assert connector.get_direct_subscription('mcollective') == (
+        '/exchange/mcollective_directed/mco1', {})
+
+
+def test_get_reply_subscription_headers(connector, config):
+    config.config['plugin.rabbitmq.reply_prefetch'] = '100'
+    assert connector.get_reply_subscription_headers() == {
+        'ack': 'client-individual', 'prefetch-count': '100'}
+
+
+def test_get_message_headers(connector):
+    assert connector.get_message_headers({':msgtime': 1000, ':ttl': 60}) == {
+        'expiration': '60000'}
+    assert connector.get_message_headers({}) == {}
+
+
+@mock.patch('pymco.connector.Connector.security',
+            new_callable=mock.PropertyMock)
+def test_send__expiration(security, connector, conn_mock):
+    connector.send({':ttl': 60}, 'spam', priority=9)
+    conn_mock.send.assert_called_once_with(
+        body=security.return_value.encode.return_value,
+        destination='spam',
+        expiration='60000',
+        priority=9,
+    )
@@ -0,0 +1,209 @@
+"""Tests for pymco.connector.selector"""
+import socket
+import threading
+import time
+
+import pytest
+from stomp import listener as stomp_listener
+
+from pymco import config as _config
+from pymco import exc
+from pymco.connector import selector as _selector
+from pymco.test import broker as _broker
+
+HOSTS = [('a', 61613), ('b', 61613), ('c', 61613)]
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def selector(clock):
+    return _selector.BrokerSelector(HOSTS, ejection_failures=2,
+                                    ejection_time=10, max_ejection_time=30,
+                                    error_half_life=60, clock=clock)
+
+
+def test_order__config_order_by_default(selector):
+    assert selector.order() == HOSTS
+    assert len(selector) == 3
+
+
+def test_order__by_connect_time_and_latency(selector):
+    selector.record_connect(HOSTS[0], 0.5)
+    selector.record_connect(HOSTS[1], 0.1)
+    selector.record_connect(HOSTS[2], 0.1)
+    selector.record_latency(HOSTS[1], 0.2)
+    assert selector.order() == [HOSTS[2], HOSTS[1], HOSTS[0]]
+
+
+def test_order__errors_count_against(selector):
+    selector.record_error(HOSTS[0])
+    assert selector.order() == [HOSTS[1], HOSTS[2], HOSTS[0]]
+
+
+def test_ejection(selector, clock):
+    selector.record_error(HOSTS[0])
+    selector.record_error(HOSTS[0])
+    health = selector.brokers[HOSTS[0]]
+    assert health.ejected_until == clock.now + 10
+    # Ejected brokers go last, even after slower ones.
+    selector.record_connect(HOSTS[1], 5)
+    selector.record_connect(HOSTS[2], 5)
+    assert selector.order()[-1] == HOSTS[0]
+
+
+def test_ejection_time_doubles(selector, clock):
+    for ejection_time in (10, 20, 30, 30):
+        selector.record_error(HOSTS[0])
+        selector.record_error(HOSTS[0])
+        assert (selector.brokers[HOSTS[0]].ejected_until ==
+                clock.now + ejection_time)
+
+
+def test_slow_readmission(selector, clock):
+    selector.record_connect(HOSTS[1], 0.01)
+    selector.record_connect(HOSTS[2], 0.01)
+    selector.record_error(HOSTS[0])
+    selector.record_error(HOSTS[0])
+    clock.now += 11
+    # Re-admitted, but still behind healthy brokers.
+    assert not selector.is_ejected(selector.brokers[HOSTS[0]])
+    assert selector.order()[-1] == HOSTS[0]
+    clock.now += 60
+    assert selector.order()[-1] == HOSTS[0]
+    # The error rate decays until it's preferred again.
+    clock.now += 3600
+    assert selector.order()[0] == HOSTS[0]
+
+
+def test_success_resets_failures(selector):
+    selector.record_error(HOSTS[0])
+    selector.record_connect(HOSTS[0], 0.1)
+    selector.record_error(HOSTS[0])
+    assert selector.brokers[HOSTS[0]].ejected_until is None
+
+
+def test_unknown_hosts_are_ignored(selector):
+    selector.record_error(('d', 1))
+    selector.record_connect(('d', 1), 1)
+    selector.record_latency(('d', 1), 1)
+    assert selector.order() == HOSTS
+
+
+def test_stats(selector):
+    selector.record_connect(HOSTS[1], 0.5)
+    stats = selector.stats()
+    assert [item['host_and_port'] for item in stats] == HOSTS
+    assert stats[1]['connect_time'] == 0.5
+
+
+def test_get_selector(config):
+    config.config['plugin.activemq.pool.ejection_failures'] = '5'
+    selector = _selector.get_selector(config)
+    assert selector is _selector.get_selector(config)
+    assert selector.order() == config.get_host_and_ports()
+    assert selector.ejection_failures == 5
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def broker(request):
+    broker_ = _broker.Broker().start()
+    request.addfinalizer(broker_.stop)
+    return broker_
+
+
+@pytest.fixture
+def pool_config(config, broker):
+    configdict = dict(broker.configure(config).config)
+    configdict.update({
+        'plugin.activemq.pool.size': '2',
+        'plugin.activemq.pool.2.host': broker.host,
+        'plugin.activemq.pool.2.port': str(broker.port),
+        'plugin.activemq.pool.2.user': 'mcollective',
+        'plugin.activemq.pool.2.password': 'secret',
+        'plugin.activemq.pool.1.port': str(free_port()),
+        'plugin.activemq.initial_reconnect_delay': '0',
+        'plugin.activemq.connect_timeout': '5',
+    })
+    return _config.Config(configdict)
+
+
+def test_connector_skips_dead_broker(pool_config, broker):
+    dead, alive = pool_config.get_host_and_ports()
+    connector = pool_config.get_connector()
+    assert connector.selects_brokers
+    connector.connect(wait=True)
+    try:
+        assert connector.connection.is_connected()
+        assert connector.get_current_host_and_port() == alive
+    finally:
+        connector.disconnect()
+
+    selector = connector.selector
+    assert selector.brokers[dead].failures == 1
+    assert selector.brokers[alive].connect_time is not None
+    assert selector.order() == [alive, dead]
+
+
+def test_connector_no_broker(pool_config, broker):
+    pool_config.config['plugin.activemq.pool.2.port'] = str(free_port())
+    pool_config.config['plugin.activemq.max_recconect_attempts'] = '2'
+    connector = pool_config.get_connector()
+    with pytest.raises(exc.ConnectError):
+        connector.connect(wait=True)
+
+
+def test_connector_keeps_listeners(pool_config, broker):
+    connector = pool_config.get_connector()
+    listener = stomp_listener.ConnectionListener()
+    connector.connection.set_listener('test', listener)
+    connector.connect(wait=True)
+    try:
+        assert connector.connection.get_listener('test') is listener
+        assert connector.connection.get_listener('connected') is None
+    finally:
+        connector.disconnect()
+
+
+@pytest.fixture
+def blackhole(request):
+    """Listening socket never answering, like a hung broker."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(5)
+    request.addfinalizer(sock.close)
+    return sock.getsockname()
+
+
+def test_connector_races_hung_broker(pool_config, broker, blackhole):
+    pool_config.config['plugin.activemq.pool.1.port'] = str(blackhole[1])
+    pool_config.config['plugin.activemq.connect_stagger'] = '0.01'
+    connector = pool_config.get_connector()
+    start = time.time()
+    connector.connect(wait=True)
+    try:
+        # Bounded by the healthy broker, not the 5 seconds connect timeout.
+        assert time.time() - start < 2
+        assert connector.get_current_host_and_port() == (broker.host,
+                                                         broker.port)
+    finally:
+        connector.disconnect()
@@ -0,0 +1,222 @@
+"""Tests for pymco.connector.sharded"""
+import threading
+import time
+
+import pytest
+
+from pymco import exc
+from pymco import listener
+from pymco.connector import BaseConnector
+from pymco.connector import activemq
+from pymco.connector import sharded
+from pymco.test import broker as _broker
+from pymco.test.utils import mock
+
+
+@pytest.fixture
+def broker(request):
+    broker_ = _broker.Broker().start()
+    request.addfinalizer(broker_.stop)
+    return broker_
+
+
+@pytest.fixture
+def shard_config(config, broker):
+    config = broker.configure(config)
+    config.config['securityprovider'] = 'none'
+    config.config['plugin.activemq.connections'] = '3'
+    return config
+
+
+@pytest.fixture
+def connector(request, shard_config):
+    connector_ = shard_config.get_connector()
+    request.addfinalizer(connector_.disconnect)
+    return connector_
+
+
+def wait_subscribers(broker, destination, count):
+    deadline = time.time() + 5
+    while broker.subscribers(destination) < count and time.time() < deadline:
+        time.sleep(0.01)
+
+
+@mock.patch('stomp.connect.StompConnection11')
+def test_shards_start_on_every_broker(conn_mock, config):
+    connector_ = sharded.ShardedConnector(config, connections=3)
+    assert len(connector_.shards) == 3
+    assert all(isinstance(shard, activemq.ActiveMQConnector)
+               for shard in connector_.shards)
+    hosts = [call[1]['host_and_ports'] for call in conn_mock.call_args_list]
+    assert hosts == [
+        [('localhost', 6163), ('localhost', 6164)],
+        [('localhost', 6164), ('localhost', 6163)],
+        [('localhost', 6163), ('localhost', 6164)],
+    ]
+
+
+def test_get_connector(connector):
+    assert isinstance(connector, sharded.ShardedConnector)
+    assert len(connector.shards) == 3
+    assert connector.connection is connector.primary.connection
+
+
+def test_get_connector__single_connection(config):
+    config.config['plugin.activemq.connections'] = '1'
+    assert isinstance(config.get_connector(), activemq.ActiveMQConnector)
+
+
+def test_send_encoded__round_robin(connector):
+    for shard in connector.shards:
+        shard.send_encoded = mock.Mock()
+    for _ in range(6):
+        connector.send_encoded('body', '/queue/foo')
+    assert [shard.send_encoded.call_count for shard in connector.shards] == [
+        2, 2, 2]
+
+
+def test_send_many__merged_replies(connector, broker, shard_config):
+    received = []
+    done = threading.Event()
+
+    def on_message(headers, body):
+        received.append(headers['destination'])
+        if len(received) == 30:
+            done.set()
+
+    for index in range(30):
+        broker.subscribe('/queue/node{0}'.format(index), on_message)
+    connector.connect(wait=True)
+    msg = {':agent': 'rpcutil', ':body': 'ping'}
+    connector.send_many(msg, ['/queue/node{0}'.format(index)
+                              for index in range(30)])
+    assert done.wait(5)
+    assert sorted(received) == sorted('/queue/node{0}'.format(index)
+                                      for index in range(30))
+    assert broker.stats['connections'] == 3
+
+    # Replies reach the single listener whatever shard gets them.
+    connector.subscribe('/queue/replies', id='replies')
+    for _ in range(3):
+        broker.publish('/queue/replies', 'foo: bar\n')
+    replies = connector.receive(timeout=5)
+    assert len(replies) >= 1
+    assert all(shard.connection.get_listener('response_listener').listener is
+               connector.get_response_listener()
+               for shard in connector.shards)
+
+
+def test_send_many__raises_shard_errors(connector):
+    connector.shards[1].send_bulk = mock.Mock(side_effect=ValueError)
+    for shard in connector.shards[::2]:
+        shard.send_bulk = mock.Mock()
+    with pytest.raises(ValueError):
+        connector.send_many({}, ['/queue/a', '/queue/b', '/queue/c'])
+    messages = connector.shards[0].send_bulk.call_args[0][0]
+    assert [destination for _, destination in messages] == ['/queue/a']
+
+
+def test_send_many__message_headers(connector):
+    for shard in connector.shards:
+        shard.send_bulk = mock.Mock()
+    connector.send_many({':msgtime': 1000, ':ttl': 60}, ['/queue/a'],
+                        priority=9)
+    for shard in connector.shards:
+        assert shard.send_bulk.call_args[1] == {'expires': 1060000,
+                                                'priority': 9,
+                                                'receipt': None,
+                                                'timeout': 30}
+
+
+def test_subscribe__every_shard(connector):
+    for shard in connector.shards:
+        shard.subscribe = mock.Mock()
+    connector.subscribe('/queue/foo', id='foo')
+    for shard in connector.shards:
+        shard.subscribe.assert_called_once_with('/queue/foo', 'foo')
+
+
+def test_is_connector(connector):
+    assert isinstance(connector, BaseConnector)
+
+
+def test_get_reply_subscription_headers(connector, shard_config):
+    shard_config.config['plugin.activemq.reply_prefetch'] = '10'
+    assert connector.get_reply_subscription_headers() == {
+        'ack': 'client-individual', 'activemq.prefetchSize': '10'}
+
+
+def test_subscribe__topics_on_primary(connector):
+    for shard in connector.shards:
+        shard.subscribe = mock.Mock()
+    connector.subscribe('/topic/foo')
+    connector.primary.subscribe.assert_called_once_with('/topic/foo', None)
+    assert all(shard.subscribe.called is False
+               for shard in connector.shards[1:])
+
+
+def test_add_listener__every_shard(connector):
+    connector.add_listener('foo', mock.sentinel.listener)
+    assert all(shard.connection.get_listener('foo') is mock.sentinel.listener
+               for shard in connector.shards)
+
+
+def test_ack_message__through_receiving_shard(connector):
+    for shard in connector.shards:
+        shard.ack_message = mock.Mock()
+    headers = {'message-id': 'foo', sharded.SHARD_HEADER: 2}
+    connector.ack_message(headers)
+    connector.shards[2].ack_message.assert_called_once_with(headers)
+    assert connector.shards[0].ack_message.called is False
+
+
+def test_receive__flow_control(connector, broker, shard_config):
+    shard_config.config['plugin.activemq.reply_prefetch'] = '1'
+    connector.connect(wait=True)
+    response_listener = connector.get_response_listener()
+    connector.subscribe('/queue/replies',
+                        **connector.get_reply_subscription_headers())
+    wait_subscribers(broker, '/queue/replies', 3)
+    for index in range(6):
+        broker.publish('/queue/replies', 'index: {0}\n'.format(index))
+
+    # Every shard holds back replies beyond its own prefetch window.
+    time.sleep(0.2)
+    assert len(response_listener.responses) == 3
+    received = []
+    while len(received) < 6:
+        received.extend(connector.receive(timeout=5))
+    assert sorted(reply['index'] for reply in received) == list(range(6))
+
+
+@mock.patch('pymco.listener.SingleResponseListener')
+def test_receive__timeout(response_listener, connector):
+    response_listener.return_value = listener.ResponseListener(
+        connector.config, count=1, timeout=0)
+    with pytest.raises(exc.TimeoutError):
+        connector.receive(timeout=0)
+
+
+def test_add_listener__receives_from_every_shard(connector, broker):
+    received = []
+    done = threading.Event()
+
+    def on_message(headers, body):
+        received.append(headers['destination'])
+        if len(received) == 7:
+            done.set()
+
+    connector.connect(wait=True)
+    connector.add_listener('server', listener.CallbackListener(on_message))
+    connector.subscribe('/topic/mcollective.rpcutil.agent')
+    connector.subscribe('/queue/mcollective.nodes')
+    wait_subscribers(broker, '/topic/mcollective.rpcutil.agent', 1)
+    wait_subscribers(broker, '/queue/mcollective.nodes', 3)
+    broker.publish('/topic/mcollective.rpcutil.agent', 'body')
+    for _ in range(6):
+        broker.publish('/queue/mcollective.nodes', 'body')
+    assert done.wait(5)
+    time.sleep(0.1)
+    # Topic messages are received once, queue ones from every shard.
+    assert received.count('/topic/mcollective.rpcutil.agent') == 1
+    assert received.count('/queue/mcollective.nodes') == 6
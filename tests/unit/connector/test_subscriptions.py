@@ -0,0 +1,83 @@
+"""Tests for pymco.connector.subscriptions"""
+import pytest
+
+from pymco.connector import subscriptions
+
+
+@pytest.fixture
+def manager():
+    return subscriptions.SubscriptionManager()
+
+
+def test_acquire(manager):
+    subscription, new = manager.acquire('/queue/foo', headers={'a': 'b'})
+    assert new is True
+    assert (subscription.destination, subscription.id,
+            subscription.headers, subscription.users) == (
+        '/queue/foo', 1, {'a': 'b'}, 1)
+    assert manager.get('/queue/foo') is subscription
+    assert '/queue/foo' in manager
+
+
+def test_acquire__shared(manager):
+    subscription, _ = manager.acquire('/queue/foo')
+    assert manager.acquire('/queue/foo', id='other') == (subscription, False)
+    assert subscription.id == 1
+    assert subscription.users == 2
+    assert len(manager) == 1
+
+
+def test_acquire__conflicting_headers(manager):
+    subscription, _ = manager.acquire('/queue/foo', headers={'a': 'b'})
+    with pytest.raises(ValueError):
+        manager.acquire('/queue/foo', headers={'a': 'c'})
+    with pytest.raises(ValueError):
+        manager.acquire('/queue/foo')
+    assert manager.acquire('/queue/foo', headers={'a': 'b'}) == (
+        subscription, False)
+    assert subscription.users == 2
+
+
+def test_acquire__ids_skip_given_ones(manager):
+    manager.acquire('/queue/foo', id=2)
+    assert manager.acquire('/queue/bar')[0].id == 1
+    assert manager.acquire('/queue/baz')[0].id == 3
+
+
+def test_release(manager):
+    manager.acquire('/queue/foo')
+    subscription, _ = manager.acquire('/queue/foo')
+    assert manager.release('/queue/foo') is None
+    assert manager.release('/queue/foo') is subscription
+    assert '/queue/foo' not in manager
+    assert manager.release('/queue/foo') is None
+
+
+def test_iter__subscription_order(manager):
+    for destination in ('/queue/b', '/queue/a', '/queue/c'):
+        manager.acquire(destination)
+    assert [subscription.destination for subscription in manager] == [
+        '/queue/b', '/queue/a', '/queue/c']
+
+
+def test_clear(manager):
+    manager.acquire('/queue/foo')
+    manager.clear()
+    assert len(manager) == 0
+    assert manager.acquire('/queue/foo')[1] is True
+
+
+def test_find(manager):
+    subscription, _ = manager.acquire('/queue/foo', id=7)
+    assert manager.find('7') is subscription
+    assert manager.find(7) is subscription
+    assert manager.find('8') is None
+
+
+@pytest.mark.parametrize('headers,acked', (
+    (None, False),
+    ({'ack': 'auto'}, False),
+    ({'ack': 'client-individual'}, True),
+))
+def test_acked(headers, acked):
+    assert subscriptions.Subscription('/queue/foo', 1, headers).acked is acked
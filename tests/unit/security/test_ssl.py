@@ -5,6 +5,7 @@ import os
 import pytest
 
 from pymco import exc
+from pymco import metrics
 from pymco.security import ssl
 from pymco.test import ctxt
 from pymco.test.utils import mock
@@ -113,6 +114,33 @@ def test_get_hash(sha, private_key, signer, encode, ssl_provider, msg):
     encode.assert_called_with(signer.return_value.sign.return_value)
 
 
+@mock.patch('base64.b64encode')
+@mock.patch('Crypto.Signature.PKCS1_v1_5.new')
+@mock.patch('pymco.security.ssl.SSLProvider.private_key',
+            new_callable=mock.PropertyMock)
+@mock.patch('Crypto.Hash.SHA.new')
+def test_get_hash__reuses_hash_for_same_body(sha, private_key, signer, encode,
+                                             ssl_provider, msg):
+    assert ssl_provider.get_hash(msg) == encode.return_value
+    msg[':collective'] = 'sub1'
+    assert ssl_provider.get_hash(msg) == encode.return_value
+    assert signer.return_value.sign.call_count == 1
+
+
+@mock.patch('base64.b64encode')
+@mock.patch('Crypto.Signature.PKCS1_v1_5.new')
+@mock.patch('pymco.security.ssl.SSLProvider.private_key',
+            new_callable=mock.PropertyMock)
+@mock.patch('Crypto.Hash.SHA.new')
+def test_get_hash__resigns_on_body_change(sha, private_key, signer, encode,
+                                          ssl_provider, msg):
+    ssl_provider.get_hash(msg)
+    msg[':body'] = 'pong'
+    ssl_provider.get_hash(msg)
+    assert signer.return_value.sign.call_count == 2
+    sha.assert_called_with('pong'.encode('utf8'))
+
+
 @mock.patch('Crypto.Signature.PKCS1_v1_5.new')
 @mock.patch('pymco.security.ssl.SSLProvider.server_public_key',
             new_callable=mock.PropertyMock)
@@ -131,5 +159,79 @@ def test_verify__ok(sha, server_public, verifier, ssl_provider, reply):
 @mock.patch('Crypto.Hash.SHA.new')
 def test_verify__error(sha, server_public, verifier, ssl_provider, reply):
     verifier.return_value.verify.return_value = False
+    failures = metrics.VERIFICATION_FAILURES.get()
     with pytest.raises(exc.VerificationError):
         ssl_provider.verify(reply)
+    assert metrics.VERIFICATION_FAILURES.get() == failures + 1
+
+
+@mock.patch('pymco.config.Config.get_serializer')
+def test_deserialize_body(get_serializer, ssl_provider):
+    deserialize = get_serializer.return_value.deserialize
+    assert ssl_provider.deserialize_body('--- pong') == deserialize.return_value
+    deserialize.assert_called_once_with('--- pong')
+
+
+@pytest.fixture
+def ssl_server_provider(config):
+    config.config['plugin.ssl_server_private'] = os.path.join(
+        ctxt.ROOT, 'fixtures/server-private.pem')
+    config.config['plugin.ssl_client_cert_dir'] = os.path.join(ctxt.ROOT,
+                                                               'fixtures')
+    return ssl.SSLServerProvider(config=config)
+
+
+@pytest.fixture
+def ssl_client_provider(config):
+    config.config['plugin.ssl_client_private'] = os.path.join(
+        ctxt.ROOT, 'fixtures/client-private.pem')
+    config.config['plugin.ssl_client_public'] = os.path.join(
+        ctxt.ROOT, 'fixtures/client-public.pem')
+    config.config['plugin.ssl_server_public'] = os.path.join(
+        ctxt.ROOT, 'fixtures/server-public.pem')
+    return ssl.SSLProvider(config=config)
+
+
+def test_serialize_body(ssl_provider):
+    with mock.patch.object(ssl_provider, 'serialize') as serialize:
+        assert ssl_provider.serialize_body('pong') == serialize.return_value
+    serialize.assert_called_once_with('pong')
+
+
+def test_server_verifies_client_requests(ssl_client_provider,
+                                         ssl_server_provider,
+                                         msg):
+    signed = ssl_client_provider.sign(msg)
+    assert signed[':callerid'] == 'cert=client-public'
+    assert ssl_server_provider.verify(signed) is signed
+
+
+def test_client_verifies_server_replies(config, ssl_server_provider):
+    reply = ssl_server_provider.sign({':body': '--- pong\n'})
+    assert ':callerid' not in reply
+    config.config['plugin.ssl_server_public'] = os.path.join(
+        ctxt.ROOT, 'fixtures/server-public.pem')
+    assert ssl.SSLProvider(config=config).verify(reply) is reply
+
+
+def test_server_verify__tampered(ssl_client_provider, ssl_server_provider,
+                                 msg):
+    signed = ssl_client_provider.sign(msg)
+    signed[':body'] = 'tampered'
+    with pytest.raises(exc.VerificationError):
+        ssl_server_provider.verify(signed)
+
+
+@pytest.mark.parametrize('callerid', ('cert=../client-public',
+                                      'cert=',
+                                      'cert=unknown'))
+def test_server_verify__bad_callers(ssl_server_provider, callerid):
+    with pytest.raises(exc.VerificationError):
+        ssl_server_provider.get_public_key({':callerid': callerid})
+
+
+def test_keys_are_cached_apart(ssl_client_provider, msg):
+    ssl_client_provider.sign(msg)
+    assert (ssl_client_provider.server_public_key is not
+            ssl_client_provider.private_key)
+    assert ssl_client_provider._private_key is ssl_client_provider.private_key
@@ -15,3 +15,26 @@ def yaml_response():
 :senderagent: discovery
 :msgtime: 1384022186
 :body: pong"""
+
+
+@pytest.fixture
+def json():
+    from pymco.serializers import json
+    return json.Serializer()
+
+
+@pytest.fixture
+def msgpack():
+    from pymco.serializers import msgpack
+    return msgpack.Serializer()
+
+
+@pytest.fixture
+def response():
+    return {
+        ':senderid': 'mco1',
+        ':requestid': '335a3e8261e4589499d366862b328816',
+        ':senderagent': 'discovery',
+        ':msgtime': 1384022186,
+        ':body': 'pong',
+    }
@@ -0,0 +1,25 @@
+"""Tests JSON serializer"""
+import json as json_
+
+
+def test_serialize(json, msg):
+    """Test msg serialization"""
+    assert json_.loads(json.serialize(msg)) == dict(msg)
+
+
+def test_serialize__compact(json, msg):
+    """Test msg serialization doesn't add whitespace"""
+    assert ', ' not in json.serialize(msg)
+    assert ': ' not in json.serialize(msg)
+
+
+def test_deserialize(json, response):
+    assert json.deserialize(json_.dumps(response)) == response
+
+
+def test_roundtrip_keeps_symbol_keys(json, msg):
+    assert json.deserialize(json.serialize(msg)) == dict(msg)
+
+
+def test_is_not_binary(json):
+    assert json.binary is False
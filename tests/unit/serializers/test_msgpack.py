@@ -0,0 +1,19 @@
+"""Tests msgpack serializer"""
+import msgpack as msgpack_
+
+
+def test_serialize(msgpack, msg):
+    """Test msg serialization"""
+    assert msgpack_.unpackb(msgpack.serialize(msg), raw=False) == dict(msg)
+
+
+def test_deserialize(msgpack, response):
+    assert msgpack.deserialize(msgpack_.packb(response)) == response
+
+
+def test_roundtrip_keeps_symbol_keys(msgpack, msg):
+    assert msgpack.deserialize(msgpack.serialize(msg)) == dict(msg)
+
+
+def test_is_binary(msgpack):
+    assert msgpack.binary is True
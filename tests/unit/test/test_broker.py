@@ -0,0 +1,225 @@
+"""Tests for pymco.test.broker"""
+import threading
+import time
+
+import pytest
+
+from pymco import exc
+from pymco import listener
+from pymco.test import broker as _broker
+from pymco.test.utils import mock
+
+
+@pytest.fixture
+def broker(request):
+    broker_ = _broker.Broker()
+    request.addfinalizer(broker_.stop)
+    return broker_
+
+
+@pytest.fixture
+def callback():
+    return mock.Mock()
+
+
+def test_escape():
+    value = 'foo:bar\nspam\\eggs\r'
+    assert _broker.escape(value) == 'foo\\cbar\\nspam\\\\eggs\\r'
+    assert _broker.unescape(_broker.escape(value)) == value
+
+
+def test_pack_and_parse():
+    buffer = bytearray(b'\n\n' +
+                       _broker.pack('SEND', {'destination': '/queue/a:b'},
+                                    u'foo\x00bar') +
+                       b'\nMESSAGE\nfoo:bar\n\nspam\x00MESS')
+    frames = _broker.parse(buffer)
+    assert frames == [
+        _broker.Frame('SEND',
+                      {'destination': '/queue/a:b', 'content-length': '7'},
+                      b'foo\x00bar'),
+        _broker.Frame('MESSAGE', {'foo': 'bar'}, b'spam'),
+    ]
+    assert buffer == bytearray(b'MESS')
+
+
+def test_parse__incomplete():
+    frame = _broker.pack('SEND', {'destination': '/topic/foo'}, b'body')
+    buffer = bytearray(frame[:-3])
+    assert _broker.parse(buffer) == []
+    buffer.extend(frame[-3:])
+    assert len(_broker.parse(buffer)) == 1
+
+
+def test_parse__not_escaped():
+    buffer = bytearray(b'CONNECT\nlogin:foo\\c\n\n\x00')
+    assert _broker.parse(buffer)[0].headers == {'login': 'foo\\c'}
+
+
+def test_subscription__selector():
+    subscription = _broker.Subscription('/queue/foo', None,
+                                        "mc_identity = 'mco1'")
+    assert subscription.matches({'mc_identity': 'mco1'}) is True
+    assert subscription.matches({'mc_identity': 'mco2'}) is False
+    assert subscription.matches({}) is False
+
+
+def test_subscription__unsupported_selector():
+    with pytest.raises(ValueError):
+        _broker.Subscription('/queue/foo', None, "a = 'b' OR c = 'd'")
+
+
+def test_publish__topic(broker, callback):
+    other = mock.Mock()
+    broker.subscribe('/topic/foo', callback)
+    broker.subscribe('/topic/foo', other)
+    assert broker.publish('/topic/foo', 'body', {'foo': 'bar'}) == 2
+    headers = callback.call_args[0][0]
+    assert headers['destination'] == '/topic/foo'
+    assert headers['foo'] == 'bar'
+    assert 'message-id' in headers
+    other.assert_called_once_with(headers, 'body')
+
+
+def test_publish__topic_without_subscribers(broker):
+    assert broker.publish('/topic/foo', 'body') == 0
+    assert broker.stats['dropped'] == 1
+
+
+def test_publish__queue_round_robin(broker, callback):
+    other = mock.Mock()
+    broker.subscribe('/queue/foo', callback)
+    broker.subscribe('/queue/foo', other)
+    for _ in range(4):
+        assert broker.publish('/queue/foo', 'body') == 1
+    assert callback.call_count == other.call_count == 2
+
+
+def test_publish__queue_keeps_messages(broker, callback):
+    assert broker.publish('/queue/foo', 'body') == 0
+    broker.subscribe('/queue/foo', callback)
+    assert callback.call_args[0][1] == 'body'
+    assert broker.stats['dropped'] == 0
+
+
+def test_publish__selector(broker, callback):
+    other = mock.Mock()
+    broker.subscribe('/queue/nodes', callback, "mc_identity = 'mco1'")
+    broker.subscribe('/queue/nodes', other, "mc_identity = 'mco2'")
+    broker.publish('/queue/nodes', 'body', {'mc_identity': 'mco2'})
+    assert callback.called is False
+    assert other.called is True
+
+
+def test_unsubscribe(broker, callback):
+    subscription = broker.subscribe('/topic/foo', callback)
+    assert broker.subscribers('/topic/foo') == 1
+    broker.unsubscribe(subscription)
+    broker.unsubscribe(subscription)
+    assert broker.subscribers('/topic/foo') == 0
+    assert broker.publish('/topic/foo', 'body') == 0
+    assert callback.called is False
+
+
+def test_configure(broker, config):
+    broker.port = 61613
+    new_config = broker.configure(config)
+    assert new_config.get_host_and_ports() == [('127.0.0.1', 61613)]
+    assert new_config.get_ssl_params() == []
+    assert config.getint('plugin.activemq.pool.size') == 2
+
+
+@pytest.mark.parametrize('connector', ('rabbitmq', 'stomp'))
+def test_configure__other_connectors(broker, config, connector):
+    config.config['connector'] = connector
+    broker.port = 61613
+    new_config = broker.configure(config)
+    assert new_config.get_host_and_ports() == [('127.0.0.1', 61613)]
+    assert new_config.get_user_and_password(('127.0.0.1', 61613)) == (
+        'mcollective', 'secret')
+
+
+def test_stomp_client(broker, config):
+    broker.start()
+    connector = broker.configure(config).get_connector()
+    received = threading.Event()
+    messages = []
+
+    def on_message(headers, body):
+        messages.append((headers, body))
+        received.set()
+
+    connector.connect(wait=True)
+    connector.connection.set_listener('test',
+                                      listener.CallbackListener(on_message))
+    connector.subscribe('/queue/replies', id='replies')
+    connector.send_encoded('foo: bar\n', '/queue/replies',
+                           **{'reply-to': '/queue/a:b'})
+    assert received.wait(5)
+    connector.disconnect()
+
+    headers, body = messages[0]
+    assert body == 'foo: bar\n'
+    assert headers['reply-to'] == '/queue/a:b'
+    assert headers['subscription'] == 'replies'
+    assert broker.stats['connections'] == 1
+
+
+def test_stomp_client__heartbeats(request, config):
+    broker = _broker.Broker(heartbeat=0.05).start()
+    request.addfinalizer(broker.stop)
+    config = broker.configure(config)
+    config.config['plugin.activemq.heartbeat_interval'] = '0.05'
+    config.config['securityprovider'] = 'none'
+    connector = config.get_connector()
+    connector.connect(wait=True)
+    connector.subscribe('/queue/replies', id='replies')
+
+    # A silent broker is detected long before the receive timeout.
+    broker.silent = True
+    start = time.time()
+    with pytest.raises(exc.ConnectionLostError):
+        connector.receive(timeout=10)
+    assert time.time() - start < 5
+
+    broker.silent = False
+    connector.reconnect(wait=True)
+    connector.send_encoded('foo: bar\n', '/queue/replies')
+    assert len(connector.receive(timeout=5)) == 1
+    connector.disconnect()
+    assert broker.stats['connections'] == 2
+
+
+def test_stomp_client__prefetch(broker, config):
+    broker.start()
+    config = broker.configure(config)
+    config.config['plugin.activemq.reply_prefetch'] = '2'
+    config.config['securityprovider'] = 'none'
+    connector = config.get_connector()
+    connector.connect(wait=True)
+    response_listener = connector.get_response_listener()
+    connector.subscribe('/queue/replies',
+                        **connector.get_reply_subscription_headers())
+    for index in range(5):
+        broker.publish('/queue/replies', 'index: {0}\n'.format(index))
+
+    # The broker stops at the prefetch window until replies are consumed.
+    time.sleep(0.2)
+    assert len(response_listener.responses) == 2
+    received = []
+    while len(received) < 5:
+        replies = connector.receive(timeout=5)
+        assert len(replies) <= 2
+        received.extend(replies)
+    assert [reply['index'] for reply in received] == [0, 1, 2, 3, 4]
+    connector.disconnect()
+
+
+def test_purge(broker, callback):
+    broker.publish('/queue/foo', 'body')
+    broker.publish('/queue/foo', 'body')
+    broker.publish('/queue/bar', 'body')
+    assert broker.purge('/queue/foo') == 2
+    assert broker.purge() == 1
+    broker.subscribe('/queue/foo', callback)
+    assert callback.called is False
@@ -0,0 +1,246 @@
+"""Tests for pymco.test.fleet"""
+import os
+
+import pytest
+
+from pymco import listener
+from pymco import message
+from pymco import server
+from pymco.security import none
+from pymco.test import broker as _broker
+from pymco.test import ctxt
+from pymco.test import fleet as _fleet
+from pymco.test.utils import mock
+
+
+@pytest.fixture
+def broker(request):
+    broker_ = _broker.Broker()
+    request.addfinalizer(broker_.stop)
+    return broker_
+
+
+@pytest.fixture
+def rpcutil():
+    return _fleet.StaticAgent('rpcutil', {
+        'ping': {'pong': 1},
+        'echo': lambda data, request: data,
+    })
+
+
+@pytest.fixture
+def fleet(request, broker, config, rpcutil):
+    config.config['securityprovider'] = 'none'
+    fleet_ = _fleet.Fleet(broker, config, size=6, agents=[rpcutil])
+    request.addfinalizer(fleet_.stop)
+    return fleet_
+
+
+@pytest.fixture
+def security(config):
+    return none.NoneProvider(config)
+
+
+@pytest.fixture
+def request_(config):
+    return message.Message(body={':action': 'ping', ':data': {}},
+                           agent='rpcutil',
+                           config=config)
+
+
+def get_replies(broker, fleet, security, request_, **kwargs):
+    replies = []
+    broker.subscribe('/queue/replies',
+                     lambda headers, body: replies.append(
+                         message.Reply(body, security)))
+    fleet.start()
+    scheduled = fleet.on_request({'reply-to': '/queue/replies'},
+                                 security.encode(request_),
+                                 **kwargs)
+    assert fleet.wait(5)
+    assert scheduled == len(replies)
+    return replies
+
+
+def test_default_facts():
+    assert _fleet.default_facts(4) == {'environment': 'staging',
+                                       'processorcount': '2',
+                                       'index': '4'}
+
+
+def test_static_agent(rpcutil):
+    assert rpcutil.handle({':action': 'ping'}, {}) == {
+        ':statuscode': server.OK, ':statusmsg': 'OK', ':data': {'pong': 1}}
+    assert rpcutil.handle({':action': 'echo', ':data': {'foo': 'bar'}},
+                          {})[':data'] == {'foo': 'bar'}
+    assert rpcutil.handle({':action': 'missing'}, {})[':statuscode'] == (
+        server.UNKNOWN_RPC_ACTION)
+
+
+def test_nodes(fleet):
+    assert len(fleet) == 6
+    assert fleet.nodes[5].identity == 'node00005'
+    assert fleet.nodes[5].facts['environment'] == 'development'
+    assert fleet.nodes_by_identity['node00005'] is fleet.nodes[5]
+    assert sorted(fleet.agents) == ['discovery', 'rpcutil']
+
+
+def test_nodes__fixed_facts_and_classes(broker, config):
+    config.config['securityprovider'] = 'none'
+    fleet = _fleet.Fleet(broker, config, size=2, identity='web{0}',
+                         facts={'country': 'uk'},
+                         classes=lambda index: ['web{0}'.format(index)])
+    assert fleet.nodes[1].identity == 'web1'
+    assert fleet.nodes[1].facts == {'country': 'uk'}
+    assert fleet.nodes[1].classes == frozenset(['web1'])
+
+
+@pytest.mark.parametrize('latency,expected', (
+    (0.5, 0.5),
+    ((0.1, 0.1), 0.1),
+    (lambda node: len(node.identity), 9),
+))
+def test_get_latency(fleet, latency, expected):
+    fleet.latency = latency
+    assert fleet.get_latency(fleet.nodes[0]) == expected
+
+
+def test_start_and_stop(fleet, broker):
+    fleet.start()
+    # Two agents per collective and the ActiveMQ direct queue.
+    assert len(fleet._subscriptions) == 9
+    assert len(fleet._threads) == 1
+    fleet.stop()
+    assert fleet._subscriptions == fleet._threads == []
+    assert broker.publish('/topic/mcollective.discovery.agent', 'ping') == 0
+
+
+def test_start__rabbitmq_direct(broker, config):
+    config.config.update({'securityprovider': 'none',
+                          'connector': 'rabbitmq',
+                          'plugin.rabbitmq.vhost': '/mcollective',
+                          'plugin.rabbitmq.pool.size': '0'})
+    fleet = _fleet.Fleet(broker, config, size=2).start()
+    # One agent and one direct exchange per node, for each collective.
+    assert len(fleet._subscriptions) == 9
+    assert fleet._subscriptions[-1].destination == (
+        '/exchange/sub2_directed/node00001')
+    fleet.stop()
+
+
+def test_on_request(broker, fleet, security, request_):
+    replies = get_replies(broker, fleet, security, request_)
+    assert sorted(reply[':senderid'] for reply in replies) == [
+        node.identity for node in fleet.nodes]
+    assert replies[0][':requestid'] == request_[':requestid']
+    assert replies[0].body[':data'] == {'pong': 1}
+    assert fleet.stats['replied'] == 6
+
+
+def test_on_request__without_templates(broker, fleet, security, request_):
+    fleet.templates = False
+    replies = get_replies(broker, fleet, security, request_)
+    assert len(replies) == 6
+    assert replies[0].body[':data'] == {'pong': 1}
+
+
+def test_encode_reply__templates(fleet, security):
+    request = {':requestid': 'foo', ':agent': 'discovery'}
+    plain = security.decode(fleet.encode_reply(fleet.nodes[1], request,
+                                               'pong'))
+    template = fleet._last_template[-1]
+    assert _fleet.PLACEHOLDER in template
+    fleet.templates = False
+    assert security.decode(fleet.encode_reply(fleet.nodes[1], request,
+                                              'pong')) == plain
+
+
+def test_on_request__filter(broker, fleet, security, request_):
+    request_[':filter'] = message.Filter().add_fact('environment', 'staging')
+    replies = get_replies(broker, fleet, security, request_)
+    assert sorted(reply[':senderid'] for reply in replies) == [
+        'node00001', 'node00004']
+
+
+def test_on_request__direct(broker, fleet, security, request_):
+    replies = get_replies(broker, fleet, security, request_,
+                          identity='node00003')
+    assert [reply[':senderid'] for reply in replies] == ['node00003']
+
+
+def test_on_request__direct_queue(broker, fleet, security, request_):
+    replies = []
+    broker.subscribe('/queue/replies',
+                     lambda headers, body: replies.append(body))
+    fleet.start()
+    broker.publish('/queue/mcollective.nodes', security.encode(request_),
+                   {'reply-to': '/queue/replies',
+                    'mc_identity': 'node00002'})
+    assert fleet.wait(5)
+    assert len(replies) == 1
+
+
+@pytest.mark.parametrize('headers,identity', (
+    ({}, None),
+    ({'reply-to': '/queue/replies'}, 'missing'),
+))
+def test_on_request__dropped(fleet, security, request_, headers, identity):
+    assert fleet.on_request(headers, security.encode(request_),
+                            identity) == 0
+    assert fleet.stats['filtered'] == 1
+
+
+def test_on_request__unknown_agent(fleet, security, request_):
+    request_[':agent'] = 'package'
+    assert fleet.on_request({'reply-to': '/queue/replies'},
+                            security.encode(request_)) == 0
+
+
+def test_on_request__invalid(fleet):
+    assert fleet.on_request({'reply-to': '/queue/replies'}, b'{foo: [') == 0
+    assert fleet.stats['invalid'] == 1
+
+
+def test_on_request__unverified(fleet, security, request_):
+    with mock.patch.object(fleet.security, 'verify', side_effect=ValueError):
+        assert fleet.on_request({'reply-to': '/queue/replies'},
+                                security.encode(request_)) == 0
+    assert fleet.stats['unverified'] == 1
+
+
+def test_ssl_round_trip(broker, config):
+    fixtures = os.path.join(ctxt.ROOT, 'fixtures')
+    config.config.update({
+        'plugin.ssl_server_private': os.path.join(fixtures,
+                                                  'server-private.pem'),
+        'plugin.ssl_server_public': os.path.join(fixtures,
+                                                 'server-public.pem'),
+        'plugin.ssl_client_private': os.path.join(fixtures,
+                                                  'client-private.pem'),
+        'plugin.ssl_client_public': os.path.join(fixtures,
+                                                 'client-public.pem'),
+        'plugin.ssl_client_cert_dir': fixtures,
+    })
+    broker.start()
+    config = broker.configure(config)
+    fleet = _fleet.Fleet(broker, config, size=20, latency=(0, 0.01)).start()
+    connector = config.get_connector()
+    connector.connect(wait=True)
+    reply_target = connector.get_reply_target(agent='discovery',
+                                              collective='mcollective')
+    responses = listener.ResponseListener(config, count=20, timeout=5)
+    connector.connection.set_listener('responses', responses)
+    connector.subscribe(reply_target)
+    connector.send(message.Message(body='ping', agent='discovery',
+                                   config=config),
+                   connector.get_target(agent='discovery',
+                                        collective='mcollective'),
+                   **{'reply-to': reply_target})
+    responses.wait_on_message()
+    connector.disconnect()
+    fleet.stop()
+
+    assert len(responses.responses) == 20
+    for reply in responses.responses:
+        assert connector.security.verify(reply) is reply
+        assert reply.body == 'pong'
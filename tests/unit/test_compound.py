@@ -0,0 +1,131 @@
+"""Tests for pymco.compound"""
+import pytest
+
+from pymco import compound
+from pymco import exc
+
+FACTS = {
+    'country': 'uk',
+    'environment': 'staging',
+    'processorcount': '8',
+    'uptime_days': 12,
+    'kernelversion': '3.10',
+}
+
+CLASSES = ['common::linux', 'apache', 'apache::mod_ssl']
+
+
+@pytest.mark.parametrize('expression,callstack', (
+    ('apache', [{'statement': 'apache'}]),
+    ('country=uk and !apache', [{'statement': 'country=uk'},
+                                {'and': 'and'},
+                                {'not': 'not'},
+                                {'statement': 'apache'}]),
+    ('(a or b) and not c', [{'(': '('},
+                            {'statement': 'a'},
+                            {'or': 'or'},
+                            {'statement': 'b'},
+                            {')': ')'},
+                            {'and': 'and'},
+                            {'not': 'not'},
+                            {'statement': 'c'}]),
+    ('country!=uk', [{'statement': 'country!=uk'}]),
+    ('country=/u k/ or /ap(ache)/', [{'statement': 'country=/u k/'},
+                                     {'or': 'or'},
+                                     {'statement': '/ap(ache)/'}]),
+    ('path=/usr/local/bin', [{'statement': 'path=/usr/local/bin'}]),
+))
+def test_tokenize(expression, callstack):
+    assert compound.tokenize(expression) == callstack
+
+
+def test_tokenize__unterminated_regex():
+    with pytest.raises(exc.BadFilterExpression):
+        compound.tokenize('/apache')
+
+
+@pytest.mark.parametrize('expression,result', (
+    ('apache', True),
+    ('nginx', False),
+    ('/mod_/', True),
+    ('/^nginx/', False),
+    ('country=uk', True),
+    ('country==uk', True),
+    ('country=us', False),
+    ('country!=us', True),
+    ('country=/^u/', True),
+    ('country=~^u', True),
+    ('missing=uk', False),
+    ('processorcount>4', True),
+    ('processorcount>=8', True),
+    ('processorcount=>8', True),
+    ('processorcount<10', True),
+    ('processorcount=<7', False),
+    ('uptime_days>9', True),
+    ('kernelversion>3.09', True),
+    ('country=uk and apache', True),
+    ('country=uk and nginx', False),
+    ('country=us or apache', True),
+    ('not apache', False),
+    ('!nginx', True),
+    ('country=uk and (nginx or environment=staging)', True),
+    ('not (country=uk and apache)', False),
+    # and binds tighter than or, as Ruby && and ||
+    ('apache or nginx and country=us', True),
+    ('nginx and country=us or apache', True),
+    ('country=uk or nginx and country=us', True),
+    ('nginx or apache and country=us', False),
+    ('(apache or nginx) and country=us', False),
+))
+def test_evaluate(expression, result):
+    assert compound.parse(expression)(FACTS, CLASSES) is result
+
+
+def test_evaluate_alias():
+    expression = compound.parse('apache')
+    assert expression.evaluate({}, CLASSES) is True
+
+
+def test_expression_callstack():
+    expression = compound.parse('country=uk and apache')
+    assert expression.callstack == compound.tokenize('country=uk and apache')
+
+
+def test_expression_from_callstack():
+    expression = compound.Expression([{'statement': 'country=uk'}])
+    assert expression(FACTS) is True
+
+
+@pytest.mark.parametrize('expression', (
+    '',
+    'and apache',
+    'apache and',
+    'apache nginx',
+    '(apache',
+    'apache)',
+    'country=',
+    '=uk',
+))
+def test_parse_errors(expression):
+    with pytest.raises(exc.BadFilterExpression):
+        compound.parse(expression)
+
+
+def test_unsupported_statements():
+    with pytest.raises(exc.BadFilterExpression):
+        compound.Expression([{'fstatement': {'name': 'foo'}}])
+
+
+def test_compile_fact__bad_operator():
+    with pytest.raises(exc.BadFilterExpression):
+        compound.compile_fact('country', 'uk', '<>')
+
+
+def test_compile_fact__default_operator():
+    assert compound.compile_fact('country', 'uk', None)(FACTS) is True
+
+
+def test_compile_class():
+    assert compound.compile_class('apache')(CLASSES) is True
+    assert compound.compile_class('/^common::/')(CLASSES) is True
+    assert compound.compile_class('nginx')(CLASSES) is False
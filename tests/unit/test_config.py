@@ -120,6 +120,14 @@ def test_get_serializer(import_object, config):
         import_object.assert_called_once_with('serializer.foo.FooSerializer')
 
 
+@pytest.mark.parametrize('provider,name', (('ssl', 'json'),
+                                           ('none', 'yaml')))
+def test_get_serializer_name(config, provider, name):
+    config.config['securityprovider'] = provider
+    config.config['plugin.ssl_serializer'] = 'json'
+    assert config.get_serializer_name() == name
+
+
 def test_get_host_and_ports(config):
     assert config.get_host_and_ports() == [('localhost', 6163),
                                            ('localhost', 6164)]
@@ -202,3 +210,20 @@ def test_get_conn_params__stomp(config):
     assert config.get_conn_params() == {
         'host_and_ports': [('localhost', 6163)],
     }
+
+
+@mock.patch('pymco.utils.import_object')
+def test_get_server_security(import_object, config):
+    with mock.patch.dict('pymco.security.SecurityProvider.server_plugins',
+                         {'ssl': 'security.foo.FooServerProvider'}):
+        assert config.get_server_security() == import_object.return_value
+        import_object.assert_called_once_with(
+            'security.foo.FooServerProvider', config=config)
+
+
+@mock.patch('pymco.utils.import_object')
+def test_get_server_security__fallback(import_object, config):
+    config.config['securityprovider'] = 'none'
+    config.get_server_security()
+    import_object.assert_called_once_with(
+        'pymco.security.none.NoneProvider', config=config)
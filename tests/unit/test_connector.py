@@ -1,9 +1,13 @@
 """Tests for python-mcollective base connector."""
+import threading
+import time
+
 import pytest
-import six
 
 from pymco import connector
 from pymco import exc
+from pymco import metrics
+from pymco.test import broker as _broker
 from pymco.test.utils import mock
 
 
@@ -23,6 +27,7 @@ class ConnectorFake(connector.Connector):
 
 @pytest.fixture
 def fake_connector(config, conn_mock):
+    conn_mock.transport.listeners = {}
     return ConnectorFake(config=config, connection=conn_mock)
 
 
@@ -52,7 +57,7 @@ def test_connector_security__caches_security(get_security, fake_connector):
 
 @mock.patch('pymco.connector.Connector.get_current_host_and_port')
 def test_connect(host_and_port, fake_connector, conn_mock, config):
-    conn_mock.connected = False
+    conn_mock.is_connected.return_value = False
     host_and_port.return_value = ('localhost', 6163)
     assert fake_connector.connect() is fake_connector
     conn_mock.connect.assert_called_once_with(
@@ -65,7 +70,7 @@ def test_connect(host_and_port, fake_connector, conn_mock, config):
 
 
 def test_connect_already_connected(fake_connector, conn_mock):
-    conn_mock.connected = True
+    conn_mock.is_connected.return_value = True
     assert fake_connector.connect() is fake_connector
     assert 0 == conn_mock.connect.call_count
     assert 0 == conn_mock.start.call_count
@@ -101,18 +106,234 @@ def test_send(security, fake_connector, conn_mock):
                                       destination='destination')
 
 
+@mock.patch('pymco.connector.Connector.security')
+def test_send_many(security, fake_connector, conn_mock):
+    security.encode.return_value = 'body'
+    assert fake_connector.send_many('foo', ['dest1', 'dest2']) is fake_connector
+    security.encode.assert_called_once_with('foo')
+    conn_mock.transport.send.assert_called_once_with(
+        b'SEND\ndestination:dest1\ncontent-length:4\n\nbody\x00'
+        b'SEND\ndestination:dest2\ncontent-length:4\n\nbody\x00')
+    assert conn_mock.send.called is False
+
+
+def test_send_bulk(fake_connector, conn_mock):
+    sent = metrics.MESSAGES_SENT.get()
+    assert fake_connector.send_bulk(
+        [(u'caf\xe9', '/queue/a:b'), (b'\x00\x01', 'dest')],
+        **{'reply-to': '/queue/reply\n'}) is fake_connector
+    frames = _broker.parse(bytearray(conn_mock.transport.send.call_args[0][0]))
+    assert frames == [
+        _broker.Frame('SEND', {'destination': '/queue/a:b',
+                               'reply-to': '/queue/reply\n',
+                               'content-length': '5'},
+                      u'caf\xe9'.encode('utf-8')),
+        _broker.Frame('SEND', {'destination': 'dest',
+                               'reply-to': '/queue/reply\n',
+                               'content-length': '2'}, b'\x00\x01'),
+    ]
+    assert metrics.MESSAGES_SENT.get() == sent + 2
+
+
+def test_send_bulk__notifies_listeners(fake_connector, conn_mock):
+    listener = mock.Mock()
+    listener.on_send.side_effect = lambda frame: frame.headers.update(
+        {'x-sent': 'yes'})
+    conn_mock.transport.listeners['tracker'] = listener
+    conn_mock.transport.listeners['removed'] = None
+    fake_connector.send_bulk([('foo', 'dest1'), ('foo', 'dest2')],
+                             priority=4)
+    frames = [call[0][0] for call in listener.on_send.call_args_list]
+    assert [(frame.cmd, frame.headers, frame.body) for frame in frames] == [
+        ('SEND', {'destination': 'dest1', 'priority': 4, 'x-sent': 'yes'},
+         b'foo'),
+        ('SEND', {'destination': 'dest2', 'priority': 4, 'x-sent': 'yes'},
+         b'foo'),
+    ]
+    sent = _broker.parse(bytearray(conn_mock.transport.send.call_args[0][0]))
+    assert [frame.headers['x-sent'] for frame in sent] == ['yes', 'yes']
+
+
+def test_send_bulk__coalesces_up_to_bulk_send_bytes(fake_connector,
+                                                    conn_mock):
+    fake_connector.bulk_send_bytes = 100
+    fake_connector.send_bulk(('x' * 40, 'dest') for _ in range(5))
+    writes = [call[0][0] for call in conn_mock.transport.send.call_args_list]
+    assert len(writes) == 3
+    assert sum(len(_broker.parse(bytearray(write))) for write in writes) == 5
+
+
+def test_send_bulk__traced(fake_connector, conn_mock, tracing_hook):
+    fake_connector.send_bulk([('foo', 'dest1'), ('foo', 'dest2')])
+    tracing_hook.end.assert_called_once_with(
+        tracing_hook.start.return_value, {'messages': 2, 'bytes': 90}, None)
+
+
+def test_send_bulk__receipt(request, config):
+    broker = _broker.Broker().start()
+    request.addfinalizer(broker.stop)
+    connector_ = broker.configure(config).get_connector()
+    connector_.connect(wait=True)
+    request.addfinalizer(connector_.disconnect)
+    received = []
+    broker.subscribe('/queue/foo', lambda headers, body: received.append(
+        headers))
+    connector_.send_bulk([('foo', '/queue/foo')] * 3, receipt='done',
+                         timeout=5)
+    # The broker handles frames in order, so the receipt comes last.
+    assert len(received) == 3
+    assert 'receipt' not in received[-1]
+    assert connector_.connection.get_listener('receipt_listener') is None
+
+
+def test_send_bulk__receipt_timeout(fake_connector, conn_mock):
+    with pytest.raises(exc.TimeoutError):
+        fake_connector.send_bulk([('foo', 'dest')], receipt='done',
+                                 timeout=0)
+    frame = _broker.parse(bytearray(conn_mock.transport.send.call_args[0][0]))
+    assert frame[0].headers['receipt'] == 'done'
+    conn_mock.remove_listener.assert_called_once_with('receipt_listener')
+
+
+def test_send_encoded(fake_connector, conn_mock):
+    assert fake_connector.send_encoded('foo', 'dest', priority=4) is fake_connector
+    conn_mock.send.assert_called_once_with(body='foo',
+                                           destination='dest',
+                                           priority=4)
+
+
+def test_send_encoded__traced(fake_connector, conn_mock, tracing_hook):
+    fake_connector.send_encoded('foo', 'dest')
+    tracing_hook.start.assert_called_once_with(
+        'connector.send', {'destination': 'dest', 'bytes': 3})
+
+
+def test_send_encoded_counts_sent(fake_connector, conn_mock):
+    sent = metrics.MESSAGES_SENT.get()
+    fake_connector.send_encoded('foo', 'dest')
+    assert metrics.MESSAGES_SENT.get() == sent + 1
+
+
 def test_subcscribe(fake_connector, conn_mock):
     assert fake_connector.subscribe('destination', id='some-id') is fake_connector
     conn_mock.subscribe.assert_called_once_with('destination', id='some-id')
 
 
-@mock.patch.object(six.moves.builtins, 'next')
-@mock.patch('pymco.connector.Connector.id_generator')
-def test_subscribe_no_id(id_generator, next, fake_connector, conn_mock):
-    next.return_value = 1
+def test_subscribe_no_id(fake_connector, conn_mock, config):
     assert fake_connector.subscribe('destination') is fake_connector
-    conn_mock.subscribe.assert_called_once_with('destination', id=1)
-    next.assert_called_once_with(id_generator)
+    fake_connector.subscribe('other')
+    assert conn_mock.subscribe.call_args_list == [
+        mock.call('destination', id=1),
+        mock.call('other', id=2),
+    ]
+    # Ids are per connector.
+    other = ConnectorFake(config=config, connection=mock.Mock())
+    other.subscribe('destination')
+    other.connection.subscribe.assert_called_once_with('destination', id=1)
+
+
+def test_subscribe__shared(fake_connector, conn_mock):
+    fake_connector.subscribe('destination', selector='foo')
+    fake_connector.subscribe('destination', selector='foo')
+    conn_mock.subscribe.assert_called_once_with('destination', id=1,
+                                                selector='foo')
+    assert fake_connector.subscriptions.get('destination').users == 2
+
+
+def test_subscribe__conflicting_headers(fake_connector, conn_mock):
+    fake_connector.subscribe('destination', selector='foo')
+    with pytest.raises(ValueError):
+        fake_connector.subscribe('destination', selector='bar')
+    assert conn_mock.subscribe.call_count == 1
+    assert fake_connector.subscriptions.get('destination').users == 1
+
+
+def test_subscribe__error(fake_connector, conn_mock):
+    conn_mock.subscribe.side_effect = ValueError
+    with pytest.raises(ValueError):
+        fake_connector.subscribe('destination')
+    assert 'destination' not in fake_connector.subscriptions
+
+
+def test_unsubscribe(fake_connector, conn_mock):
+    fake_connector.subscribe('destination', id='foo')
+    fake_connector.subscribe('destination')
+    assert fake_connector.unsubscribe('destination') is fake_connector
+    assert conn_mock.unsubscribe.called is False
+    fake_connector.unsubscribe('destination')
+    conn_mock.unsubscribe.assert_called_once_with(id='foo')
+    assert 'destination' not in fake_connector.subscriptions
+    fake_connector.unsubscribe('destination')
+    assert conn_mock.unsubscribe.call_count == 1
+
+
+def test_unsubscribe__not_connected(fake_connector, conn_mock):
+    conn_mock.is_connected.return_value = False
+    fake_connector.subscribe('destination')
+    fake_connector.unsubscribe('destination')
+    assert conn_mock.unsubscribe.called is False
+    assert len(fake_connector.subscriptions) == 0
+
+
+def test_get_reply_subscription_headers__no_prefetch_header(fake_connector,
+                                                          config):
+    config.config['plugin.activemq.reply_prefetch'] = '10'
+    assert fake_connector.get_reply_subscription_headers() == {}
+
+
+def test_get_message_headers(fake_connector, msg):
+    assert fake_connector.get_message_headers(msg) == {}
+
+
+def test_ack_message(fake_connector, conn_mock):
+    fake_connector.subscribe('auto')
+    fake_connector.subscribe('acked', ack='client-individual')
+    fake_connector.ack_message({'message-id': 'foo', 'subscription': '1'})
+    fake_connector.ack_message({'message-id': 'bar', 'subscription': '3'})
+    assert conn_mock.ack.called is False
+    fake_connector.ack_message({'message-id': 'foo', 'subscription': '2'})
+    conn_mock.ack.assert_called_once_with('foo', '2')
+
+
+def test_disconnect__forgets_subscriptions(fake_connector, conn_mock):
+    fake_connector.subscribe('destination')
+    fake_connector.disconnect()
+    fake_connector.subscribe('destination')
+    assert conn_mock.subscribe.call_count == 2
+
+
+def test_reconnect(fake_connector, conn_mock):
+    conn_mock.is_connected.return_value = False
+    fake_connector.subscribe('/queue/foo', id='foo')
+    fake_connector.subscribe('/queue/bar', id='bar', selector='spam')
+    conn_mock.subscribe.reset_mock()
+    with mock.patch.object(fake_connector, 'get_current_host_and_port',
+                           return_value=('localhost', 6163)):
+        assert fake_connector.reconnect() is fake_connector
+    assert conn_mock.connect.call_args[1]['wait'] is True
+    assert conn_mock.subscribe.call_args_list == [
+        mock.call('/queue/foo', id='foo'),
+        mock.call('/queue/bar', id='bar', selector='spam'),
+    ]
+
+
+@mock.patch.object(ConnectorFake, 'selects_brokers', False)
+@mock.patch('stomp.connect.StompConnection11')
+def test_reconnect__replaces_connection(conn_mock, config):
+    connector_ = ConnectorFake(config=config)
+    old = connector_.connection
+    new = conn_mock.return_value = mock.Mock(**{
+        'is_connected.return_value': False,
+        'get_listener.return_value': None,
+    })
+    old.transport.listeners = {'tracker': mock.sentinel.tracker}
+    with mock.patch.object(connector_, 'get_current_host_and_port',
+                           return_value=('localhost', 6163)):
+        connector_.reconnect()
+    old.transport.disconnect_socket.assert_called_once_with()
+    assert connector_.connection is new
+    new.set_listener.assert_any_call('tracker', mock.sentinel.tracker)
+    assert new.connect.called
 
 
 def test_set_ssl(config, conn_mock):
@@ -131,38 +352,156 @@ def test_set_ssl(config, conn_mock):
 
 
 @mock.patch('pymco.listener.SingleResponseListener',
-            **{'return_value.responses.__len__.return_value': 1})
+            **{'return_value.consume.return_value': [mock.sentinel.reply],
+               'return_value.lost': False})
 class TestReceive:
-    def patch_connection(self, fake_connector):
-        return mock.patch.multiple(fake_connector,
-                                   connect=mock.DEFAULT,
-                                   subscribe=mock.DEFAULT,
-                                   disconnect=mock.DEFAULT)
-
     def test_receive__sets_single_response_listener(self,
                                                     listener,
                                                     fake_connector,
                                                     conn_mock):
         fake_connector.receive(5)
+        listener.assert_called_once_with(config=fake_connector.config,
+                                         ack=fake_connector.ack_message)
         assert mock.call('response_listener', listener.return_value
                          ) in conn_mock.set_listener.call_args_list
 
+    def test_receive__keeps_listener(self, listener, fake_connector,
+                                     conn_mock):
+        fake_connector.get_response_listener()
+        fake_connector.receive(5)
+        fake_connector.receive(5)
+        assert listener.call_count == 1
+
     def test_receive__sets_the_right_timeout(self,
                                              listener,
                                              fake_connector,
                                              conn_mock):
         fake_connector.receive(5)
-        listener.assert_called_once_with(timeout=5,
-                                         config=fake_connector.config)
+        listener.return_value.wait_on_message.assert_called_once_with(5)
+
+    def test_receive__consumes_replies(self, listener, fake_connector,
+                                       conn_mock):
+        assert fake_connector.receive(5) == [mock.sentinel.reply]
+        listener.return_value.consume.assert_called_once_with()
 
     def test_receive__raises_timeout_error_if_no_message(self,
                                                          listener,
                                                          fake_connector,
                                                          conn_mock):
-        listener.return_value.responses.__len__.return_value = 0
-        with self.patch_connection(fake_connector):
-            with pytest.raises(exc.TimeoutError):
-                fake_connector.receive(5)
+        listener.return_value.consume.return_value = []
+        with pytest.raises(exc.TimeoutError):
+            fake_connector.receive(5)
+
+    def test_receive__raises_connection_lost(self, listener, fake_connector,
+                                             conn_mock):
+        listener.return_value.consume.return_value = []
+        listener.return_value.lost = True
+        with pytest.raises(exc.ConnectionLostError):
+            fake_connector.receive(5)
+
+    def test_receive__records_latency(self, listener, fake_connector,
+                                      conn_mock):
+        fake_connector._select_brokers = True
+        fake_connector._selector = selector = mock.MagicMock()
+        selector.__len__.return_value = 2
+        fake_connector._sent_at = 10.0
+        listener.return_value.consume.return_value = [
+            mock.Mock(received_at=10.5)]
+        with mock.patch.object(fake_connector, 'get_current_host_and_port',
+                               return_value=('localhost', 6163)):
+            fake_connector.receive(5)
+        selector.record_latency.assert_called_once_with(('localhost', 6163),
+                                                        0.5)
+
+    def test_receive__traced(self, listener, fake_connector, conn_mock,
+                             tracing_hook):
+        fake_connector.receive(5)
+        tracing_hook.end.assert_called_once_with(
+            tracing_hook.start.return_value, {'timeout': 5, 'replies': 1},
+            None)
+
+    def test_unsubscribe__drops_buffered_replies(self, listener,
+                                                 fake_connector, conn_mock):
+        fake_connector.get_response_listener()
+        fake_connector.subscribe('destination')
+        fake_connector.subscribe('destination')
+        fake_connector.unsubscribe('destination')
+        assert listener.return_value.consume.called is False
+        fake_connector.unsubscribe('destination')
+        listener.return_value.consume.assert_called_once_with('destination')
+
+    def test_reconnect__resets_listener(self, listener, fake_connector,
+                                        conn_mock):
+        fake_connector.get_response_listener()
+        with mock.patch.object(fake_connector, 'get_current_host_and_port',
+                               return_value=('localhost', 6163)):
+            fake_connector.reconnect()
+        listener.return_value.reset.assert_called_once_with()
+
+    def test_disconnect__resets_listener(self, listener, fake_connector,
+                                         conn_mock):
+        fake_connector.get_response_listener()
+        fake_connector.disconnect()
+        listener.return_value.reset.assert_called_once_with()
+
+
+HOST_A, HOST_B = ('a', 61613), ('b', 61613)
+
+
+class TestConnectFirst:
+    def test_first_wins(self, fake_connector):
+        connections = {HOST_A: mock.Mock(), HOST_B: mock.Mock()}
+        with mock.patch.object(fake_connector, 'connect_broker',
+                               side_effect=lambda host, wait: connections[host]):
+            connection, errors = fake_connector.connect_first([HOST_A, HOST_B],
+                                                              stagger=1)
+        assert connection is connections[HOST_A]
+        assert errors == []
+
+    def test_failures_start_next_right_away(self, fake_connector):
+        error = ValueError()
+
+        def connect_broker(host, wait):
+            if host == HOST_A:
+                raise error
+            return host
+
+        with mock.patch.object(fake_connector, 'connect_broker',
+                               side_effect=connect_broker):
+            start = time.time()
+            result = fake_connector.connect_first([HOST_A, HOST_B], stagger=10)
+        assert result == (HOST_B, [error])
+        assert time.time() - start < 5
+
+    def test_slow_brokers_are_raced(self, fake_connector):
+        release = threading.Event()
+
+        def connect_broker(host, wait):
+            if host == HOST_A:
+                release.wait(5)
+            return host
+
+        with mock.patch.object(fake_connector, 'connect_broker',
+                               side_effect=connect_broker):
+            with mock.patch.object(fake_connector,
+                                   'close_connection') as close:
+                assert fake_connector.connect_first(
+                    [HOST_A, HOST_B], stagger=0.01) == (HOST_B, [])
+                release.set()
+                for _ in range(100):
+                    if close.called:
+                        break
+                    time.sleep(0.01)
+        # The late connection is closed.
+        close.assert_called_once_with(HOST_A)
+
+    def test_every_broker_fails(self, fake_connector):
+        with mock.patch.object(fake_connector, 'connect_broker',
+                               side_effect=ValueError):
+            connection, errors = fake_connector.connect_first([HOST_A, HOST_B],
+                                                              stagger=0)
+        assert connection is None
+        assert len(errors) == 2
 
 
 @mock.patch('pymco.config.Config.get_conn_params')
@@ -188,3 +527,40 @@ def test_default_connection__rabbitmq(conn_mock, get_conn_params, config):
     connector = ConnectorFake(config=config)
     assert connector.connection is conn_mock.return_value
     conn_mock.assert_called_once_with(**{'vhost': 'mcollective'})
+
+
+@mock.patch('pymco.config.Config.get_security')
+@mock.patch('pymco.config.Config.get_conn_params')
+@mock.patch('stomp.connect.StompConnection11')
+def test_default_connection__binary_serializer(conn_mock, get_conn_params,
+                                               get_security, config):
+    pytest.importorskip('msgpack')
+    config.config['securityprovider'] = 'ssl'
+    config.config['plugin.ssl_serializer'] = 'msgpack'
+    get_conn_params.return_value = {}
+    connector = ConnectorFake(config=config)
+    assert connector.connection is conn_mock.return_value
+    conn_mock.assert_called_once_with(**{'auto_decode': False})
+    assert get_security.called is False
+
+
+@mock.patch('pymco.config.Config.get_conn_params')
+@mock.patch('stomp.connect.StompConnection11')
+def test_default_connection__text_serializer(conn_mock, get_conn_params,
+                                             config):
+    config.config['securityprovider'] = 'ssl'
+    config.config['plugin.ssl_serializer'] = 'json'
+    get_conn_params.return_value = {}
+    ConnectorFake(config=config)
+    conn_mock.assert_called_once_with()
+
+
+@mock.patch('stomp.connect.StompConnection11')
+def test_default_connection__heartbeats(conn_mock, config):
+    config.config['plugin.activemq.heartbeat_interval'] = '30'
+    ConnectorFake(config=config)
+    assert conn_mock.call_args[1]['heartbeats'] == (30000, 30000)
+
+
+def test_get_direct_subscription(fake_connector):
+    assert fake_connector.get_direct_subscription('mcollective') is None
@@ -0,0 +1,160 @@
+"""Tests for pymco.inventory"""
+import pytest
+
+from pymco import inventory
+from pymco import message
+from pymco.test.utils import mock
+
+NODES = (
+    {'identity': 'web1.example.com',
+     'facts': {'country': 'uk', 'processorcount': 8, 'os': 'Debian'},
+     'classes': ['common::linux', 'apache'],
+     'agents': ['rpcutil', 'package', 'service']},
+    {'identity': 'web2.example.com',
+     'facts': {'country': 'us', 'processorcount': 2, 'os': 'Debian'},
+     'classes': ['common::linux', 'apache'],
+     'agents': ['rpcutil', 'package']},
+    {'identity': 'db1.example.com',
+     'facts': {'country': 'uk', 'processorcount': 16, 'os': 'RedHat'},
+     'classes': ['common::linux', 'mysql::server'],
+     'agents': ['rpcutil', 'service']},
+)
+
+
+@pytest.fixture
+def store():
+    store_ = inventory.Inventory()
+    store_.update_many(NODES)
+    return store_
+
+
+def test_update_many(store):
+    assert len(store) == 3
+    assert 'web1.example.com' in store
+    assert 'foo.example.com' not in store
+
+
+def test_get(store):
+    node = store.get('web1.example.com')
+    assert node['facts'] == {'country': 'uk', 'processorcount': '8',
+                             'os': 'Debian'}
+    assert node['classes'] == ['apache', 'common::linux']
+    assert node['agents'] == ['package', 'rpcutil', 'service']
+
+
+def test_get__unknown(store):
+    assert store.get('foo.example.com') is None
+
+
+def test_update_replaces_node(store):
+    store.update('web1.example.com', facts={'country': 'es'})
+    node = store.get('web1.example.com')
+    assert node['facts'] == {'country': 'es'}
+    assert node['classes'] == []
+    assert len(store) == 3
+
+
+def test_remove(store):
+    store.remove('web1.example.com')
+    assert 'web1.example.com' not in store
+    assert store.discover(message.Filter().add_agent('package')) == [
+        'web2.example.com']
+
+
+@mock.patch('time.time')
+def test_expire(time, store):
+    time.return_value = 1000
+    store.update('old.example.com', updated=10)
+    assert store.expire(max_age=100) == ['old.example.com']
+    assert 'old.example.com' not in store
+
+
+@pytest.mark.parametrize('filter_,identities', (
+    (message.Filter(), ['db1.example.com', 'web1.example.com',
+                        'web2.example.com']),
+    (message.Filter().add_agent('service'), ['db1.example.com',
+                                             'web1.example.com']),
+    (message.Filter().add_agent('service').add_agent('package'),
+     ['web1.example.com']),
+    (message.Filter().add_cfclass('apache'), ['web1.example.com',
+                                              'web2.example.com']),
+    (message.Filter().add_cfclass('/^mysql/'), ['db1.example.com']),
+    (message.Filter().add_fact('country', 'uk'), ['db1.example.com',
+                                                  'web1.example.com']),
+    (message.Filter().add_fact('country', 'uk', '!='), ['web2.example.com']),
+    (message.Filter().add_fact('country', '/^u/'), ['db1.example.com',
+                                                    'web1.example.com',
+                                                    'web2.example.com']),
+    (message.Filter().add_fact('processorcount', '4', '>'),
+     ['db1.example.com', 'web1.example.com']),
+    (message.Filter().add_fact('processorcount', 8, '=='),
+     ['web1.example.com']),
+    (message.Filter().add_identity('web1.example.com').add_identity('/^db/'),
+     ['db1.example.com', 'web1.example.com']),
+    (message.Filter().add_compound('apache and country=uk'),
+     ['web1.example.com']),
+    (message.Filter().add_agent('rpcutil').add_compound('os=RedHat or '
+                                                        'country=us'),
+     ['db1.example.com', 'web2.example.com']),
+))
+def test_discover(store, filter_, identities):
+    assert store.discover(filter_) == identities
+
+
+def test_discover__compiled_filter(store):
+    filter_ = message.Filter().add_cfclass('apache').compile()
+    assert store.discover(filter_) == ['web1.example.com', 'web2.example.com']
+
+
+@mock.patch('time.time')
+def test_discover__max_age(time, store):
+    time.return_value = 1000
+    store.update('old.example.com', agents=['package'], updated=10)
+    store.update('new.example.com', agents=['package'], updated=990)
+    filter_ = message.Filter().add_agent('package')
+    assert 'old.example.com' in store.discover(filter_)
+    assert 'old.example.com' not in store.discover(filter_, max_age=100)
+    assert 'new.example.com' in store.discover(filter_, max_age=100)
+
+
+def test_update_from_reply(store):
+    store.update_from_reply({
+        ':senderid': 'new.example.com',
+        ':body': {':statuscode': 0,
+                  ':data': {':agents': ['rpcutil'],
+                            ':classes': ['nginx'],
+                            ':facts': {'country': 'es'}}},
+    })
+    assert store.discover(message.Filter().add_cfclass('nginx')) == [
+        'new.example.com']
+
+
+def test_update_from_reply__lazy_reply(store):
+    security = mock.Mock()
+    security.deserialize.return_value = {':senderid': 'new.example.com',
+                                         ':body': 'serialized'}
+    security.deserialize_body.return_value = {
+        'data': {'agents': ['rpcutil'], 'facts': {}, 'classes': ['nginx']}}
+    store.update_from_reply(message.Reply('frame', security))
+    assert store.get('new.example.com')['classes'] == ['nginx']
+
+
+def test_update_from_registration(store):
+    store.update_from_registration({
+        ':senderid': 'new.example.com',
+        ':body': {':agentlist': ['rpcutil', 'puppet'],
+                  ':classes': ['nginx'],
+                  ':facts': {'country': 'es'},
+                  ':identity': 'new.example.com'},
+    })
+    node = store.get('new.example.com')
+    assert node['agents'] == ['puppet', 'rpcutil']
+    assert node['facts'] == {'country': 'es'}
+
+
+def test_persistent_database(tmpdir):
+    path = str(tmpdir.join('inventory.db'))
+    store = inventory.Inventory(path)
+    store.update_many(NODES)
+    store.close()
+    assert len(inventory.Inventory(path)) == 3
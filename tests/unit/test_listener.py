@@ -4,6 +4,8 @@ Tests for pymco.listener
 import pytest
 
 from pymco import listener
+from pymco import message
+from pymco import metrics
 from pymco.test.utils import mock
 
 
@@ -42,17 +44,85 @@ class TestOnMessage():
         condition.notify.assert_called_once_with()
         condition.release.assert_called_once_with()
 
-    def test_deseralize_message(self, get_security, result_listener):
+    def test_deseralize_message_lazily(self, get_security, result_listener):
         deserialize = get_security.return_value.deserialize
         deserialize.return_value = {'foo': 'spam'}
         result_listener.on_message(body='---\nfoo: spam', headers={})
+        assert deserialize.called is False
+        assert result_listener.responses[0]['foo'] == 'spam'
         deserialize.assert_called_once_with('---\nfoo: spam')
 
     def test_appends_messages(self, get_security, result_listener):
-        result_listener.on_message(body='---\nfoo: spam', headers={})
         deserialize = get_security.return_value.deserialize
-        deserialize.assert_called_once_with('---\nfoo: spam')
-        assert result_listener.responses == [deserialize.return_value]
+        deserialize.return_value = {'foo': 'spam'}
+        result_listener.on_message(body='---\nfoo: spam', headers={})
+        assert result_listener.responses == [{'foo': 'spam'}]
+        assert isinstance(result_listener.responses[0], message.Reply)
+
+    @mock.patch('timeit.default_timer')
+    def test_sets_received_at(self, timer, get_security, result_listener):
+        timer.return_value = 42.0
+        result_listener.on_message(body='---\nfoo: spam', headers={})
+        assert result_listener.responses[0].received_at == 42.0
+
+    def test_accounts_metrics(self, get_security, result_listener):
+        received = metrics.REPLIES_RECEIVED.get()
+        buffered = metrics.BUFFERED_REPLIES.get()
+        result_listener.on_message(body='---\nfoo: spam', headers={})
+        assert metrics.REPLIES_RECEIVED.get() == received + 1
+        assert metrics.BUFFERED_REPLIES.get() == buffered + 1
+        result_listener.consume()
+        assert metrics.BUFFERED_REPLIES.get() == buffered
+
+    def test_reset_drops_replies(self, get_security, result_listener):
+        buffered = metrics.BUFFERED_REPLIES.get()
+        result_listener.on_message(body='---\nfoo: spam', headers={})
+        result_listener.lost = True
+        result_listener.reset()
+        assert result_listener.responses == []
+        assert result_listener.lost is False
+        assert metrics.BUFFERED_REPLIES.get() == buffered
+
+
+@mock.patch('pymco.config.Config.get_security')
+class TestConsume():
+    @pytest.fixture
+    def ack(self):
+        return mock.Mock()
+
+    @pytest.fixture
+    def ack_listener(self, config, condition, ack):
+        return listener.ResponseListener(config, condition=condition, count=1,
+                                         ack=ack)
+
+    def receive(self, ack_listener, number, destination='/queue/foo'):
+        for index in range(number):
+            ack_listener.on_message(body='foo', headers={
+                'message-id': '{0}-{1}'.format(destination, index),
+                'destination': destination})
+
+    def test_acks_only_when_consumed(self, get_security, ack_listener, ack):
+        self.receive(ack_listener, 3)
+        ack_listener.wait_on_message()
+        assert ack.called is False
+        assert len(ack_listener.consume()) == 3
+        assert [call[0][0]['message-id'] for call in ack.call_args_list] == [
+            '/queue/foo-0', '/queue/foo-1', '/queue/foo-2']
+        assert ack_listener.responses == []
+        assert ack_listener.received == 0
+
+    def test_consume_destination(self, get_security, ack_listener, ack):
+        self.receive(ack_listener, 2, '/queue/foo')
+        self.receive(ack_listener, 1, '/queue/bar')
+        assert len(ack_listener.consume('/queue/bar')) == 1
+        assert ack.call_count == 1
+        assert len(ack_listener.responses) == 2
+        assert ack_listener.received == 2
+
+    def test_reset_does_not_ack(self, get_security, ack_listener, ack):
+        self.receive(ack_listener, 2)
+        ack_listener.reset()
+        assert ack.called is False
 
 
 def test_wait_on_message__acquire_release_condition(result_listener, condition):
@@ -62,9 +132,10 @@ def test_wait_on_message__acquire_release_condition(result_listener, condition):
     condition.release.assert_called_once_with()
 
 
-def test_wait_on_message__reset_received_count(result_listener, condition):
-    result_listener.received = result_listener.count + 1
-    assert result_listener.wait_on_message().received == 0
+def test_wait_on_message__timeout(result_listener, condition):
+    with mock.patch.object(result_listener, '_wait_loop') as wait_loop:
+        result_listener.wait_on_message(2)
+    wait_loop.assert_called_once_with(2)
 
 
 def test_wait_on_message__runs_wait_loop(result_listener, condition):
@@ -88,6 +159,15 @@ def test_wait_loop__exits_on_timeout(time, result_listener, condition):
     assert condition.wait.call_args_list == [mock.call(5), mock.call(3)]
 
 
+@pytest.mark.parametrize('event', ('on_disconnected', 'on_heartbeat_timeout'))
+def test_wait_loop__exits_when_lost(result_listener, condition, event):
+    getattr(result_listener, event)()
+    result_listener._wait_loop(5)
+    assert result_listener.lost is True
+    condition.notify.assert_called_once_with()
+    assert condition.wait.called is False
+
+
 @mock.patch('pymco.config.Config.get_security')
 def test_security(get_security, result_listener):
     assert result_listener.security == get_security.return_value
@@ -106,3 +186,16 @@ def test_current_host_port_listener(track_listener):
     track_listener.on_connecting(('localhost', 61613))
     assert track_listener.get_host() == 'localhost'
     assert track_listener.get_port() == 61613
+
+
+@pytest.mark.parametrize('event', ('on_disconnected', 'on_heartbeat_timeout'))
+def test_connection_lost_listener(event):
+    callback = mock.Mock()
+    getattr(listener.ConnectionLostListener(callback), event)()
+    callback.assert_called_once_with()
+
+
+def test_callback_listener():
+    callback = mock.Mock()
+    listener.CallbackListener(callback).on_message({'foo': 'bar'}, 'body')
+    callback.assert_called_once_with({'foo': 'bar'}, 'body')
@@ -0,0 +1,79 @@
+"""Tests for pymco.matcher"""
+import pytest
+
+from pymco import matcher
+from pymco import message
+from pymco.test.utils import mock
+
+
+@pytest.fixture
+def filter_matcher():
+    return matcher.FilterMatcher('mco1',
+                                 agents=['discovery', 'package'],
+                                 facts={'country': 'uk',
+                                        'processorcount': '8'},
+                                 classes=['apache', 'common::linux'])
+
+
+@pytest.mark.parametrize('filter_,result', (
+    ({}, True),
+    (message.Filter(), True),
+    (message.Filter().add_agent('package'), True),
+    (message.Filter().add_agent('/^pack/'), True),
+    (message.Filter().add_agent('service'), False),
+    (message.Filter().add_cfclass('/linux/'), True),
+    (message.Filter().add_cfclass('nginx'), False),
+    (message.Filter().add_fact('country', 'uk'), True),
+    (message.Filter().add_fact('processorcount', '16', '<'), True),
+    (message.Filter().add_fact('country', '/^u/'), True),
+    (message.Filter().add_fact('country', 'us'), False),
+    (message.Filter().add_fact('missing', 'us', '!='), False),
+    (message.Filter().add_identity('foo').add_identity('mco1'), True),
+    (message.Filter().add_identity('/^mco/'), True),
+    (message.Filter().add_identity('foo'), False),
+    (message.Filter().add_compound('apache and country=uk'), True),
+    (message.Filter().add_compound('not apache or country=us'), False),
+    (message.Filter().add_agent('package').add_identity('foo'), False),
+    ({'fact': [{':fact': 'country', ':value': 'uk', ':operator': '<>'}]},
+     False),
+))
+def test_matches(filter_matcher, filter_, result):
+    assert filter_matcher.matches(dict(filter_)) is result
+
+
+def test_matches__compiled_filter(filter_matcher):
+    assert filter_matcher(message.Filter().add_agent('package').compile())
+
+
+@mock.patch('pymco.matcher.compile_filter')
+def test_matches__caches_results(compile_filter, filter_matcher):
+    filter_ = {'agent': ['package'], 'identity': []}
+    assert filter_matcher.matches(filter_) is True
+    assert filter_matcher.matches({'identity': [], 'agent': ['package']})
+    compile_filter.assert_called_once_with(filter_)
+    assert compile_filter.return_value.call_count == 1
+
+
+@mock.patch('pymco.matcher.compile_filter')
+def test_update__keeps_predicates(compile_filter, filter_matcher):
+    filter_ = {'fact': [{':fact': 'country', ':value': 'uk'}]}
+    compile_filter.return_value.side_effect = (True, False)
+    assert filter_matcher.matches(filter_) is True
+    filter_matcher.update(facts={'country': 'us'})
+    assert filter_matcher.matches(filter_) is False
+    assert compile_filter.call_count == 1
+
+
+def test_update(filter_matcher):
+    filter_ = dict(message.Filter().add_identity('mco2').add_agent('service'))
+    assert filter_matcher.matches(filter_) is False
+    filter_matcher.update(identity='mco2', agents=['service'])
+    assert filter_matcher.matches(filter_) is True
+
+
+def test_maxsize(filter_matcher):
+    filter_matcher.maxsize = 2
+    for identity in ('mco1', 'mco2', 'mco3'):
+        filter_matcher.matches({'identity': [identity]})
+    assert len(filter_matcher._results) == 1
+    assert len(filter_matcher._predicates) == 1
@@ -4,6 +4,7 @@ import pytest
 from pymco import exc
 from pymco import message
 from pymco.test import ctxt
+from pymco.test.utils import mock
 
 
 @pytest.fixture
@@ -63,6 +64,22 @@ def test_filter_add_identity(filter_):
     assert filter_['identity'] == ['foo.bar.com', 'spam.bar.com']
 
 
+def test_filter_add_compound(filter_):
+    """Tests :py:method:`pymco.message.Filter.add_compound`."""
+    from pymco import compound
+    filter_.add_compound('country=uk and apache')
+    filter_.add_compound(compound.parse('nginx'))
+    assert filter_['compound'] == [
+        [{'statement': 'country=uk'}, {'and': 'and'}, {'statement': 'apache'}],
+        [{'statement': 'nginx'}],
+    ]
+
+
+def test_filter_add_compound__bad_expression(filter_):
+    with pytest.raises(exc.BadFilterExpression):
+        filter_.add_compound('country=uk and')
+
+
 def test_filter_method_chaining(filter_):
     '''Tests :py:class:`pymco.message.Filter` method chaining.'''
     assert dict(filter_) == {'cf_class': [],
@@ -87,6 +104,78 @@ def test_filter_length(filter_):
     assert len(filter_) == 5
 
 
+def test_filter_compile(filter_):
+    """Tests :py:meth:`pymco.message.Filter.compile` canonical form."""
+    filter_.add_agent('package').add_agent('discovery').add_agent('package')
+    filter_.add_fact('country', 'uk', '==').add_fact('arch', 'x86_64')
+    filter_.add_fact('country', 'uk', '==')
+    compiled = filter_.compile()
+    assert isinstance(compiled, message.CompiledFilter)
+    assert compiled['agent'] == ['discovery', 'package']
+    assert compiled['fact'] == [
+        {':fact': 'arch', ':value': 'x86_64'},
+        {':fact': 'country', ':value': 'uk', ':operator': '=='},
+    ]
+    assert len(compiled) == 5
+    assert sorted(compiled) == sorted(filter_)
+
+
+def test_compiled_filter_equality_and_hash():
+    """Tests filters built in different order compile to equal objects."""
+    filter1 = message.Filter().add_agent('package').add_cfclass('apache')
+    filter1.add_identity('foo').add_identity('bar')
+    filter2 = message.CompactFilter().add_identity('bar').add_identity('foo')
+    filter2.add_cfclass('apache').add_agent('package').add_agent('package')
+    assert filter1.compile() == filter2.compile()
+    assert hash(filter1.compile()) == hash(filter2.compile())
+    assert filter1.compile() != message.Filter().compile()
+    assert {filter1.compile(): 'cached'}[filter2.compile()] == 'cached'
+
+
+def test_compiled_filter_compare_with_mappings(filter_):
+    """Tests compiled filters are equal to their dict form."""
+    assert filter_.compile() == dict(filter_)
+
+
+def test_compiled_filter_is_a_snapshot(filter_):
+    """Tests compiled filters don't change with the original filter."""
+    compiled = filter_.compile()
+    filter_.add_agent('package')
+    assert compiled['agent'] == []
+
+
+def test_compiled_filter_compile(filter_):
+    compiled = filter_.compile()
+    assert compiled.compile() is compiled
+
+
+def test_compiled_filter_compound():
+    """Tests compound callstacks are kept in order, but de-duplicated."""
+    filter_ = message.Filter()
+    callstack = [{'statement': 'country=uk'},
+                 {'and': 'and'},
+                 {'statement': 'apache'}]
+    filter_['compound'].append(callstack)
+    filter_['compound'].append(list(callstack))
+    assert filter_.compile()['compound'] == [callstack]
+
+
+def test_compiled_filter_to_dict_is_cached(filter_):
+    compiled = filter_.compile()
+    assert compiled.to_dict() is compiled.to_dict()
+    assert compiled.to_dict() == dict(filter_)
+
+
+def test_message_compiled_filter_is_not_copied(config, filter_):
+    """Tests messages use compiled filter dicts as they are."""
+    compiled = filter_.compile()
+    msg = message.Message(body='ping', agent='discovery', config=config,
+                          filter_=compiled)
+    assert msg[':filter'] is compiled.to_dict()
+    msg[':filter'] = compiled
+    assert msg[':filter'] is compiled.to_dict()
+
+
 def test_message(msg, filter_):
     '''Tests :py:class:`pymco.message.Message` attribues.'''
     for name, value in ((':senderid', 'mco1'),
@@ -155,3 +244,268 @@ def test_msg_update_no_symbol(msg):
     """Test update msg with a non symbol raises ValueError"""
     with pytest.raises(ValueError):
         msg['foo'] = 'foo'
+
+
+def test_message_to_dict(msg):
+    """Tests :py:meth:`pymco.message.Message.to_dict` doesn't copy."""
+    assert msg.to_dict() is msg._message
+
+
+def test_message_from_dict():
+    """Tests :py:meth:`pymco.message.Message.from_dict`."""
+    msg = message.Message.from_dict({':body': 'ping'})
+    assert isinstance(msg, message.Message)
+    assert dict(msg) == {':body': 'ping'}
+
+
+@pytest.fixture
+def compact_filter():
+    return message.CompactFilter()
+
+
+def test_compact_filter_add_methods(compact_filter):
+    """Tests :py:class:`pymco.message.CompactFilter` add methods."""
+    compact_filter.add_agent('package').add_cfclass('apache')
+    compact_filter.add_identity('foo.bar.com').add_fact('country', 'uk', '==')
+    assert compact_filter.agent == ['package']
+    assert compact_filter['cf_class'] == ['apache']
+    assert compact_filter['identity'] == ['foo.bar.com']
+    assert compact_filter['fact'] == [{':fact': 'country',
+                                       ':value': 'uk',
+                                       ':operator': '=='}]
+    with pytest.raises(exc.BadFilterFactOperator):
+        compact_filter.add_fact(fact='country', value='uk', operator='bad')
+
+
+def test_compact_filter_mapping(compact_filter, filter_):
+    """Tests :py:class:`pymco.message.CompactFilter` behaves like
+    :py:class:`pymco.message.Filter`."""
+    assert len(compact_filter) == len(filter_)
+    assert dict(compact_filter) == dict(filter_)
+    assert compact_filter.to_dict() == dict(filter_)
+    with pytest.raises(KeyError):
+        compact_filter['foo']
+
+
+def test_message_compact_filter_uses_to_dict(config, compact_filter):
+    """Tests messages get compact filters dicts from ``to_dict``."""
+    with mock.patch.object(message.CompactFilter, '__iter__') as iter_:
+        msg = message.Message(body='ping', agent='discovery', config=config,
+                              filter_=compact_filter)
+    assert iter_.called is False
+    assert msg[':filter'] == compact_filter.to_dict()
+
+
+def test_compact_filter_has_no_dict(compact_filter):
+    """Tests :py:class:`pymco.message.CompactFilter` uses slots."""
+    assert not hasattr(compact_filter, '__dict__')
+
+
+@pytest.fixture
+def compact_msg(config, filter_):
+    with mock.patch('time.time') as time:
+        with mock.patch('hashlib.sha1') as sha1:
+            time.return_value = ctxt.MSG['msgtime']
+            sha1.return_value.hexdigest.return_value = ctxt.MSG['requestid']
+            return message.CompactMessage(body=ctxt.MSG['body'],
+                                          agent=ctxt.MSG['agent'],
+                                          filter_=filter_,
+                                          config=config)
+
+
+def test_compact_message(compact_msg, msg):
+    """Tests :py:class:`pymco.message.CompactMessage` has the same fields
+    than :py:class:`pymco.message.Message`."""
+    assert dict(compact_msg) == dict(msg)
+    assert compact_msg.to_dict() == msg.to_dict()
+    assert len(compact_msg) == len(msg)
+    assert compact_msg.body == ctxt.MSG['body']
+    assert compact_msg[':agent'] == ctxt.MSG['agent']
+
+
+def test_compact_message_set_item(compact_msg):
+    """Tests :py:meth:`pymco.message.CompactMessage.__setitem__`."""
+    compact_msg[':callerid'] = 'user=foo'
+    compact_msg[':test'] = 123
+    assert compact_msg.callerid == 'user=foo'
+    assert compact_msg[':test'] == 123
+    assert compact_msg.to_dict()[':test'] == 123
+    with pytest.raises(ValueError):
+        compact_msg['foo'] = 'foo'
+
+
+def test_compact_message_filter_update(compact_msg):
+    """Tests :py:class:`pymco.message.CompactMessage` keeps filters as
+    dicts."""
+    compact_msg[':filter'] = message.CompactFilter()
+    assert isinstance(compact_msg.filter, dict)
+
+
+def test_compact_message_del_item(compact_msg):
+    """Tests :py:meth:`pymco.message.CompactMessage.__delitem__`."""
+    compact_msg[':test'] = 123
+    del compact_msg[':test']
+    del compact_msg[':body']
+    for key in (':test', ':body', ':hash'):
+        with pytest.raises(KeyError):
+            compact_msg[key]
+        with pytest.raises(KeyError):
+            del compact_msg[key]
+    assert ':body' not in compact_msg.to_dict()
+
+
+def test_compact_message_has_no_dict(compact_msg):
+    """Tests :py:class:`pymco.message.CompactMessage` uses slots."""
+    assert not hasattr(compact_msg, '__dict__')
+
+
+def test_compact_message_raises_improperly_configured(filter_):
+    with pytest.raises(exc.ImproperlyConfigured):
+        message.CompactMessage(body='ping',
+                               agent='discovery',
+                               config={},
+                               filter_=filter_)
+
+
+def test_compact_message_from_dict(msg):
+    """Tests :py:meth:`pymco.message.CompactMessage.from_dict`."""
+    compact_msg = message.CompactMessage.from_dict(msg.to_dict())
+    assert compact_msg.to_dict() == msg.to_dict()
+
+
+@pytest.fixture
+def template(config, filter_):
+    filter_.add_agent(ctxt.MSG['agent'])
+    return message.MessageTemplate(agent=ctxt.MSG['agent'],
+                                   config=config,
+                                   filter_=filter_)
+
+
+@mock.patch('time.time')
+def test_template_new(time, template, filter_):
+    """Tests :py:meth:`pymco.message.MessageTemplate.new` fills messages."""
+    time.return_value = ctxt.MSG['msgtime']
+    msg = template.new(body=ctxt.MSG['body'])
+    assert isinstance(msg, message.Message)
+    for name, value in ((':senderid', 'mco1'),
+                        (':msgtime', int(ctxt.MSG['msgtime'])),
+                        (':ttl', 60),
+                        (':body', ctxt.MSG['body']),
+                        (':agent', ctxt.MSG['agent']),
+                        (':collective', 'mcollective'),
+                        (':filter', dict(filter_)),
+                        ):
+        assert msg[name] == value
+    assert len(msg[':requestid']) == 32
+
+
+def test_template_call(template):
+    """Tests :py:class:`pymco.message.MessageTemplate` is callable."""
+    assert template(body='ping')[':body'] == 'ping'
+
+
+def test_template_unique_request_ids(template):
+    """Tests messages built on the same second get different request ids."""
+    assert (template.new(body='ping')[':requestid'] !=
+            template.new(body='ping')[':requestid'])
+
+
+def test_template_messages_are_independent(template):
+    """Tests messages built from a template don't share state."""
+    msg1, msg2 = template.new(body='ping'), template.new(body='pong')
+    msg1[':ttl'] = 10
+    assert msg2[':ttl'] == 60
+    assert msg2[':body'] == 'pong'
+
+
+def test_template_custom_collective_and_ttl(config):
+    """Tests :py:class:`pymco.message.MessageTemplate` keyword arguments."""
+    template = message.MessageTemplate(agent='discovery',
+                                       config=config,
+                                       collective='sub1',
+                                       ttl=10)
+    msg = template.new(body='ping')
+    assert msg[':collective'] == 'sub1'
+    assert msg[':ttl'] == 10
+    assert msg[':filter'] == dict(message.Filter())
+
+
+def test_template_message_class(config):
+    """Tests :py:class:`pymco.message.MessageTemplate` can build compact
+    messages."""
+    template = message.MessageTemplate(agent='discovery',
+                                       config=config,
+                                       message_class=message.CompactMessage)
+    msg = template.new(body='ping')
+    assert isinstance(msg, message.CompactMessage)
+    assert msg.body == 'ping'
+
+
+def test_template_raises_improperly_configured():
+    """Tests :py:class:`pymco.message.MessageTemplate` raises
+    :py:exc:`pymco.exc.ImproperlyConfigured` on incomplete configuration."""
+    with pytest.raises(exc.ImproperlyConfigured):
+        message.MessageTemplate(agent='discovery', config={})
+
+
+@pytest.fixture
+def reply_security():
+    security = mock.Mock()
+    security.deserialize.return_value = {':senderid': 'mco1',
+                                         ':requestid': 'some-id',
+                                         ':body': 'serialized body'}
+    return security
+
+
+@pytest.fixture
+def reply(reply_security):
+    return message.Reply('frame', reply_security)
+
+
+def test_reply_is_lazy(reply, reply_security):
+    """Tests :py:class:`pymco.message.Reply` doesn't de-serialize on init."""
+    assert reply_security.deserialize.called is False
+    assert reply_security.deserialize_body.called is False
+
+
+def test_reply_envelope(reply, reply_security):
+    """Tests :py:class:`pymco.message.Reply` de-serializes envelope once,
+    without decoding the body."""
+    assert reply[':senderid'] == 'mco1'
+    assert reply[':requestid'] == 'some-id'
+    reply_security.deserialize.assert_called_once_with('frame')
+    assert reply_security.deserialize_body.called is False
+
+
+def test_reply_mapping(reply, reply_security):
+    """Tests :py:class:`pymco.message.Reply` mapping interface."""
+    assert len(reply) == 3
+    assert dict(reply) == reply_security.deserialize.return_value
+
+
+def test_reply_body(reply, reply_security):
+    """Tests :py:attr:`pymco.message.Reply.body` decodes the body once."""
+    assert reply.body == reply_security.deserialize_body.return_value
+    assert reply.body == reply_security.deserialize_body.return_value
+    reply_security.deserialize_body.assert_called_once_with('serialized body')
+    reply_security.deserialize.assert_called_once_with('frame')
+
+
+def test_reply_body_none(reply, reply_security):
+    """Tests :py:attr:`pymco.message.Reply.body` caches falsy bodies."""
+    reply_security.deserialize_body.return_value = None
+    assert reply.body is None
+    assert reply.body is None
+    reply_security.deserialize_body.assert_called_once_with('serialized body')
+
+
+def test_reply_load(reply, reply_security):
+    """Tests :py:meth:`pymco.message.Reply.load` decodes eagerly."""
+    assert reply.load(body=False) is reply
+    reply_security.deserialize.assert_called_once_with('frame')
+    assert reply_security.deserialize_body.called is False
+    assert reply.load() is reply
+    reply_security.deserialize_body.assert_called_once_with('serialized body')
+    reply.load()
+    assert reply_security.deserialize.call_count == 1
+    assert reply_security.deserialize_body.call_count == 1
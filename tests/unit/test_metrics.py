@@ -0,0 +1,118 @@
+"""Tests for pymco.metrics"""
+import pytest
+from six.moves.urllib import request as urllib_request
+
+from pymco import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        metrics.Metric('foo', 'Foo.')
+
+
+def test_counter(registry):
+    counter = registry.counter('foo_total', 'Foo.')
+    counter.inc()
+    counter.inc(2)
+    assert counter.get() == 3
+    assert counter.expose() == ('# HELP foo_total Foo.\n'
+                                '# TYPE foo_total counter\n'
+                                'foo_total 3.0\n')
+
+
+def test_counter_only_increments(registry):
+    with pytest.raises(ValueError):
+        registry.counter('foo_total', 'Foo.').inc(-1)
+
+
+def test_gauge(registry):
+    gauge = registry.gauge('foo', 'Foo.')
+    gauge.inc(5)
+    gauge.dec(2)
+    assert gauge.get() == 3
+    gauge.set(1.5)
+    assert 'foo 1.5\n' in gauge.expose()
+
+
+def test_labels(registry):
+    counter = registry.counter('foo_total', 'Foo.', ('kind',))
+    counter.labels('reply').inc()
+    counter.labels(kind='reply').inc()
+    counter.labels(kind='request').inc()
+    assert counter.labels('reply') is counter.labels(kind='reply')
+    assert counter.expose().splitlines()[2:] == [
+        'foo_total{kind="reply"} 2.0',
+        'foo_total{kind="request"} 1.0',
+    ]
+
+
+def test_labels_required(registry):
+    counter = registry.counter('foo_total', 'Foo.', ('kind',))
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.labels('a', 'b')
+
+
+def test_label_escaping(registry):
+    counter = registry.counter('foo_total', 'Foo.', ('kind',))
+    counter.labels('a"b\\c\nd').inc()
+    assert 'foo_total{kind="a\\"b\\\\c\\nd"} 1.0' in counter.expose()
+
+
+def test_histogram(registry):
+    histogram = registry.histogram('foo_seconds', 'Foo.', buckets=(1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.sum == 14.5
+    assert histogram.expose().splitlines()[2:] == [
+        'foo_seconds_bucket{le="1.0"} 2.0',
+        'foo_seconds_bucket{le="5.0"} 3.0',
+        'foo_seconds_bucket{le="+Inf"} 4.0',
+        'foo_seconds_count 4.0',
+        'foo_seconds_sum 14.5',
+    ]
+
+
+def test_register_returns_existing(registry):
+    counter = registry.counter('foo_total', 'Foo.')
+    assert registry.counter('foo_total', 'Foo.') is counter
+    assert registry.get('foo_total') is counter
+    with pytest.raises(ValueError):
+        registry.gauge('foo_total', 'Foo.')
+
+
+def test_registry_expose(registry):
+    registry.gauge('b', 'B.')
+    registry.counter('a_total', 'A.')
+    output = registry.expose()
+    assert output.index('a_total') < output.index('# HELP b ')
+
+
+def test_default_registry():
+    output = metrics.exposition()
+    for name in ('pymco_messages_sent_total', 'pymco_messages_received_total',
+                 'pymco_messages_dropped_total',
+                 'pymco_verification_failures_total',
+                 'pymco_rpc_latency_seconds', 'pymco_rpc_replies',
+                 'pymco_rpc_in_flight', 'pymco_buffered_replies'):
+        assert '# TYPE {0} '.format(name) in output
+
+
+def test_start_http_server(registry):
+    registry.counter('foo_total', 'Foo.').inc()
+    server = metrics.start_http_server(0, '127.0.0.1', registry)
+    try:
+        response = urllib_request.urlopen('http://127.0.0.1:{0}/metrics'.format(
+            server.server_address[1]))
+        assert response.read().decode('utf8') == registry.expose()
+        assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+    finally:
+        server.shutdown()
+        server.server_close()
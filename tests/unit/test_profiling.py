@@ -0,0 +1,83 @@
+"""Tests for pymco.profiling"""
+import os
+import pstats
+
+import pytest
+
+from pymco import profiling
+from pymco.test.utils import mock
+
+
+class Profiled(object):
+    def __init__(self, config):
+        self.config = config
+
+    @profiling.profiled
+    def call(self, value):
+        return [value] * 1000
+
+
+@pytest.fixture
+def environ(request):
+    patcher = mock.patch.dict(os.environ)
+    patcher.start()
+    os.environ.pop(profiling.ENVIRONMENT_VARIABLE, None)
+    request.addfinalizer(patcher.stop)
+    return os.environ
+
+
+def test_get_profile_dir__disabled(config, environ):
+    assert profiling.get_profile_dir(config) is None
+
+
+def test_get_profile_dir__config(config, environ):
+    config.config[profiling.CONFIG_KEY] = '/tmp/profiles'
+    assert profiling.get_profile_dir(config) == '/tmp/profiles'
+
+
+def test_get_profile_dir__environment(config, environ):
+    config.config[profiling.CONFIG_KEY] = '/tmp/profiles'
+    environ[profiling.ENVIRONMENT_VARIABLE] = '/tmp/other'
+    assert profiling.get_profile_dir(config) == '/tmp/other'
+
+
+@mock.patch('pymco.profiling.CallProfile')
+def test_profiled__disabled(call_profile, config, environ):
+    assert Profiled(config).call(1) == [1] * 1000
+    assert call_profile.called is False
+
+
+def test_profiled(config, environ, tmpdir):
+    directory = str(tmpdir.join('profiles'))
+    environ[profiling.ENVIRONMENT_VARIABLE] = directory
+    assert Profiled(config).call(1) == [1] * 1000
+    assert Profiled(config).call(2) == [2] * 1000
+    files = sorted(os.listdir(directory))
+    assert len(files) == 6
+    assert all(name.startswith('Profiled.call-') for name in files)
+    profiles = [name for name in files if name.endswith('.prof')]
+    stats = pstats.Stats(os.path.join(directory, profiles[0]))
+    assert any(function[2] == 'call' for function in stats.stats)
+
+
+def test_profiled__writes_on_error(config, environ, tmpdir):
+    environ[profiling.ENVIRONMENT_VARIABLE] = str(tmpdir)
+
+    class Failing(Profiled):
+        @profiling.profiled
+        def call(self):
+            raise ValueError
+
+    with pytest.raises(ValueError):
+        Failing(config).call()
+    assert any(name.endswith('.prof') for name in os.listdir(str(tmpdir)))
+
+
+def test_call_profile__stops_tracemalloc(tmpdir):
+    tracemalloc = pytest.importorskip('tracemalloc')
+    with profiling.CallProfile(str(tmpdir), 'foo') as profile:
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+    snapshot = tracemalloc.Snapshot.load(profile.path + '.tracemalloc')
+    assert snapshot.traces is not None
+    assert os.path.exists(profile.path + '.allocations.txt')
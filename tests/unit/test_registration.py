@@ -0,0 +1,143 @@
+"""Tests for pymco.registration"""
+import pytest
+
+from pymco import exc
+from pymco import inventory
+from pymco import listener
+from pymco import registration
+from pymco.test.utils import mock
+
+
+@pytest.fixture
+def connector():
+    return mock.Mock()
+
+
+@pytest.fixture
+def store():
+    return inventory.Inventory()
+
+
+@pytest.fixture
+def security():
+    security_ = mock.Mock()
+    security_.verify.side_effect = lambda msg: msg
+    security_.deserialize.side_effect = lambda frame: {
+        ':senderid': frame,
+        ':body': {':identity': frame,
+                  ':agentlist': ['rpcutil'],
+                  ':facts': {'country': 'uk'},
+                  ':classes': ['apache']},
+    }
+    security_.deserialize_body.side_effect = lambda body: body
+    return security_
+
+
+@pytest.fixture
+def consumer(config, store, connector, security):
+    consumer_ = registration.RegistrationConsumer(config, store,
+                                                  batch_size=2,
+                                                  connector=connector)
+    consumer_._security = security
+    return consumer_
+
+
+def test_collective(config, store):
+    consumer = registration.RegistrationConsumer(config, store)
+    assert consumer.collective == 'mcollective'
+    config.config['registration_collective'] = 'sub1'
+    consumer = registration.RegistrationConsumer(config, store)
+    assert consumer.collective == 'sub1'
+    consumer = registration.RegistrationConsumer(config, store,
+                                                 collective='sub2')
+    assert consumer.collective == 'sub2'
+
+
+@mock.patch('pymco.config.Config.get_connector')
+def test_connector(get_connector, config, store):
+    consumer = registration.RegistrationConsumer(config, store)
+    assert consumer.connector == get_connector.return_value
+
+
+def test_get_target(consumer, connector):
+    assert consumer.get_target() == connector.get_target.return_value
+    connector.get_target.assert_called_once_with(agent='registration',
+                                                 collective='mcollective')
+
+
+def test_start(consumer, connector):
+    assert consumer.start() is consumer
+    connector.connect.assert_called_once_with(wait=True)
+    name, queue_listener = connector.add_listener.call_args[0]
+    assert name == 'registration'
+    assert isinstance(queue_listener, listener.QueueListener)
+    assert queue_listener.queue is consumer.queue
+    connector.subscribe.assert_called_once_with(
+        destination=connector.get_target.return_value)
+
+
+def test_stop(consumer, connector):
+    assert consumer.stop() is consumer
+    connector.disconnect.assert_called_once_with()
+
+
+def test_get_batch__timeout(consumer):
+    assert consumer.get_batch(timeout=0.01) == []
+
+
+def test_get_batch__batch_size(consumer):
+    for frame in ('node1', 'node2', 'node3'):
+        consumer.queue.put(frame)
+    assert consumer.get_batch() == ['node1', 'node2']
+    assert consumer.get_batch() == ['node3']
+
+
+def test_process_batch(consumer, store):
+    consumer.queue.put('node1')
+    consumer.queue.put('node2')
+    assert consumer.process_batch() == 2
+    assert store.get('node1')['classes'] == ['apache']
+    assert consumer.stats.as_dict()['stored'] == 2
+    assert consumer.stats.batches == 1
+
+
+def test_process_batch__empty(consumer):
+    assert consumer.process_batch(timeout=0.01) == 0
+    assert consumer.stats.batches == 0
+
+
+def test_process_batch__drops_failures(consumer, security, store):
+    def verify(msg):
+        if msg[':senderid'] == 'node1':
+            raise exc.VerificationError
+        return msg
+
+    security.verify.side_effect = verify
+    consumer.queue.put('node1')
+    consumer.queue.put('node2')
+    assert consumer.process_batch() == 1
+    assert consumer.stats.failed == 1
+    assert consumer.stats.received == 2
+    assert 'node2' in store
+
+
+def test_run__duration(consumer, connector):
+    consumer.queue.put('node1')
+    stats = consumer.run(duration=0.05, timeout=0.01)
+    assert stats.stored == 1
+    connector.subscribe.assert_called_once_with(
+        destination=connector.get_target.return_value)
+    connector.disconnect.assert_called_once_with()
+
+
+def test_stats_rate():
+    stats = registration.Stats()
+    with mock.patch('time.time', return_value=stats.started + 2):
+        stats.stored = 10
+        assert stats.rate == 5
+
+
+def test_queue_listener():
+    queue = mock.Mock()
+    listener.QueueListener(queue).on_message(headers={}, body='frame')
+    queue.put.assert_called_once_with('frame')
@@ -1,6 +1,11 @@
 """Tests for pymco.rpc"""
+import os
+
 import pytest
 
+from pymco import exc
+from pymco import metrics
+from pymco import profiling
 from pymco import rpc
 from pymco.test import ctxt
 from pymco.test.utils import mock
@@ -46,13 +51,169 @@ class TestSimpleActionCall():
         connector.subscribe.assert_called_with(
             destination=reply_target)
 
+    def test_it_subscribes_with_flow_control(self, connector, simple_action):
+        connector.get_reply_subscription_headers.return_value = {
+            'ack': 'client-individual', 'activemq.prefetchSize': '10'}
+        simple_action.call()
+        connector.subscribe.assert_called_with(
+            destination=simple_action.get_reply_target(),
+            **{'ack': 'client-individual', 'activemq.prefetchSize': '10'})
+
+    def test_sends_message_headers(self, connector, simple_action, msg):
+        connector.get_message_headers.return_value = {'expires': 1000}
+        simple_action.call()
+        connector.get_message_headers.assert_called_once_with(msg)
+        connector.send_encoded.assert_called_once_with(
+            mock.ANY, simple_action.get_target(),
+            **{'expires': 1000,
+               'reply-to': simple_action.get_reply_target()})
+
+    def test_sends_priority(self, connector, config, msg):
+        simple_action = rpc.SimpleAction(agent=ctxt.MSG['agent'],
+                                         config=config, msg=msg, priority=9)
+        simple_action.call()
+        assert connector.send_encoded.call_args[1]['priority'] == 9
+
     def test_sends_msg(self, connector, simple_action, msg):
         simple_action.call()
         target = simple_action.get_target()
         reply_target = simple_action.get_reply_target()
-        connector.send.assert_called_with(msg,
-                                          target,
-                                          **{'reply-to': reply_target})
+        security = connector.security
+        security.sign.assert_called_once_with(msg)
+        security.serialize.assert_called_once_with(
+            security.sign.return_value)
+        connector.send_encoded.assert_called_with(
+            security.serialize.return_value,
+            target,
+            **{'reply-to': reply_target})
+
+    def test_returns_result(self, connector, simple_action):
+        connector.receive.return_value = ['reply']
+        result = simple_action.call()
+        assert result == ['reply']
+        assert isinstance(result, rpc.Result)
+        assert result.timing is simple_action.timing
+
+    def test_times_phases(self, connector, simple_action):
+        timing = simple_action.call().timing
+        for phase in ('resolve', 'connect', 'subscribe', 'sign', 'serialize',
+                      'publish', 'disconnect', 'total'):
+            assert getattr(timing, phase) >= 0
+        assert timing.total >= timing.connect + timing.publish
+
+    def test_times_replies(self, connector, simple_action):
+        replies = [mock.Mock(received_at=None), mock.Mock(received_at=None)]
+        connector.receive.return_value = replies
+        with mock.patch('timeit.default_timer') as timer:
+            timer.return_value = 10.0
+            replies[0].received_at = 10.5
+            replies[1].received_at = 12.0
+            timing = simple_action.call().timing
+        assert timing.replies == 2
+        assert timing.first_reply == 0.5
+        assert timing.last_reply == 2.0
+
+    def test_gathers_expected_replies(self, connector, simple_action):
+        replies = [mock.Mock(received_at=None) for _ in range(3)]
+        connector.receive.side_effect = [replies[:1], replies[1:]]
+        with mock.patch('timeit.default_timer') as timer:
+            timer.return_value = 10.0
+            for reply, received_at in zip(replies, (10.5, 11.0, 13.0)):
+                reply.received_at = received_at
+            result = simple_action.call(expected=3)
+        assert result == replies
+        assert connector.receive.call_count == 2
+        assert result.timing.first_reply == 0.5
+        assert result.timing.last_reply == 3.0
+
+    def test_gathers_replies_until_timeout(self, connector, simple_action):
+        connector.receive.side_effect = [['foo'], ['bar'], exc.TimeoutError]
+        assert simple_action.call(expected=None) == ['foo', 'bar']
+        assert connector.receive.call_count == 3
+        assert connector.receive.call_args[1]['timeout'] <= 5
+
+    def test_gathers_replies__connection_lost(self, connector,
+                                              simple_action):
+        connector.receive.side_effect = [['foo'], exc.ConnectionLostError]
+        assert simple_action.call(expected=2) == ['foo']
+        assert connector.send_encoded.call_count == 1
+
+    def test_decode(self, connector, simple_action):
+        reply = mock.Mock(received_at=None)
+        connector.receive.return_value = [reply]
+        timing = simple_action.call(decode=True).timing
+        connector.security.verify.assert_called_once_with(reply)
+        assert len(timing.decode) == len(timing.verify) == 1
+
+    def test_no_decode_by_default(self, connector, simple_action):
+        connector.receive.return_value = [mock.Mock(received_at=None)]
+        timing = simple_action.call().timing
+        assert connector.security.verify.called is False
+        assert timing.decode == timing.verify == []
+
+    def test_accounts_metrics(self, connector, simple_action):
+        connector.receive.side_effect = [[mock.Mock(received_at=None)]] * 3
+        latency, fanin = metrics.RPC_LATENCY.count, metrics.REPLY_FANIN.sum
+        in_flight = metrics.IN_FLIGHT.get()
+        simple_action.call(expected=3)
+        assert metrics.RPC_LATENCY.count == latency + 1
+        assert metrics.REPLY_FANIN.sum == fanin + 3
+        assert metrics.IN_FLIGHT.get() == in_flight
+
+    def test_traced(self, connector, simple_action, msg, tracing_hook):
+        connector.receive.return_value = [mock.Mock(received_at=None)]
+        simple_action.call()
+        names = [call[0][0] for call in tracing_hook.start.call_args_list]
+        assert names == ['rpc.call', 'security.encode']
+        attributes = tracing_hook.end.call_args_list[-1][0][1]
+        assert attributes['agent'] == simple_action.agent
+        assert attributes['requestid'] == msg[':requestid']
+        assert attributes['replies'] == 1
+
+    def test_profiled(self, connector, simple_action, tmpdir):
+        environ = {profiling.ENVIRONMENT_VARIABLE: str(tmpdir)}
+        with mock.patch.dict('os.environ', environ):
+            simple_action.call()
+        assert any(name.startswith('SimpleAction.call-') and
+                   name.endswith('.prof') for name in os.listdir(str(tmpdir)))
+
+    def test_timing_hooks(self, connector, config, msg):
+        hook, global_hook = mock.Mock(), mock.Mock()
+        rpc.timing_hooks.append(global_hook)
+        try:
+            action = rpc.SimpleAction(config, msg, 'foo', timing_hook=hook)
+            action.call()
+        finally:
+            rpc.timing_hooks.remove(global_hook)
+        hook.assert_called_once_with(action.timing)
+        global_hook.assert_called_once_with(action.timing)
+
+    def test_timing_hook_errors_are_ignored(self, connector, config, msg):
+        hook = mock.Mock(side_effect=ValueError)
+        action = rpc.SimpleAction(config, msg, 'foo', timing_hook=hook)
+        assert action.call() is not None
+        assert hook.called
+
+    def test_timing_hooks_on_failure(self, connector, config, msg):
+        hook = mock.Mock()
+        connector.receive.side_effect = RuntimeError
+        action = rpc.SimpleAction(config, msg, 'foo', timing_hook=hook)
+        with pytest.raises(RuntimeError):
+            action.call()
+        hook.assert_called_once_with(action.timing)
+        assert action.timing.total is not None
+
+    def test_unsubscribes_reply(self, connector, simple_action):
+        simple_action.call()
+        connector.unsubscribe.assert_called_once_with(
+            simple_action.get_reply_target())
+
+    def test_unsubscribes_reply__on_timeout(self, connector, simple_action):
+        connector.receive.side_effect = exc.TimeoutError
+        with pytest.raises(exc.TimeoutError):
+            simple_action.call()
+        connector.unsubscribe.assert_called_once_with(
+            simple_action.get_reply_target())
 
     def test_disconnects(self, connector, simple_action):
         simple_action.call()
@@ -66,6 +227,27 @@ class TestSimpleActionCall():
         simple_action.call(timeout=10)
         connector.receive.assert_called_once_with(timeout=10)
 
+    def test_resends_on_connection_lost(self, connector, simple_action):
+        connector.receive.side_effect = [exc.ConnectionLostError, ['reply']]
+        assert simple_action.call() == ['reply']
+        connector.reconnect.assert_called_once_with(wait=True)
+        assert connector.send_encoded.call_count == 2
+        assert connector.receive.call_args_list[1][1]['timeout'] <= 5
+
+    def test_resends_once(self, connector, simple_action):
+        connector.receive.side_effect = exc.ConnectionLostError
+        with pytest.raises(exc.ConnectionLostError):
+            simple_action.call()
+        assert connector.receive.call_count == 2
+        assert connector.send_encoded.call_count == 2
+
+    def test_no_resends(self, connector, config, msg):
+        action = rpc.SimpleAction(config, msg, 'rpcutil', resends=0)
+        connector.receive.side_effect = exc.ConnectionLostError
+        with pytest.raises(exc.ConnectionLostError):
+            action.call()
+        assert connector.reconnect.called is False
+
     def test_get_target_delegates_connector(self, connector, simple_action):
         assert simple_action.get_target() == connector.get_target.return_value
         connector.get_target.assert_called_once_with(
@@ -80,3 +262,16 @@ class TestSimpleActionCall():
             collective=simple_action.collective,
             agent=simple_action.agent,
         )
+
+
+def test_call_timing_as_dict():
+    timing = rpc.CallTiming()
+    with timing.measure('connect'):
+        pass
+    timing.decode.append(0.1)
+    result = timing.as_dict()
+    assert result['connect'] >= 0
+    assert result['publish'] is None
+    assert result['decode'] == [0.1]
+    assert result['replies'] == 0
+    assert 'connect=' in repr(timing)
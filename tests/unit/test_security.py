@@ -60,3 +60,26 @@ def test_decode(verify, sec_provider, msg):
     sec_provider.serializer.deserialize.assert_called_once_with(msg)
     verify.assert_called_once_with(
         sec_provider.serializer.deserialize.return_value)
+
+
+def test_encode__traced(sec_provider, tracing_hook):
+    sec_provider.serializer.serialize.return_value = 'encoded'
+    sec_provider.encode({':agent': 'foo', ':collective': 'mcollective',
+                         ':requestid': 'bar', ':body': 'spam'})
+    tracing_hook.end.assert_called_once_with(
+        tracing_hook.start.return_value,
+        {'agent': 'foo', 'collective': 'mcollective', 'requestid': 'bar',
+         'bytes': 7}, None)
+
+
+def test_decode__traced(sec_provider, tracing_hook):
+    sec_provider.serializer.deserialize.return_value = {':agent': 'foo'}
+    with mock.patch.object(FakeProvider, 'verify', side_effect=lambda x: x):
+        sec_provider.decode('message')
+    tracing_hook.end.assert_called_once_with(
+        tracing_hook.start.return_value, {'bytes': 7, 'agent': 'foo'}, None)
+
+
+def test_deserialize_body(sec_provider):
+    assert sec_provider.deserialize_body('body') == 'body'
+    assert sec_provider.serializer.deserialize.called is False
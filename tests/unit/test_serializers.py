@@ -2,9 +2,30 @@
 import pytest
 
 from pymco import serializers
+from pymco.test.utils import mock
 
 
 def test_serializer_can_not_be_instantiated():
     """Tests pymco.serializers.SerializerBase  can't be instantiated."""
     with pytest.raises(TypeError):
         serializers.SerializerBase()
+
+
+def test_serializer_plugins():
+    """Tests all shipped serializers are registered as plugins."""
+    assert sorted(serializers.SerializerBase.plugins) == ['json',
+                                                          'msgpack',
+                                                          'yaml']
+
+
+def test_to_dict__uses_msg_to_dict():
+    """Tests pymco.serializers.to_dict asks messages for their dict."""
+    msg = mock.Mock()
+    assert serializers.to_dict(msg) == msg.to_dict.return_value
+
+
+def test_to_dict__copies_mappings():
+    """Tests pymco.serializers.to_dict copies plain mappings."""
+    msg = {':body': 'ping'}
+    assert serializers.to_dict(msg) == msg
+    assert serializers.to_dict(msg) is not msg
@@ -0,0 +1,381 @@
+"""Tests for pymco.server"""
+import threading
+import time
+
+import pytest
+
+from pymco import message
+from pymco import metrics
+from pymco import server
+from pymco.security import none
+from pymco.test.utils import mock
+
+
+class Echo(server.RPCAgent):
+    name = 'echo'
+
+    def echo(self, data, request):
+        return data
+
+    def abort(self, data, request):
+        raise server.RPCError('aborted')
+
+    def fail(self, data, request):
+        raise ValueError('failed')
+
+
+class SyncPool(object):
+    """Pool running tasks right away."""
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def submit(self, fnc, args=(), callback=None):
+        callback(fnc(*args))
+
+
+@pytest.fixture
+def connector():
+    return mock.Mock(**{'get_direct_subscription.return_value': None})
+
+
+@pytest.fixture
+def security(config):
+    return none.NoneProvider(config)
+
+
+@pytest.fixture
+def mcollectived(config, connector, security):
+    server_ = server.Server(config,
+                            agents=[Echo()],
+                            pool=SyncPool(),
+                            connector=connector,
+                            facts={'country': 'uk', 'processorcount': '8'},
+                            classes=['apache', 'common::linux'])
+    server_._security = security
+    return server_
+
+
+@pytest.fixture
+def request_(config, security):
+    msg = message.Message(body={':action': 'echo', ':data': {'foo': 'spam'}},
+                          agent='echo',
+                          config=config)
+    return msg
+
+
+def encode(security, msg):
+    return security.encode(msg)
+
+
+@pytest.mark.parametrize('action,code,data', (
+    ('echo', server.OK, {'foo': 'spam'}),
+    ('missing', server.UNKNOWN_RPC_ACTION, {}),
+    ('handle', server.UNKNOWN_RPC_ACTION, {}),
+    ('_private', server.UNKNOWN_RPC_ACTION, {}),
+    ('abort', server.RPC_ABORTED, {}),
+    ('fail', server.UNKNOWN_RPC_ERROR, {}),
+))
+def test_rpc_agent(action, code, data):
+    reply = Echo().handle({':action': action, ':data': {'foo': 'spam'}}, {})
+    assert reply[':statuscode'] == code
+    assert reply[':data'] == data
+
+
+def test_agent_is_abstract():
+    with pytest.raises(TypeError):
+        server.Agent()
+
+
+def test_discovery_agent():
+    assert server.DiscoveryAgent().handle('ping', {}) == 'pong'
+
+
+def test_rpc_agent__failure_logged():
+    with mock.patch.object(server.logger, 'exception') as exception:
+        reply = Echo().handle({':action': 'fail'}, {})
+    assert isinstance(reply, server.AgentFailure)
+    assert exception.called
+
+
+def test_run_agent__error_reply():
+    agent = mock.Mock(**{'handle.side_effect': ValueError('boom')})
+    with mock.patch.object(server.logger, 'exception') as exception:
+        reply = server.run_agent(agent, 'body', {':requestid': 'foo'})
+    assert isinstance(reply, server.AgentFailure)
+    assert reply == {':statuscode': server.UNKNOWN_RPC_ERROR,
+                     ':statusmsg': 'boom', ':data': {}}
+    assert exception.called
+
+
+def test_worker_pool():
+    pool = server.WorkerPool(size=2, backlog=2).start()
+    results = []
+    done = threading.Event()
+
+    def callback(result):
+        results.append(result)
+        if len(results) == 3:
+            done.set()
+
+    for value in range(3):
+        pool.submit(lambda value: value * 2, (value,), callback)
+
+    assert done.wait(5)
+    pool.stop()
+    assert sorted(results) == [0, 2, 4]
+    assert pool.threads == []
+
+
+def test_worker_pool__counts_failures():
+    pool = server.WorkerPool(size=1, backlog=2).start()
+    failures = metrics.TASK_FAILURES.get()
+    done = threading.Event()
+    pool.submit(lambda: 1 / 0)
+    pool.submit(done.set)
+    assert done.wait(5)
+    pool.stop()
+    assert pool.failed == 1
+    assert metrics.TASK_FAILURES.get() == failures + 1
+
+
+def test_process_worker_pool():
+    pool = server.ProcessWorkerPool(size=1, backlog=2).start()
+    results = []
+    pool.submit(server.run_agent, (server.DiscoveryAgent(), 'ping', {}),
+                results.append)
+    pool.stop()
+    assert results == ['pong']
+
+
+def test_process_worker_pool__releases_failed_tasks():
+    pool = server.ProcessWorkerPool(size=1, backlog=1).start()
+    failures = metrics.TASK_FAILURES.get()
+    results = []
+    pool.submit(divmod, (1, 0), results.append)
+    pool.submit(divmod, (7, 2), results.append)
+    pool.stop()
+    assert results == [(3, 1)]
+    assert pool.failed == 1
+    assert metrics.TASK_FAILURES.get() == failures + 1
+
+
+def test_process_worker_pool__py2_outcome():
+    assert server._run_task(divmod, 7, 2) == (False, (3, 1))
+    failed, error = server._run_task(divmod, 1, 0)
+    assert failed and isinstance(error, ZeroDivisionError)
+
+
+def test_load_facts(config, tmpdir):
+    facts1, facts2 = tmpdir.join('facts1.yaml'), tmpdir.join('facts2.yaml')
+    facts1.write('country: uk\nos: Debian\n')
+    facts2.write('os: RedHat\n')
+    config.config['plugin.yaml'] = '{0}:{1}:/missing'.format(facts1, facts2)
+    assert server.load_facts(config) == {'country': 'uk', 'os': 'RedHat'}
+
+
+def test_load_facts__other_source(config):
+    config.config['factsource'] = 'facter'
+    assert server.load_facts(config) == {}
+
+
+def test_load_classes(config, tmpdir):
+    classes = tmpdir.join('classes.txt')
+    classes.write('apache\n\ncommon::linux\n')
+    config.config['classesfile'] = str(classes)
+    assert server.load_classes(config) == ['apache', 'common::linux']
+    config.config['classesfile'] = str(tmpdir.join('missing.txt'))
+    assert server.load_classes(config) == []
+
+
+def test_collectives(mcollectived):
+    assert mcollectived.collectives == ['mcollective', 'sub1', 'sub2']
+
+
+def test_registers_discovery(mcollectived):
+    assert sorted(mcollectived.agents) == ['discovery', 'echo']
+
+
+@mock.patch('pymco.config.Config.get_server_security')
+def test_security(get_server_security, config, connector):
+    server_ = server.Server(config, connector=connector, facts={},
+                            classes=[])
+    assert server_.security == get_server_security.return_value
+
+
+def test_get_subscriptions(mcollectived, connector):
+    connector.get_target.side_effect = '{agent}@{collective}'.format
+    connector.get_direct_subscription.side_effect = (
+        lambda collective: ('direct@' + collective, {'selector': 'foo'}))
+    assert mcollectived.get_subscriptions()[:3] == [
+        ('discovery@mcollective', {}),
+        ('echo@mcollective', {}),
+        ('direct@mcollective', {'selector': 'foo'}),
+    ]
+    assert len(mcollectived.get_subscriptions()) == 9
+
+
+def test_start_and_stop(mcollectived, connector):
+    connector.get_target.side_effect = '{agent}@{collective}'.format
+    assert mcollectived.start() is mcollectived
+    connector.connect.assert_called_once_with(wait=True)
+    assert [call[0][0] for call in
+            connector.add_listener.call_args_list] == [
+        'server', 'server_lost']
+    assert connector.subscribe.call_args_list[0] == mock.call(
+        'discovery@mcollective')
+    assert connector.subscribe.call_count == 6
+    assert mcollectived.stop() is mcollectived
+    assert sorted(connector.unsubscribe.call_args_list) == sorted(
+        mock.call(call[0][0]) for call in connector.subscribe.call_args_list)
+    connector.disconnect.assert_called_once_with()
+
+
+@pytest.mark.parametrize('filter_,result', (
+    (message.Filter(), True),
+    (message.Filter().add_agent('echo'), True),
+    (message.Filter().add_agent('/^ec/'), True),
+    (message.Filter().add_agent('package'), False),
+    (message.Filter().add_cfclass('apache'), True),
+    (message.Filter().add_cfclass('nginx'), False),
+    (message.Filter().add_fact('country', 'uk'), True),
+    (message.Filter().add_fact('processorcount', '4', '>'), True),
+    (message.Filter().add_fact('country', 'us'), False),
+    (message.Filter().add_identity('foo').add_identity('mco1'), True),
+    (message.Filter().add_identity('/^mco/'), True),
+    (message.Filter().add_identity('foo'), False),
+    (message.Filter().add_compound('apache and country=uk'), True),
+    (message.Filter().add_compound('apache and country=us'), False),
+))
+def test_matches(mcollectived, filter_, result):
+    assert mcollectived.matches(dict(filter_)) is result
+
+
+def test_on_request(mcollectived, connector, security, request_):
+    assert mcollectived.on_request({'reply-to': '/queue/reply'},
+                                   encode(security, request_)) is True
+    body, destination = connector.send_encoded.call_args[0]
+    assert destination == '/queue/reply'
+    reply = security.decode(body)
+    assert reply[':senderid'] == 'mco1'
+    assert reply[':senderagent'] == 'echo'
+    assert reply[':requestid'] == request_[':requestid']
+    assert reply[':body'][':data'] == {'foo': 'spam'}
+    assert mcollectived.stats['replied'] == 1
+
+
+def test_on_request__reply_target_fallback(mcollectived, connector, security,
+                                           request_):
+    mcollectived.on_request({}, encode(security, request_))
+    connector.get_reply_target.assert_called_once_with(
+        agent='echo', collective='mcollective')
+    assert (connector.send_encoded.call_args[0][1] ==
+            connector.get_reply_target.return_value)
+
+
+def test_on_request__unknown_agent(mcollectived, connector, security,
+                                   request_):
+    request_[':agent'] = 'package'
+    assert mcollectived.on_request({}, encode(security, request_)) is False
+    assert mcollectived.stats['filtered'] == 1
+    assert connector.send_encoded.called is False
+
+
+def test_on_request__filtered(mcollectived, security, request_):
+    request_[':filter'] = message.Filter().add_cfclass('nginx')
+    assert mcollectived.on_request({}, encode(security, request_)) is False
+    assert mcollectived.stats['filtered'] == 1
+
+
+def test_on_request__expired(mcollectived, security, request_):
+    request_[':msgtime'] = int(time.time()) - 100
+    request_[':ttl'] = 60
+    dropped = metrics.MESSAGES_DROPPED.labels('expired').get()
+    assert mcollectived.on_request({}, encode(security, request_)) is False
+    assert mcollectived.stats['expired'] == 1
+    assert metrics.MESSAGES_DROPPED.labels('expired').get() == dropped + 1
+
+
+def test_on_request__unverified(mcollectived, security, request_):
+    frame = encode(security, request_)
+    with mock.patch.object(security, 'verify', side_effect=ValueError):
+        assert mcollectived.on_request({}, frame) is False
+    assert mcollectived.stats['unverified'] == 1
+
+
+@pytest.mark.parametrize('frame', (
+    b'{foo: [',
+    b'--- spam\n',
+    b'--- {":agent": "echo"}\n',
+))
+def test_on_request__invalid(mcollectived, connector, frame):
+    dropped = metrics.MESSAGES_DROPPED.labels('invalid').get()
+    assert mcollectived.on_request({}, frame) is False
+    assert mcollectived.stats['invalid'] == 1
+    assert metrics.MESSAGES_DROPPED.labels('invalid').get() == dropped + 1
+    assert connector.send_encoded.called is False
+
+
+def test_on_connection_lost__reconnects(mcollectived, connector):
+    connector.is_connected.return_value = False
+    reconnected = threading.Event()
+    connector.reconnect.side_effect = lambda wait: reconnected.set()
+    mcollectived.on_connection_lost()
+    assert reconnected.wait(5)
+    connector.reconnect.assert_called_once_with(wait=True)
+
+
+def test_reconnect__skipped_when_connected_or_stopped(mcollectived,
+                                                      connector):
+    connector.is_connected.return_value = True
+    mcollectived.reconnect()
+    connector.is_connected.return_value = False
+    mcollectived._stopped.set()
+    mcollectived.reconnect()
+    mcollectived.on_connection_lost()
+    assert connector.reconnect.called is False
+
+
+def test_reply__no_body(mcollectived, connector):
+    mcollectived.reply({}, {}, None)
+    assert connector.send_encoded.called is False
+    assert mcollectived.stats['processed'] == 1
+
+
+def test_reply__agent_failure(mcollectived, connector, request_):
+    failures = metrics.TASK_FAILURES.get()
+    body = server.AgentFailure(
+        server.RPCAgent.reply(server.UNKNOWN_RPC_ERROR, 'boom'))
+    with mock.patch('pymco.server.build_reply',
+                    wraps=server.build_reply) as build_reply:
+        mcollectived.reply(dict(request_), {'reply-to': '/queue/replies'},
+                           body)
+    reply_body = build_reply.call_args[0][2]
+    assert type(reply_body) is dict
+    assert reply_body[':statuscode'] == server.UNKNOWN_RPC_ERROR
+    assert connector.send_encoded.called
+    assert mcollectived.stats['failed'] == 1
+    assert metrics.TASK_FAILURES.get() == failures + 1
+
+
+def test_run__duration(mcollectived, connector):
+    mcollectived.run(duration=0.01)
+    connector.disconnect.assert_called_once_with()
+
+
+def test_register__updates_matcher(mcollectived):
+    filter_ = {'agent': ['rpcutil']}
+    assert mcollectived.matches(filter_) is False
+    rpcutil = Echo()
+    rpcutil.name = 'rpcutil'
+    mcollectived.register(rpcutil)
+    assert mcollectived.matches(filter_) is True
+
+
+def test_on_request__filtered_before_body(mcollectived, security, request_):
+    request_[':filter'] = message.Filter().add_identity('mco2')
+    with mock.patch.object(security, 'deserialize_body') as deserialize_body:
+        assert mcollectived.on_request({}, encode(security, request_)) is False
+    assert deserialize_body.called is False
@@ -0,0 +1,67 @@
+"""Tests for pymco.tracing"""
+import pytest
+
+from pymco import tracing
+from pymco.test.utils import mock
+
+
+@pytest.fixture
+def hook(tracing_hook):
+    return tracing_hook
+
+
+def test_noop_span_by_default():
+    with tracing.span('foo', bar=1) as span:
+        span.set('spam', 2)
+        span.update({'eggs': 3})
+    assert span is tracing.NOOP_SPAN
+    assert not span
+
+
+def test_span(hook):
+    with tracing.span('foo', bar=1) as span:
+        assert span
+        hook.start.assert_called_once_with('foo', {'bar': 1})
+        assert hook.end.called is False
+        span.set('spam', 2)
+    hook.end.assert_called_once_with(hook.start.return_value,
+                                     {'bar': 1, 'spam': 2}, None)
+
+
+def test_span_error(hook):
+    error = ValueError()
+    with pytest.raises(ValueError):
+        with tracing.span('foo'):
+            raise error
+    hook.end.assert_called_once_with(hook.start.return_value, {}, error)
+
+
+def test_hook_errors_are_ignored(hook):
+    hook.start.side_effect = RuntimeError
+    other = tracing.add_hook(mock.Mock())
+    try:
+        with tracing.span('foo'):
+            pass
+    finally:
+        tracing.remove_hook(other)
+    assert hook.end.called is False
+    assert other.end.called
+
+
+def test_hooks_end_in_reverse_order(hook):
+    calls = []
+    hook.end.side_effect = lambda *args: calls.append('first')
+    other = tracing.add_hook(mock.Mock())
+    other.end.side_effect = lambda *args: calls.append('second')
+    try:
+        with tracing.span('foo'):
+            pass
+    finally:
+        tracing.remove_hook(other)
+    assert calls == ['second', 'first']
+
+
+def test_message_attributes():
+    assert tracing.message_attributes({':agent': 'foo', ':requestid': 'bar',
+                                       ':body': 'spam'}) == {
+        'agent': 'foo', 'requestid': 'bar'}